@@ -0,0 +1,5 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
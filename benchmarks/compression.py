@@ -0,0 +1,114 @@
+"""Benchmark bandwidth and latency tradeoff of request body compression at different payload sizes
+
+Usage: python -m benchmarks.compression [--sizes 1000,10000,100000] [--bandwidths 0,10,1] [--output results.json]
+"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import argparse
+from json import dumps
+import platform
+import random
+import sys
+import time
+
+from promailgate_client import PromailgateClient
+
+from benchmarks.server import ServerProcess
+
+API_KEY = 'benchmark-api-key'
+
+# Compression levels to compare, with None being uncompressed
+LEVELS = (None, 1, 6, 9)
+
+
+def generate_data(size, seed=0):
+    """Return send data of approximately size bytes when encoded, made of
+    rendered HTML fragments and lists, as found in campaign payloads"""
+    generator = random.Random(seed)
+    words = ['offer', 'discount', 'account', 'order', 'delivery', 'product', 'summer', 'sale', 'new', 'your']
+    data = {'name': 'Benchmark User', 'fragments': [], 'products': []}
+    encoded_size = len(dumps(data))
+    while encoded_size < size:
+        fragment = '<tr><td class="product-%s"><a href="https://example.com/p/%s">%s</a></td><td>%s</td></tr>' % (
+            generator.randint(0, 1000), generator.randint(0, 100000),
+            ' '.join(generator.choice(words) for _ in range(6)), '%.2f' % (generator.random() * 100))
+        product = {'id': generator.randint(0, 100000), 'title': ' '.join(generator.choice(words) for _ in range(4)),
+                   'price': round(generator.random() * 100, 2)}
+        data['fragments'].append(fragment)
+        data['products'].append(product)
+        encoded_size += len(dumps(fragment)) + len(dumps(product)) + 4
+    return data
+
+
+def run_case(url, size, level, messages):
+    """Send messages with payload of size bytes at compression level, returning dict of results"""
+    data = generate_data(size)
+    client = PromailgateClient(
+        url=url, default_api_key=API_KEY, transport='http.client',
+        compress_threshold=None if level is None else 0, compress_level=level or 6)
+    uncompressed = client._serializer.dumps(client._build_send_payload('user@example.com', None, data, True))
+    body, _ = client._get_send_request(uncompressed)
+
+    latencies = []
+    cpu_start = time.process_time()
+    with client:
+        for index in range(messages):
+            start = time.perf_counter()
+            client.send_email('user%s@example.com' % index, data=data)
+            latencies.append(time.perf_counter() - start)
+    cpu_time = time.process_time() - cpu_start
+
+    latencies.sort()
+    return {
+        'payload_bytes': size,
+        'compress_level': level,
+        'uncompressed_bytes': len(uncompressed),
+        'body_bytes': len(body),
+        'ratio': len(uncompressed) / float(len(body)),
+        'latency_p50_ms': latencies[len(latencies) // 2] * 1000,
+        'cpu_per_message_us': cpu_time / messages * 1e6,
+    }
+
+
+def main(argv=None):
+    """Run benchmarks and output results as JSON"""
+    parser = argparse.ArgumentParser(description='Benchmark request body compression')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000', help='Comma-separated payload sizes, in bytes')
+    parser.add_argument('--bandwidths', default='0,100,10',
+                        help='Comma-separated simulated upload bandwidths in Mbit/s (0 for unlimited)')
+    parser.add_argument('--messages', type=int, default=50, help='Messages to send per case')
+    parser.add_argument('--output', help='File to write JSON results to (default: stdout)')
+    args = parser.parse_args(argv)
+
+    results = []
+    for bandwidth in [float(value) for value in args.bandwidths.split(',')]:
+        with ServerProcess(bandwidth=bandwidth * 125000 or None) as server:
+            for size in [int(value) for value in args.sizes.split(',')]:
+                for level in LEVELS:
+                    result = run_case(server.url, size, level, args.messages)
+                    result['bandwidth_mbit'] = bandwidth
+                    sys.stderr.write(
+                        '%(bandwidth_mbit)6.0fMbit %(payload_bytes)9d bytes  level %(level)-4s  body %(body_bytes)9d '
+                        'bytes  ratio %(ratio)5.1f  p50 %(latency_p50_ms)8.2fms  cpu %(cpu_per_message_us)8.1fus/msg\n'
+                        % dict(result, level=level or '-'))
+                    results.append(result)
+
+    output = dumps({
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Benchmark cold start: import time of the client and time to first send in a new interpreter
+
+Usage: python -m benchmarks.import_time [--runs N] [--output results.json]
+"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import argparse
+from json import dumps, loads
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+from benchmarks.server import ServerProcess
+
+# Run in a new interpreter, timing import, client creation and first send
+COLD_START_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import promailgate_client
+imported = time.perf_counter()
+client = promailgate_client.PromailgateClient(url=sys.argv[1], default_api_key='benchmark-api-key',
+                                              transport=sys.argv[2])
+if sys.argv[3] == 'warmup':
+    client.warmup(connections=1)
+created = time.perf_counter()
+client.send_email('user@example.com', data={'name': 'Benchmark'})
+sent = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'create_ms': (created - imported) * 1000,
+    'first_send_ms': (sent - created) * 1000,
+    'total_ms': (sent - start) * 1000,
+    'modules': sorted(name for name in ('requests', 'http.client', 'concurrent.futures', 'orjson')
+                      if name in sys.modules),
+}))
+'''
+
+
+def get_import_breakdown(limit=10):
+    """Return the slowest modules imported by promailgate_client, using -X importtime"""
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import promailgate_client'],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    modules = []
+    # Lines are formatted as "import time: <self us> | <cumulative us> | <module>", after a header
+    for line in output.splitlines()[1:]:
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+        modules.append({
+            'module': name.strip(),
+            'self_us': int(self_us),
+            'cumulative_us': int(cumulative_us),
+        })
+    return sorted(modules, key=lambda module: module['cumulative_us'], reverse=True)[:limit]
+
+
+def run_cold_start(url, transport, warmup, runs):
+    """Run cold start script in new interpreters, returning median timings"""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', COLD_START_SCRIPT, url, transport, 'warmup' if warmup else ''],
+            universal_newlines=True, env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'))
+        samples.append(loads(output))
+
+    result = {
+        'transport': transport,
+        'warmup': warmup,
+        'runs': runs,
+        'modules_loaded': samples[-1]['modules'],
+    }
+    for key in ('import_ms', 'create_ms', 'first_send_ms', 'total_ms'):
+        result[key] = statistics.median(sample[key] for sample in samples)
+    return result
+
+
+def main(argv=None):
+    """Run benchmark and output results as JSON"""
+    parser = argparse.ArgumentParser(description='Benchmark Promailgate client import time and cold start')
+    parser.add_argument('--runs', type=int, default=10, help='Interpreters to start per configuration')
+    parser.add_argument('--output', help='File to write JSON results to (default: stdout)')
+    args = parser.parse_args(argv)
+
+    results = []
+    with ServerProcess() as server:
+        for transport in ('requests', 'http.client'):
+            for warmup in (False, True):
+                result = run_cold_start(server.url, transport, warmup, args.runs)
+                sys.stderr.write('%(transport)-12s warmup=%(warmup)-5s import %(import_ms)6.1fms  '
+                                 'create %(create_ms)6.1fms  first send %(first_send_ms)6.1fms  '
+                                 'total %(total_ms)6.1fms\n' % result)
+                results.append(result)
+
+    output = dumps({
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'slowest_imports': get_import_breakdown(),
+        'results': results
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
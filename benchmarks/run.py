@@ -0,0 +1,263 @@
+"""Benchmark send throughput and latency of the client against a local stand-in server
+
+Usage: python -m benchmarks.run [--messages N] [--latency SECONDS] [--output results.json]
+
+Each mode is run in a new interpreter, so that its peak memory is not affected by earlier modes.
+"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps, loads
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from promailgate_client import PromailgateClient
+
+from benchmarks.server import ServerProcess
+
+API_KEY = 'benchmark-api-key'
+
+
+def _get_recipients(messages):
+    """Return recipients for benchmark"""
+    return ['user%s@example.com' % i for i in range(messages)]
+
+
+def _timed(send, latencies):
+    """Wrap send function, recording the latency of each call"""
+    def timed_send(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return send(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return timed_send
+
+
+def run_sequential(url, messages, concurrency, latencies):
+    """Send one message at a time, opening a new connection for each"""
+    for recipient in _get_recipients(messages):
+        with PromailgateClient(url=url, default_api_key=API_KEY) as client:
+            _timed(client.send_email, latencies)(recipient, data={'name': 'Benchmark'})
+
+
+def run_pooled(url, messages, concurrency, latencies):
+    """Send one message at a time, reusing pooled connections"""
+    with PromailgateClient(url=url, default_api_key=API_KEY) as client:
+        send = _timed(client.send_email, latencies)
+        for recipient in _get_recipients(messages):
+            send(recipient, data={'name': 'Benchmark'})
+
+
+def run_pooled_httpclient(url, messages, concurrency, latencies):
+    """Send one message at a time, reusing persistent http.client connections"""
+    with PromailgateClient(url=url, default_api_key=API_KEY, transport='http.client') as client:
+        send = _timed(client.send_email, latencies)
+        for recipient in _get_recipients(messages):
+            send(recipient, data={'name': 'Benchmark'})
+
+
+def run_threaded_httpclient(url, messages, concurrency, latencies):
+    """Send from a thread pool sharing a single client using the http.client transport"""
+    with PromailgateClient(
+            url=url, default_api_key=API_KEY, pool_maxsize=concurrency, transport='http.client') as client:
+        send = _timed(client.send_email, latencies)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(send, recipient, data={'name': 'Benchmark'})
+                       for recipient in _get_recipients(messages)]
+            for future in futures:
+                future.result()
+
+
+def run_threaded(url, messages, concurrency, latencies):
+    """Send from a thread pool sharing a single client"""
+    with PromailgateClient(url=url, default_api_key=API_KEY, pool_maxsize=concurrency) as client:
+        send = _timed(client.send_email, latencies)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(send, recipient, data={'name': 'Benchmark'})
+                       for recipient in _get_recipients(messages)]
+            for future in futures:
+                future.result()
+
+
+def run_bulk(url, messages, concurrency, latencies):
+    """Send using send_many"""
+    with PromailgateClient(url=url, default_api_key=API_KEY, pool_maxsize=concurrency) as client:
+        client.send_email = _timed(client.send_email, latencies)
+        items = ({'recipient': recipient, 'data': {'name': 'Benchmark'}}
+                 for recipient in _get_recipients(messages))
+        for result in client.send_many(items, concurrency=concurrency):
+            if not result.ok:
+                raise result.error
+
+
+def run_sharded(url, messages, concurrency, latencies):
+    """Send from a pool of worker processes, each using the http.client transport.
+    Latencies are not recorded, as sends are made in worker processes."""
+    from promailgate_client.sharding import ShardedSender
+
+    sender = ShardedSender({'url': url, 'default_api_key': API_KEY, 'transport': 'http.client',
+                            'pool_maxsize': concurrency}, concurrency=concurrency)
+    items = ({'recipient': recipient, 'data': {'name': 'Benchmark'}} for recipient in _get_recipients(messages))
+    for result in sender.send_many(items, ordered=False):
+        if not result.ok:
+            raise result.error
+
+
+def run_async(url, messages, concurrency, latencies):
+    """Send using AsyncPromailgateClient"""
+    import asyncio
+    from promailgate_client.async_client import AsyncPromailgateClient
+
+    async def send_all():
+        async with AsyncPromailgateClient(url=url, default_api_key=API_KEY, max_concurrency=concurrency) as client:
+            async def send(recipient):
+                start = time.perf_counter()
+                try:
+                    return await client.send_email(recipient, data={'name': 'Benchmark'})
+                finally:
+                    latencies.append(time.perf_counter() - start)
+
+            await asyncio.gather(*[send(recipient) for recipient in _get_recipients(messages)])
+
+    asyncio.run(send_all())
+
+
+MODES = {
+    'sequential': run_sequential,
+    'pooled': run_pooled,
+    'pooled_httpclient': run_pooled_httpclient,
+    'threaded': run_threaded,
+    'threaded_httpclient': run_threaded_httpclient,
+    'async': run_async,
+    'bulk': run_bulk,
+    'sharded': run_sharded,
+}
+
+
+def _percentile(values, percentile):
+    """Return percentile of sorted values"""
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(percentile / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def _format_ms(value):
+    """Format latency for display"""
+    return '-' if value is None else '%.2f' % value
+
+
+def _get_children_cpu_time():
+    """Return CPU time used by terminated child processes, such as sharded workers"""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_mode(name, url, messages, concurrency, trace_memory=False):
+    """Run benchmark mode, returning dict of results.
+    max_rss_kb is the peak of the whole process, so each mode should be run in a new process."""
+    latencies = []
+    if trace_memory:
+        tracemalloc.start()
+
+    cpu_start = time.process_time() + _get_children_cpu_time()
+    wall_start = time.perf_counter()
+    MODES[name](url, messages, concurrency, latencies)
+    wall_time = time.perf_counter() - wall_start
+    # Includes worker processes of modes that send from several processes
+    cpu_time = time.process_time() + _get_children_cpu_time() - cpu_start
+
+    result = {
+        'mode': name,
+        'messages': messages,
+        'concurrency': concurrency,
+        'wall_time_s': wall_time,
+        'throughput_per_s': messages / wall_time,
+        'cpu_per_message_us': cpu_time / messages * 1e6,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        # Peak of the largest worker process, if the mode uses any
+        'max_child_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+    if trace_memory:
+        result['peak_traced_kb'] = tracemalloc.get_traced_memory()[1] / 1024.0
+        tracemalloc.stop()
+
+    latencies.sort()
+    result['latency_p50_ms'] = _percentile(latencies, 50) * 1000 if latencies else None
+    result['latency_p99_ms'] = _percentile(latencies, 99) * 1000 if latencies else None
+    return result
+
+
+def run_mode_process(name, url, messages, concurrency, trace_memory=False):
+    """Run benchmark mode in a new interpreter, returning dict of results"""
+    command = [
+        sys.executable, '-m', 'benchmarks.run', '--run-mode', name, '--url', url,
+        '--messages', str(messages), '--concurrency', str(concurrency)]
+    if trace_memory:
+        command.append('--trace-memory')
+    output = subprocess.check_output(
+        command, universal_newlines=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return loads(output)
+
+
+def main(argv=None):
+    """Run benchmarks and output results as JSON"""
+    parser = argparse.ArgumentParser(description='Benchmark Promailgate client send modes')
+    parser.add_argument('--messages', type=int, default=2000, help='Messages to send per mode')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrency for parallel modes')
+    parser.add_argument('--latency', type=float, default=0.0, help='Stand-in server latency, in seconds')
+    parser.add_argument('--modes', default=','.join(MODES), help='Comma-separated modes to run')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Report peak allocated memory using tracemalloc (slows benchmarks)')
+    parser.add_argument('--output', help='File to write JSON results to (default: stdout)')
+    # Used to run a single mode in a new interpreter, against an existing server
+    parser.add_argument('--run-mode', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_mode:
+        print(dumps(run_mode(args.run_mode, args.url, args.messages, args.concurrency, args.trace_memory)))
+        return
+
+    results = []
+    with ServerProcess(latency=args.latency) as server:
+        for name in args.modes.split(','):
+            if name == 'async':
+                try:
+                    import aiohttp  # noqa: F401
+                except ImportError:
+                    sys.stderr.write('Skipping async mode, as aiohttp is not installed\n')
+                    continue
+            result = run_mode_process(name, server.url, args.messages, args.concurrency, args.trace_memory)
+            sys.stderr.write('%-20s %10.1f msg/s  p50 %sms  p99 %sms  cpu %.1fus/msg\n' % (
+                result['mode'], result['throughput_per_s'], _format_ms(result['latency_p50_ms']),
+                _format_ms(result['latency_p99_ms']), result['cpu_per_message_us']))
+            results.append(result)
+
+    output = dumps({
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'latency_s': args.latency,
+        'results': results
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Local stand-in Promailgate server for benchmarks"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import gzip
+from json import dumps, loads
+import itertools
+import multiprocessing
+import socket
+import time
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Handle send and status requests, with configurable latency and upload bandwidth"""
+
+    # Keep connections alive, as the real server does
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        """Disable Nagle's algorithm, as headers and body are written separately"""
+        super(StandInHandler, self).setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        """Disable request logging"""
+        pass
+
+    def _respond(self, status_code, body):
+        """Send JSON response"""
+        encoded = dumps(body).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_POST(self):
+        """Handle send request"""
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        # Simulate time taken to upload body over a constrained link
+        if self.server.bandwidth:
+            time.sleep(len(body) / self.server.bandwidth)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        if self.path != '/api/message/send':
+            return self._respond(404, {'message': 'Not found'})
+
+        payload = loads(body)
+        if payload['return_id']:
+            return self._respond(201, {'status': 'OK', 'message_id': 'bench-%s' % next(self.server.message_ids)})
+        return self._respond(200, {'status': 'OK'})
+
+    def do_GET(self):
+        """Handle status request"""
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if not self.path.startswith('/api/message/status/'):
+            return self._respond(404, {'message': 'Not found'})
+        return self._respond(200, {'MessageStatus': 'SENT', 'external_id': 'external-id'})
+
+
+class StandInServer(ThreadingHTTPServer):
+    """HTTP server standing in for Promailgate"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, bandwidth=None):
+        """Setup variables
+
+        bandwidth, if provided, is the simulated upload bandwidth in bytes per second."""
+        super(StandInServer, self).__init__(address, StandInHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.message_ids = itertools.count()
+
+    @property
+    def url(self):
+        """Base URL of server"""
+        return 'http://%s:%s' % self.server_address[:2]
+
+
+def _serve(latency, bandwidth, url_queue):
+    """Run server, publishing its URL"""
+    server = StandInServer(latency=latency, bandwidth=bandwidth)
+    url_queue.put(server.url)
+    server.serve_forever()
+
+
+class ServerProcess(object):
+    """Run stand-in server in a separate process, so that its CPU time
+    is not attributed to the client being measured"""
+
+    def __init__(self, latency=0.0, bandwidth=None):
+        """Setup variables"""
+        self._latency = latency
+        self._bandwidth = bandwidth
+        self._process = None
+        self.url = None
+
+    def __enter__(self):
+        """Start server"""
+        url_queue = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=_serve, args=(self._latency, self._bandwidth, url_queue), daemon=True)
+        self._process.start()
+        self.url = url_queue.get(timeout=30)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Stop server"""
+        self._process.terminate()
+        self._process.join()
@@ -6,14 +6,23 @@
 #  Proprietary and confidential
 #  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
 
-from json import dumps
-import requests
+import threading
+import time
+import zlib
 
+import promailgate_client.balancer
 import promailgate_client.errors
+import promailgate_client.hedging
+import promailgate_client.metrics
+import promailgate_client.retry
+import promailgate_client.serializers
+import promailgate_client.templates
+import promailgate_client.transport
 
 
-class PromailgateClient(object):
-    """Send client for Promailgate"""
+class BaseClient(object):
+    """Endpoint configuration, request building and response handling
+    shared by the synchronous and asynchronous clients"""
 
     def __init__(
             self,
@@ -21,13 +30,36 @@ class PromailgateClient(object):
             url=None,
             use_ssl=True,
             verify_ssl=True,
-            default_api_key=None):
-        """Setup variables"""
+            default_api_key=None,
+            serializer=None,
+            compress_threshold=None,
+            compress_level=6,
+            suppression=None,
+            connect_timeout=10.0,
+            read_timeout=30.0):
+        """Setup variables
+
+        serializer (promailgate_client.serializers.Serializer) encodes request payloads
+        and decodes responses, defaulting to the fastest available implementation.
+        If compress_threshold is provided, send request bodies of at least that many
+        bytes are gzip compressed, at compress_level (1 is fastest, 9 is smallest).
+        suppression (promailgate_client.suppression.SuppressionList) rejects sends to
+        suppressed recipients locally and learns from permanent send errors.
+        connect_timeout limits the time to establish a connection and read_timeout the
+        time to wait for each read of the response, in seconds (None to wait indefinitely)."""
         self._host = host
         self._url = url
         self._use_ssl = use_ssl
         self._verify_ssl = verify_ssl
         self._default_api_key = default_api_key
+        if serializer is None:
+            serializer = promailgate_client.serializers.get_default_serializer()
+        self._serializer = serializer
+        self._compress_threshold = compress_threshold
+        self._compress_level = compress_level
+        self._suppression = suppression
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
 
     def _get_url(self):
         """Return the user-specified URL.
@@ -50,12 +82,26 @@ class PromailgateClient(object):
             return self._get_url()
         return '%s://%s' % (self._get_proto(), self._get_host())
 
-    def send_email(self, recipient, api_key=None, data=None, return_id=True):
-        """Send an email using the API."""
-        # Use empty dict, if no data is provided
-        if data is None:
-            data = {}
+    @staticmethod
+    def _get_send_path():
+        """Return path of send endpoint"""
+        return '/api/message/send'
+
+    @staticmethod
+    def _get_status_path(message_id):
+        """Return path of message status endpoint"""
+        return '/api/message/status/%s' % message_id
 
+    def _get_send_url(self):
+        """Return URL for send endpoint"""
+        return self._get_base_url() + self._get_send_path()
+
+    def _get_status_url(self, message_id):
+        """Return URL for message status endpoint"""
+        return self._get_base_url() + self._get_status_path(message_id)
+
+    def _get_api_key(self, api_key):
+        """Return API key to use for send, falling back to default API key"""
         if api_key is None:
             # Check that API key has either been provided in object creation or in this function
             if self._default_api_key is None:
@@ -63,81 +109,543 @@ class PromailgateClient(object):
 
             # Set API key to default, if not provided in function
             api_key = self._default_api_key
+        return api_key
+
+    def _build_send_payload(self, recipient, api_key, data, return_id):
+        """Validate send arguments and return payload for send request"""
+        # Use empty dict, if no data is provided
+        if data is None:
+            data = {}
+
+        api_key = self._get_api_key(api_key)
 
         # Basic check to ensure that recipient is not an empty string
         if not recipient:
             raise promailgate_client.errors.NoRecipientProvidedError('No recipient has been provided')
 
-        # Send email
-        send_r = requests.post(
-            '%s/api/message/send' % self._get_base_url(),
-            headers={'Content-type': 'application/json'},
-            data=dumps({
-                'api_key': api_key,
-                'recipient': recipient,
-                'data': data,
-                'return_id': return_id
-            }),
-            verify=self._verify_ssl
-        )
+        return {
+            'api_key': api_key,
+            'recipient': recipient,
+            'data': data,
+            'return_id': return_id
+        }
 
+    def _check_recipient(self, recipient, api_key):
+        """Raise an error if recipient is suppressed for API key"""
+        if self._suppression is not None and recipient:
+            self._suppression.check(recipient, api_key)
+
+    def _learn_send_error(self, recipient, api_key, error):
+        """Record send error with suppression list"""
+        if self._suppression is not None and recipient is not None:
+            self._suppression.learn(recipient, error, api_key)
+
+    def _get_send_request(self, body):
+        """Return send request body and headers, compressing body if it exceeds the compression threshold"""
+        if self._compress_threshold is None or len(body) < self._compress_threshold:
+            return body, {'Content-type': 'application/json'}
+
+        # Use gzip container (wbits 16 + 15), as expected for Content-Encoding: gzip
+        compressor = zlib.compressobj(self._compress_level, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush(), {
+            'Content-type': 'application/json',
+            'Content-Encoding': 'gzip'
+        }
+
+    @staticmethod
+    def _handle_send_response(status_code, get_json):
+        """Return result of send request or raise an appropriate exception.
+        get_json is called, at most once, to obtain the decoded response body"""
         # Return successful
-        if send_r.status_code == 201:
+        if status_code == 201:
             # Return message ID if server provides this (based on return_id parameter)
-            return send_r.json()['message_id']
-        elif send_r.status_code == 200:
+            return get_json()['message_id']
+        elif status_code == 200:
             # Otherwise, return True
             return True
 
         # Check for errors
-        elif send_r.status_code == 401:
+        elif status_code == 401:
             # API key invalid
             raise promailgate_client.errors.InvalidAPIKeyError('Invalid API key')
 
         # Handle send error
-        elif send_r.status_code == 400:
+        elif status_code == 400:
             error = 'No error provided'
+            response = get_json()
 
             # If possible, obtain error from promailgate
-            if 'Reason' in send_r.json():
-                error = send_r.json()['Reason']
+            if 'Reason' in response:
+                error = response['Reason']
 
             # Otherwise, handle error from promailgate web server
-            elif 'message' in send_r.json():
-                error = send_r.json()['message']
+            elif 'message' in response:
+                error = response['message']
 
             # Raise exception containing error
             raise promailgate_client.errors.SendError('Send error: %s' % error)
 
-        elif send_r.status_code == 500:
+        elif status_code == 500:
             # Unknown server error
             raise promailgate_client.errors.UnknownSendError('Internal server error')
 
         else:
             # Raise exception when server return response code that isn't recognised
-            raise promailgate_client.errors.UnknownResponseError('Unknown status code: %s' % send_r.status_code)
-
-    def get_message_status(self, message_id):
-        """Obtain status of sent message"""
-        status_r = requests.get(
-            '%s/api/message/status/%s' % (self._get_base_url(), message_id),
-            headers={'Content-type': 'application/json'},
-            verify=self._verify_ssl
-        )
+            raise promailgate_client.errors.UnknownResponseError('Unknown status code: %s' % status_code)
 
+    @staticmethod
+    def _handle_status_response(status_code, get_json):
+        """Return message status or raise an appropriate exception.
+        get_json is called, at most once, to obtain the decoded response body"""
         # Return the JSON returned forom the server, if the result was successful.
-        if status_r.status_code == 200:
-            return status_r.json()
+        if status_code == 200:
+            return get_json()
 
         # Handle errors from server
         # - message not found
-        elif status_r.status_code == 404:
+        elif status_code == 404:
             raise promailgate_client.errors.NoSuchMessageError('No such message')
 
         # - internal server error
-        elif status_r.status_code == 500:
+        elif status_code == 500:
             raise promailgate_client.errors.UnknownServerError('Unknown server error')
 
         # Handle case where server returns response code that we don't support
         else:
-            raise promailgate_client.errors.UnknownResponseError('Unknown status code: %s' % status_r.status_code)
+            raise promailgate_client.errors.UnknownResponseError('Unknown status code: %s' % status_code)
+
+
+class PromailgateClient(BaseClient):
+    """Send client for Promailgate"""
+
+    def __init__(
+            self,
+            host=None,
+            url=None,
+            use_ssl=True,
+            verify_ssl=True,
+            default_api_key=None,
+            pool_connections=10,
+            pool_maxsize=10,
+            pool_block=False,
+            retry_policy=None,
+            circuit_breaker=None,
+            rate_limiter=None,
+            serializer=None,
+            status_cache=None,
+            metrics=None,
+            endpoints=None,
+            probe_timeout=5.0,
+            transport=None,
+            compress_threshold=None,
+            compress_level=6,
+            suppression=None,
+            connect_timeout=10.0,
+            read_timeout=30.0,
+            deadline=None,
+            hedge_percentile=None,
+            idempotency=None,
+            concurrency_limiter=None):
+        """Setup variables
+
+        pool_connections is the number of per-host connection pools to cache,
+        pool_maxsize is the maximum number of kept-alive connections per host and
+        pool_block causes requests to wait for a free connection, rather than
+        opening a temporary one, once pool_maxsize is reached.
+        retry_policy (promailgate_client.retry.RetryPolicy) determines which failed
+        requests are retried and circuit_breaker (promailgate_client.retry.CircuitBreaker)
+        causes requests to fail fast whilst the server is unhealthy.
+        rate_limiter (promailgate_client.ratelimit.RateLimiter) limits the rate of
+        sends for each API key.
+        status_cache (promailgate_client.cache.StatusCache) caches results of
+        get_message_status.
+        metrics (promailgate_client.metrics.MetricsSink) receives request counts,
+        latencies, in-flight gauges and retry counts.
+        endpoints is a list of base URLs to balance requests between, instead of
+        host or url, or a promailgate_client.balancer.LoadBalancer. Ejected endpoints
+        are probed with a status request, with a timeout of probe_timeout seconds.
+        transport (promailgate_client.transport.Transport) performs HTTP requests,
+        or may be the name of a transport ('requests' or 'http.client') to create
+        using the pool options. Defaults to 'requests'.
+        If compress_threshold is provided, send request bodies of at least that many
+        bytes are gzip compressed, at compress_level (1 is fastest, 9 is smallest).
+        suppression (promailgate_client.suppression.SuppressionList) rejects sends to
+        suppressed recipients locally and learns from permanent send errors.
+        connect_timeout limits the time to establish a connection and read_timeout the
+        time to wait for each read of the response, in seconds (None to wait indefinitely).
+        deadline is the default time, in seconds, that send_email and get_message_status
+        calls may take, including retries, after which DeadlineExceededError is raised,
+        including when a request times out as its timeout was limited by the deadline.
+        If hedge_percentile is provided, a second status request is made when the first
+        is slower than that percentile of recent status request latencies (e.g. 95),
+        with the first response being used. Alternatively, a
+        promailgate_client.hedging.Hedger may be passed.
+        idempotency (promailgate_client.idempotency.IdempotencyStore) merges concurrent
+        identical sends and returns the original result for sends repeated within its ttl.
+        concurrency_limiter (promailgate_client.concurrency.AIMDLimiter) limits send
+        requests in flight, adapting the limit to server errors, timeouts and latency.
+        pool_maxsize should be at least its max_limit."""
+        super(PromailgateClient, self).__init__(
+            host=host,
+            url=url,
+            use_ssl=use_ssl,
+            verify_ssl=verify_ssl,
+            default_api_key=default_api_key,
+            serializer=serializer,
+            compress_threshold=compress_threshold,
+            compress_level=compress_level,
+            suppression=suppression,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout)
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._pool_block = pool_block
+        self._retry_policy = retry_policy
+        self._circuit_breaker = circuit_breaker
+        self._rate_limiter = rate_limiter
+        self._status_cache = status_cache
+        self._metrics = metrics
+        self._probe_timeout = probe_timeout
+        self._deadline = deadline
+        self._idempotency = idempotency
+        self._concurrency_limiter = concurrency_limiter
+
+        if hedge_percentile is not None and not isinstance(hedge_percentile, promailgate_client.hedging.Hedger):
+            hedge_percentile = promailgate_client.hedging.Hedger(percentile=hedge_percentile)
+        self._hedger = hedge_percentile
+
+        if endpoints is not None and not isinstance(endpoints, promailgate_client.balancer.LoadBalancer):
+            endpoints = promailgate_client.balancer.LoadBalancer(endpoints)
+        if endpoints is not None and endpoints.probe is None:
+            endpoints.probe = self._probe_endpoint
+        self._balancer = endpoints
+
+        if transport is None:
+            transport = promailgate_client.transport.RequestsTransport.name
+        # Transport is created on first use and shared by all threads using the client
+        self._transport = None
+        self._transport_lock = threading.Lock()
+        if isinstance(transport, str):
+            if transport not in promailgate_client.transport.TRANSPORTS:
+                raise ValueError('Unknown transport: %s' % transport)
+            self._transport_name = transport
+        else:
+            self._transport = transport
+
+    def __enter__(self):
+        """Allow client to be used as a context manager"""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close connections when leaving context"""
+        self.close()
+
+    def _create_transport(self):
+        """Create transport with keep-alive connection pool"""
+        if self._transport_name == promailgate_client.transport.HttpClientTransport.name:
+            return promailgate_client.transport.HttpClientTransport(pool_maxsize=self._pool_maxsize)
+        return promailgate_client.transport.RequestsTransport(
+            pool_connections=self._pool_connections,
+            pool_maxsize=self._pool_maxsize,
+            pool_block=self._pool_block
+        )
+
+    def _get_transport(self):
+        """Return transport, creating it if it does not yet exist"""
+        transport = self._transport
+        if transport is None:
+            with self._transport_lock:
+                # Check again, in case another thread created the transport whilst waiting for lock
+                if self._transport is None:
+                    self._transport = self._create_transport()
+                transport = self._transport
+        return transport
+
+    def warmup(self, connections=0):
+        """Load and create transport ahead of the first request, which otherwise
+        does so on demand, keeping import and client creation fast.
+        If connections is provided, up to that many connections are opened to
+        each endpoint, if supported by the transport."""
+        transport = self._get_transport()
+        if self._balancer is None:
+            base_urls = [self._get_base_url()]
+        else:
+            base_urls = [endpoint.url for endpoint in self._balancer.endpoints]
+        for base_url in base_urls:
+            transport.warmup(
+                base_url, connections=connections, verify=self._verify_ssl, connect_timeout=self._connect_timeout)
+
+    def close(self):
+        """Close any pooled connections.
+        The client may still be used afterwards, which will open a new pool."""
+        transport = self._transport
+        if transport is not None:
+            transport.close()
+        if self._hedger is not None:
+            self._hedger.close()
+
+    def _get_deadline(self, deadline):
+        """Return time.monotonic() time by which a call must complete, or None,
+        from the call's deadline in seconds, falling back to the default deadline"""
+        if deadline is None:
+            deadline = self._deadline
+        if deadline is None:
+            return None
+        return time.monotonic() + deadline
+
+    def _get_timeout(self, deadline):
+        """Return (connect, read) timeout for a request, limited to time remaining before deadline"""
+        if deadline is None:
+            return self._connect_timeout, self._read_timeout
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise promailgate_client.errors.DeadlineExceededError('Deadline exceeded before request was attempted')
+        return tuple(
+            remaining if timeout is None else min(timeout, remaining)
+            for timeout in (self._connect_timeout, self._read_timeout))
+
+    @staticmethod
+    def _check_deadline(deadline, exc):
+        """Raise DeadlineExceededError, from timeout error exc, if deadline has passed,
+        as the request was cut short by the deadline rather than by the server"""
+        if deadline is not None and time.monotonic() >= deadline:
+            raise promailgate_client.errors.DeadlineExceededError('Deadline exceeded awaiting response') from exc
+
+    def _call(self, operation, func, deadline=None, idempotent=True):
+        """Call func, applying retry policy, circuit breaker and deadline, and recording metrics.
+        Requests that are not idempotent are not retried once they may have reached the server."""
+        metrics = self._metrics
+        if metrics is None:
+            if self._retry_policy is None and self._circuit_breaker is None and deadline is None:
+                return func()
+            return promailgate_client.retry.call_with_retry(
+                func, policy=self._retry_policy, circuit_breaker=self._circuit_breaker, deadline=deadline,
+                idempotent=idempotent)
+
+        labels = {'operation': operation}
+
+        def on_retry(attempt, exc):
+            """Count retry"""
+            metrics.increment(promailgate_client.metrics.RETRIES_TOTAL, labels=labels)
+
+        metrics.gauge_add(promailgate_client.metrics.IN_FLIGHT, 1, labels=labels)
+        start = time.perf_counter()
+        try:
+            return promailgate_client.retry.call_with_retry(
+                func, policy=self._retry_policy, circuit_breaker=self._circuit_breaker, on_retry=on_retry,
+                deadline=deadline, idempotent=idempotent)
+        finally:
+            metrics.observe(promailgate_client.metrics.CALL_DURATION, time.perf_counter() - start, labels=labels)
+            metrics.gauge_add(promailgate_client.metrics.IN_FLIGHT, -1, labels=labels)
+
+    def _probe_endpoint(self, base_url):
+        """Return whether endpoint is healthy.
+        Any response other than a server error shows that the endpoint is serving requests."""
+        response = self._get_transport().request(
+            'GET',
+            base_url + self._get_status_path('healthcheck'),
+            headers={'Content-type': 'application/json'},
+            verify=self._verify_ssl,
+            timeout=self._probe_timeout
+        )
+        return response.status_code < 500
+
+    def _request(self, operation, method, path, deadline=None, **kwargs):
+        """Perform HTTP request to path on endpoint, selecting endpoint if load balancing.
+        Timeouts are limited to the time remaining before deadline."""
+        kwargs['timeout'] = self._get_timeout(deadline)
+        balancer = self._balancer
+        if balancer is None:
+            return self._perform(operation, method, self._get_base_url() + path, deadline, **kwargs)
+
+        endpoint = balancer.acquire()
+        failed = True
+        start = time.perf_counter()
+        try:
+            response = self._perform(operation, method, endpoint.url + path, deadline, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        except promailgate_client.errors.DeadlineExceededError:
+            # Request was cut short by the deadline, which does not show that the endpoint is unhealthy
+            failed = False
+            raise
+        finally:
+            balancer.release(endpoint, time.perf_counter() - start, failed)
+
+    def _request_limited(self, deadline, operation, method, path, **kwargs):
+        """Perform HTTP request within the concurrency limit, if the client has one,
+        recording its latency and whether the server was overloaded"""
+        limiter = self._concurrency_limiter
+        if limiter is None:
+            return self._request(operation, method, path, deadline, **kwargs)
+
+        if not limiter.acquire(None if deadline is None else max(0.0, deadline - time.monotonic())):
+            raise promailgate_client.errors.DeadlineExceededError('Deadline exceeded waiting for concurrency limit')
+        latency = None
+        overloaded = False
+        try:
+            start = time.perf_counter()
+            response = self._request(operation, method, path, deadline, **kwargs)
+            latency = time.perf_counter() - start
+            overloaded = response.status_code >= 500
+            return response
+        except promailgate_client.errors.TransportError:
+            overloaded = True
+            raise
+        finally:
+            limiter.release(latency, overloaded)
+
+    def _perform(self, operation, method, url, deadline=None, **kwargs):
+        """Perform HTTP request using transport, recording metrics.
+        DeadlineExceededError is raised if the request times out once deadline has passed."""
+        request = self._get_transport().request
+        metrics = self._metrics
+        if metrics is None:
+            try:
+                return request(method, url, **kwargs)
+            except promailgate_client.errors.TransportTimeoutError as exc:
+                self._check_deadline(deadline, exc)
+                raise
+
+        outcome = promailgate_client.metrics.OUTCOME_ERROR
+        metrics.gauge_add(promailgate_client.metrics.POOL_IN_USE, 1)
+        try:
+            response = request(method, url, **kwargs)
+            outcome = promailgate_client.metrics.get_outcome(response.status_code)
+            return response
+        except promailgate_client.errors.TransportTimeoutError as exc:
+            self._check_deadline(deadline, exc)
+            raise
+        finally:
+            metrics.gauge_add(promailgate_client.metrics.POOL_IN_USE, -1)
+            metrics.increment(
+                promailgate_client.metrics.REQUESTS_TOTAL, labels={'operation': operation, 'outcome': outcome})
+
+    def send_email(self, recipient, api_key=None, data=None, return_id=True, deadline=None, idempotency_key=None):
+        """Send an email using the API.
+        deadline overrides the client's default deadline, in seconds.
+        idempotency_key identifies the send, for deduplication. If not provided, and the
+        client has an idempotency store, it is derived from the request."""
+        payload = self._build_send_payload(
+            recipient=recipient, api_key=api_key, data=data, return_id=return_id)
+        self._check_recipient(recipient, payload['api_key'])
+
+        # Send email
+        return self._send_body(
+            self._serializer.dumps(payload), payload['api_key'], recipient,
+            deadline=deadline, idempotency_key=idempotency_key)
+
+    def _send_body(self, body, api_key, recipient=None, deadline=None, idempotency_key=None):
+        """Send pre-encoded send request body, for the given API key.
+        recipient, if provided, is used to learn from permanent send errors."""
+        deadline = self._get_deadline(deadline)
+        if idempotency_key is None and self._idempotency is not None:
+            idempotency_key = self._idempotency.get_key(body)
+
+        # Compress once, so that retries reuse the compressed body
+        body, headers = self._get_send_request(body)
+        if idempotency_key is not None:
+            # Also provided to the server, allowing it to deduplicate sends from several clients
+            headers['Idempotency-Key'] = idempotency_key
+
+        def send():
+            """Perform single send request"""
+            # Wait for capacity within rate limit of API key, for no longer than the time remaining
+            if self._rate_limiter is not None:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                if not self._rate_limiter.acquire(api_key, timeout=timeout):
+                    raise promailgate_client.errors.DeadlineExceededError('Deadline exceeded waiting for rate limit')
+
+            send_r = self._request_limited(
+                deadline,
+                'send',
+                'POST',
+                self._get_send_path(),
+                headers=headers,
+                body=body,
+                verify=self._verify_ssl
+            )
+            return self._handle_send_response(
+                send_r.status_code, lambda: self._serializer.loads(send_r.content))
+
+        def call():
+            """Send, applying retries and learning from send errors"""
+            try:
+                # Sends may only be repeated if the server can deduplicate them using the idempotency key
+                return self._call('send', send, deadline, idempotent=idempotency_key is not None)
+            except promailgate_client.errors.SendError as exc:
+                self._learn_send_error(recipient, api_key, exc)
+                raise
+
+        if self._idempotency is None:
+            return call()
+        return self._idempotency.call(idempotency_key, call, deadline)
+
+    def prepare_send(self, api_key=None, data=None, return_id=True):
+        """Return a promailgate_client.templates.SendTemplate for sending many emails
+        that share an API key, return_id and common data.
+
+        The common parts of the request are encoded once, so that each send only
+        encodes the recipient and any per-recipient data.
+        data may be a dict or pre-encoded JSON object bytes."""
+        return promailgate_client.templates.SendTemplate(
+            self, api_key=self._get_api_key(api_key), data=data, return_id=return_id)
+
+    def send_many(self, items, concurrency=10, ordered=True, window=None, template=None):
+        """Send many emails in parallel, returning an iterator of
+        promailgate_client.bulk.SendResult objects.
+
+        If the client has a concurrency_limiter, its max_limit is used as the
+        number of threads, with sends in flight limited by the limiter, rather
+        than by concurrency.
+
+        Each item is either a recipient or a dict of send_email arguments.
+        If template (from prepare_send) is provided, items may only provide
+        recipient and per-recipient data.
+        Errors are captured in each result, rather than being raised, so that
+        a failed send does not abort the remaining sends.
+        Items are consumed lazily, with at most window sends pending at once."""
+        # Imported on first use, as concurrent.futures is slow to import
+        import promailgate_client.bulk
+
+        send = self.send_email if template is None else template.send
+        if self._concurrency_limiter is not None:
+            concurrency = self._concurrency_limiter.max_limit
+        return promailgate_client.bulk.send_many(
+            send, items, concurrency=concurrency, ordered=ordered, window=window)
+
+    def get_message_status(self, message_id, deadline=None):
+        """Obtain status of sent message.
+        deadline overrides the client's default deadline, in seconds."""
+        deadline = self._get_deadline(deadline)
+
+        def request_status():
+            """Perform single status request"""
+            return self._request(
+                'status',
+                'GET',
+                self._get_status_path(message_id),
+                deadline,
+                headers={'Content-type': 'application/json'},
+                verify=self._verify_ssl
+            )
+
+        def get_status():
+            """Perform status request, hedging if enabled, and handle response"""
+            if self._hedger is None:
+                status_r = request_status()
+            else:
+                timeout = None if deadline is None else deadline - time.monotonic()
+                try:
+                    status_r = self._hedger.call(request_status, timeout=timeout)
+                except promailgate_client.errors.TransportTimeoutError as exc:
+                    self._check_deadline(deadline, exc)
+                    raise
+            return self._handle_status_response(
+                status_r.status_code, lambda: self._serializer.loads(status_r.content))
+
+        if self._status_cache is not None:
+            return self._status_cache.get_or_load(
+                message_id, lambda: self._call('status', get_status, deadline), deadline)
+        return self._call('status', get_status, deadline)
@@ -0,0 +1,152 @@
+"""Asyncio send API client for Promailgate"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import asyncio
+
+import aiohttp
+
+import promailgate_client
+import promailgate_client.errors
+
+
+class AsyncPromailgateClient(promailgate_client.BaseClient):
+    """Asyncio send client for Promailgate"""
+
+    def __init__(
+            self,
+            host=None,
+            url=None,
+            use_ssl=True,
+            verify_ssl=True,
+            default_api_key=None,
+            serializer=None,
+            max_concurrency=100,
+            semaphore=None,
+            pool_maxsize=100,
+            pool_maxsize_per_host=0,
+            compress_threshold=None,
+            compress_level=6,
+            suppression=None,
+            connect_timeout=10.0,
+            read_timeout=30.0):
+        """Setup variables
+
+        max_concurrency limits the number of requests in flight at once.
+        Alternatively, an asyncio.Semaphore may be passed as semaphore, to share
+        a single concurrency limit between several clients.
+        pool_maxsize is the total number of connections held by the pool and
+        pool_maxsize_per_host limits connections to a single host (0 for no limit).
+        If compress_threshold is provided, send request bodies of at least that many
+        bytes are gzip compressed, at compress_level (1 is fastest, 9 is smallest).
+        suppression (promailgate_client.suppression.SuppressionList) rejects sends to
+        suppressed recipients locally and learns from permanent send errors.
+        connect_timeout limits the time to establish a connection and read_timeout the
+        time to wait for each read of the response, in seconds (None to wait indefinitely)."""
+        super(AsyncPromailgateClient, self).__init__(
+            host=host,
+            url=url,
+            use_ssl=use_ssl,
+            verify_ssl=verify_ssl,
+            default_api_key=default_api_key,
+            serializer=serializer,
+            compress_threshold=compress_threshold,
+            compress_level=compress_level,
+            suppression=suppression,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout)
+        self._max_concurrency = max_concurrency
+        self._semaphore = semaphore
+        self._pool_maxsize = pool_maxsize
+        self._pool_maxsize_per_host = pool_maxsize_per_host
+
+        # Session must be created inside a running event loop, so is created on first use
+        self._session = None
+
+    async def __aenter__(self):
+        """Allow client to be used as an async context manager"""
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Close connections when leaving context"""
+        await self.close()
+
+    def _get_semaphore(self):
+        """Return semaphore limiting concurrent requests"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._semaphore
+
+    def _get_session(self):
+        """Return aiohttp session, creating it if it does not yet exist"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._pool_maxsize,
+                limit_per_host=self._pool_maxsize_per_host
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=self._connect_timeout,
+                sock_read=self._read_timeout
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self):
+        """Close any pooled connections.
+        The client may still be used afterwards, which will open a new pool."""
+        session = self._session
+        self._session = None
+        if session is not None:
+            await session.close()
+
+    async def _request(self, method, url, data=None, headers=None):
+        """Perform request, returning status code and response body.
+        Raises promailgate_client.errors.TransportError if no response is received."""
+        if headers is None:
+            headers = {'Content-type': 'application/json'}
+        async with self._get_semaphore():
+            try:
+                async with self._get_session().request(
+                        method,
+                        url,
+                        headers=headers,
+                        data=data,
+                        ssl=self._verify_ssl) as response:
+                    return response.status, await response.read()
+            # aiohttp timeout errors are also client errors, so are handled first
+            except aiohttp.ConnectionTimeoutError as exc:
+                raise promailgate_client.errors.TransportConnectTimeoutError(
+                    'Connection timed out: %s' % exc) from exc
+            except asyncio.TimeoutError as exc:
+                raise promailgate_client.errors.TransportTimeoutError('Request timed out: %s' % exc) from exc
+            except aiohttp.ClientConnectorError as exc:
+                raise promailgate_client.errors.TransportConnectError('Connection error: %s' % exc) from exc
+            except aiohttp.ClientError as exc:
+                raise promailgate_client.errors.TransportError('Connection error: %s' % exc) from exc
+
+    async def send_email(self, recipient, api_key=None, data=None, return_id=True):
+        """Send an email using the API."""
+        payload = self._build_send_payload(
+            recipient=recipient, api_key=api_key, data=data, return_id=return_id)
+        self._check_recipient(recipient, payload['api_key'])
+
+        # Send email
+        request_body, headers = self._get_send_request(self._serializer.dumps(payload))
+        status_code, body = await self._request('POST', self._get_send_url(), data=request_body, headers=headers)
+
+        try:
+            return self._handle_send_response(status_code, lambda: self._serializer.loads(body))
+        except promailgate_client.errors.SendError as exc:
+            self._learn_send_error(recipient, payload['api_key'], exc)
+            raise
+
+    async def get_message_status(self, message_id):
+        """Obtain status of sent message"""
+        status_code, body = await self._request('GET', self._get_status_url(message_id))
+
+        return self._handle_status_response(status_code, lambda: self._serializer.loads(body))
@@ -0,0 +1,153 @@
+"""Load balancing and health-checked failover between multiple endpoints"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import random
+import threading
+import time
+
+
+class Endpoint(object):
+    """Base URL of a Promailgate server and its load and health"""
+
+    __slots__ = ('url', 'outstanding', 'latency', 'consecutive_failures', 'ejected_until', 'probing')
+
+    def __init__(self, url):
+        """Setup variables"""
+        self.url = url.rstrip('/')
+        # Requests currently in progress
+        self.outstanding = 0
+        # Exponentially weighted moving average of latency, None until a request completes
+        self.latency = None
+        self.consecutive_failures = 0
+        # Time until which endpoint is ejected, or None if endpoint is healthy
+        self.ejected_until = None
+        self.probing = False
+
+    @property
+    def healthy(self):
+        """Whether endpoint is accepting requests"""
+        return self.ejected_until is None
+
+    def __repr__(self):
+        """Return representation of endpoint"""
+        return 'Endpoint(url=%r, outstanding=%r, latency=%r, healthy=%r)' % (
+            self.url, self.outstanding, self.latency, self.healthy)
+
+
+class LoadBalancer(object):
+    """Balance requests between endpoints.
+
+    With the least_outstanding strategy, requests go to the endpoint with the
+    fewest requests in progress. With the latency strategy, requests go to the
+    endpoint with the lowest average latency multiplied by requests in progress,
+    with failed requests recorded as taking at least failure_latency seconds, so
+    that endpoints failing quickly are not preferred.
+    Endpoints failing failure_threshold consecutive requests are ejected for
+    ejection_time seconds, after which they are probed and only re-admitted if
+    the probe succeeds. If all endpoints are ejected, requests are balanced
+    across all endpoints rather than failing."""
+
+    LEAST_OUTSTANDING = 'least_outstanding'
+    LATENCY = 'latency'
+
+    def __init__(
+            self,
+            urls,
+            strategy=LEAST_OUTSTANDING,
+            failure_threshold=3,
+            ejection_time=30.0,
+            latency_decay=0.3,
+            failure_latency=10.0,
+            probe=None):
+        """Setup variables
+
+        probe, if provided, is called with the URL of an ejected endpoint and must
+        return whether the endpoint is healthy. Without a probe, endpoints are
+        re-admitted once ejection_time has elapsed."""
+        if not urls:
+            raise ValueError('At least one endpoint is required')
+        if strategy not in (self.LEAST_OUTSTANDING, self.LATENCY):
+            raise ValueError('Unknown load balancing strategy: %s' % strategy)
+        self.endpoints = [Endpoint(url) for url in urls]
+        self._strategy = strategy
+        self._failure_threshold = failure_threshold
+        self._ejection_time = ejection_time
+        self._latency_decay = latency_decay
+        self._failure_latency = failure_latency
+        self.probe = probe
+        self._lock = threading.Lock()
+
+    def _get_score(self, endpoint):
+        """Return load score of endpoint, lower being preferred"""
+        if self._strategy == self.LATENCY:
+            # Endpoints without a latency are scored as the fastest, so that they are tried
+            return (endpoint.latency or 0.0) * (endpoint.outstanding + 1)
+        return endpoint.outstanding
+
+    def _start_probes(self, now):
+        """Probe ejected endpoints whose ejection time has elapsed"""
+        for endpoint in self.endpoints:
+            if endpoint.healthy or endpoint.probing or endpoint.ejected_until > now:
+                continue
+            if self.probe is None:
+                self._readmit(endpoint)
+                continue
+            endpoint.probing = True
+            threading.Thread(
+                target=self._probe, args=(endpoint,), name='promailgate-probe', daemon=True).start()
+
+    def _probe(self, endpoint):
+        """Probe endpoint, re-admitting it if healthy or extending ejection otherwise"""
+        try:
+            healthy = self.probe(endpoint.url)
+        except Exception:
+            healthy = False
+        with self._lock:
+            endpoint.probing = False
+            if healthy:
+                self._readmit(endpoint)
+            else:
+                endpoint.ejected_until = time.monotonic() + self._ejection_time
+
+    @staticmethod
+    def _readmit(endpoint):
+        """Return endpoint to service"""
+        endpoint.ejected_until = None
+        endpoint.consecutive_failures = 0
+
+    def acquire(self):
+        """Select endpoint for a request. release must be called once the request completes."""
+        with self._lock:
+            self._start_probes(time.monotonic())
+
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.healthy] or self.endpoints
+            best_score = min(self._get_score(endpoint) for endpoint in candidates)
+            # Select randomly between equally loaded endpoints, to spread load
+            endpoint = random.choice([
+                endpoint for endpoint in candidates if self._get_score(endpoint) == best_score])
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(self, endpoint, latency, failed):
+        """Record result of request to endpoint"""
+        with self._lock:
+            endpoint.outstanding -= 1
+            if failed:
+                latency = max(latency, self._failure_latency)
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += self._latency_decay * (latency - endpoint.latency)
+
+            if not failed:
+                endpoint.consecutive_failures = 0
+                return
+
+            endpoint.consecutive_failures += 1
+            if endpoint.healthy and endpoint.consecutive_failures >= self._failure_threshold:
+                endpoint.ejected_until = time.monotonic() + self._ejection_time
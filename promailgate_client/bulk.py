@@ -0,0 +1,102 @@
+"""Parallel dispatch of many sends"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class SendResult(object):
+    """Result of a single send from a bulk send.
+    Holds either the value returned by send_email or the exception raised."""
+
+    __slots__ = ('index', 'recipient', 'message_id', 'error')
+
+    def __init__(self, index, recipient, message_id=None, error=None):
+        """Setup variables"""
+        self.index = index
+        self.recipient = recipient
+        self.message_id = message_id
+        self.error = error
+
+    @property
+    def ok(self):
+        """Whether the send succeeded"""
+        return self.error is None
+
+    def __repr__(self):
+        """Return representation of result"""
+        if self.ok:
+            return 'SendResult(index=%r, recipient=%r, message_id=%r)' % (
+                self.index, self.recipient, self.message_id)
+        return 'SendResult(index=%r, recipient=%r, error=%r)' % (
+            self.index, self.recipient, self.error)
+
+
+def normalise_item(item):
+    """Convert bulk send item to keyword arguments for send_email.
+    Items may either be a recipient string or a dict of send_email arguments."""
+    if isinstance(item, dict):
+        return item
+    return {'recipient': item}
+
+
+def _send_item(send, index, kwargs):
+    """Perform a single send, capturing any error in the result"""
+    recipient = kwargs.get('recipient')
+    try:
+        return SendResult(index, recipient, message_id=send(**kwargs))
+    except Exception as exc:
+        return SendResult(index, recipient, error=exc)
+
+
+def send_many(send, items, concurrency=10, ordered=True, window=None):
+    """Call send for each item using a pool of worker threads, yielding a SendResult per item.
+
+    Results are yielded in input order if ordered is True, otherwise as each send completes.
+    Items are consumed lazily and at most window sends (default: twice the concurrency)
+    are pending at once, so items may be a generator of any length."""
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+    if window is None:
+        window = concurrency * 2
+    window = max(window, concurrency)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = deque() if ordered else set()
+    items = iter(enumerate(items))
+    try:
+        exhausted = False
+        while True:
+            # Top up pending sends from input
+            while not exhausted and len(pending) < window:
+                try:
+                    index, item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                future = executor.submit(_send_item, send, index, normalise_item(item))
+                if ordered:
+                    pending.append(future)
+                else:
+                    pending.add(future)
+
+            if not pending:
+                break
+
+            if ordered:
+                yield pending.popleft().result()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    yield future.result()
+    finally:
+        # Cancel any queued sends if the caller stops consuming results
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,155 @@
+"""Message status cache and request coalescing"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+from collections import OrderedDict
+import threading
+import time
+
+import promailgate_client.errors
+import promailgate_client.tracker
+
+
+class _Call(object):
+    """Call in progress, awaited by concurrent callers for the same key"""
+
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        """Setup variables"""
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RequestCoalescer(object):
+    """Merge concurrent calls for the same key into a single call.
+
+    Whilst a call for a key is in progress, further calls for that key wait
+    for and share its result (or exception) rather than calling again."""
+
+    def __init__(self):
+        """Setup variables"""
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def call(self, key, func, deadline=None):
+        """Call func, or wait for in-progress call for key.
+        deadline, if provided, is the time.monotonic() time after which waiting
+        callers give up, raising DeadlineExceededError."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not call.event.wait(timeout):
+                raise promailgate_client.errors.DeadlineExceededError(
+                    'Deadline exceeded waiting for in-progress request')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class StatusCache(object):
+    """Size-bounded LRU cache of message statuses.
+
+    Pending statuses are cached for pending_ttl seconds and final statuses for
+    terminal_ttl seconds (None to cache until evicted).
+    Concurrent lookups for an uncached message result in a single request."""
+
+    def __init__(
+            self,
+            maxsize=10000,
+            pending_ttl=5.0,
+            terminal_ttl=None,
+            pending_statuses=promailgate_client.tracker.PENDING_STATUSES):
+        """Setup variables"""
+        self._maxsize = maxsize
+        self._pending_ttl = pending_ttl
+        self._terminal_ttl = terminal_ttl
+        self._pending_statuses = pending_statuses
+        # Map of message ID to (expiry time, status), ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._coalescer = RequestCoalescer()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        """Number of cached statuses"""
+        return len(self._entries)
+
+    def _get_ttl(self, status):
+        """Return time to cache status for"""
+        if promailgate_client.tracker.is_terminal_status(status, self._pending_statuses):
+            return self._terminal_ttl
+        return self._pending_ttl
+
+    def get(self, message_id):
+        """Return copy of cached status, or None if not cached or expired"""
+        with self._lock:
+            entry = self._entries.get(message_id)
+            if entry is None:
+                return None
+            expires, status = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[message_id]
+                return None
+            self._entries.move_to_end(message_id)
+        return dict(status)
+
+    def set(self, message_id, status):
+        """Cache status of message"""
+        ttl = self._get_ttl(status)
+        if ttl is not None and ttl <= 0:
+            return
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[message_id] = (expires, status)
+            self._entries.move_to_end(message_id)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, message_id=None):
+        """Remove message from cache, or clear cache if no message ID is given"""
+        with self._lock:
+            if message_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(message_id, None)
+
+    def get_or_load(self, message_id, loader, deadline=None):
+        """Return cached status, otherwise call loader to obtain status and cache it.
+        deadline limits waiting for a concurrent lookup, as for RequestCoalescer.call."""
+        status = self.get(message_id)
+        if status is not None:
+            self.hits += 1
+            return status
+        self.misses += 1
+
+        def load():
+            """Load status and store in cache"""
+            loaded = loader()
+            self.set(message_id, loaded)
+            return loaded
+
+        return dict(self._coalescer.call(message_id, load, deadline))
@@ -0,0 +1,341 @@
+"""Command line sender for campaigns read from JSON lines or CSV files
+
+Usage: promailgate-send recipients.jsonl --url https://promailgate.example.com --api-key KEY
+"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import argparse
+from json import dumps, loads
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+from promailgate_client import PromailgateClient
+import promailgate_client.concurrency
+import promailgate_client.errors
+import promailgate_client.pipeline
+import promailgate_client.ratelimit
+import promailgate_client.sharding
+import promailgate_client.suppression
+
+
+class Checkpoint(object):
+    """Record of processed input items, allowing an interrupted run to resume.
+
+    All items with an index below watermark have been processed and completed
+    holds the indexes of processed items above the watermark, as sends complete
+    out of order. results_offset is the size of the results file when the
+    checkpoint was saved."""
+
+    def __init__(self, path, input_path):
+        """Setup variables"""
+        self.path = path
+        self.input_path = os.path.abspath(input_path)
+        self.watermark = 0
+        self.completed = set()
+        self.results_offset = 0
+
+    @property
+    def processed(self):
+        """Number of processed items"""
+        return self.watermark + len(self.completed)
+
+    def load(self):
+        """Load checkpoint from file, returning whether one existed"""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r') as handle:
+            state = loads(handle.read())
+        if state['input'] != self.input_path:
+            raise promailgate_client.errors.CheckpointError(
+                'Checkpoint %s was created for a different input: %s' % (self.path, state['input']))
+        self.watermark = state['watermark']
+        self.completed = set(state['completed'])
+        self.results_offset = state['results_offset']
+        return True
+
+    def save(self, results_offset):
+        """Atomically write checkpoint to file"""
+        self.results_offset = results_offset
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as handle:
+            handle.write(dumps({
+                'input': self.input_path,
+                'watermark': self.watermark,
+                'completed': sorted(self.completed),
+                'results_offset': results_offset,
+            }))
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_path, self.path)
+
+    def is_done(self, index):
+        """Whether item has been processed"""
+        return index < self.watermark or index in self.completed
+
+    def mark(self, index):
+        """Record item as processed, advancing watermark past contiguous processed items"""
+        self.completed.add(index)
+        while self.watermark in self.completed:
+            self.completed.remove(self.watermark)
+            self.watermark += 1
+
+    def recover(self, results_path):
+        """Mark items from results written after the checkpoint was saved, so that
+        they are not sent again, and remove any partially written result"""
+        if not os.path.exists(results_path):
+            if self.results_offset:
+                raise promailgate_client.errors.CheckpointError(
+                    'Results file %s recorded in checkpoint %s is missing' % (results_path, self.path))
+            return 0
+        if os.path.getsize(results_path) < self.results_offset:
+            raise promailgate_client.errors.CheckpointError(
+                'Results file %s is shorter than recorded in checkpoint %s' % (results_path, self.path))
+        recovered = 0
+        with open(results_path, 'rb+') as handle:
+            handle.seek(self.results_offset)
+            data = handle.read()
+            end = data.rfind(b'\n') + 1
+            for line in data[:end].splitlines():
+                if line.strip():
+                    self.mark(loads(line.decode('utf-8'))['index'])
+                    recovered += 1
+            handle.truncate(self.results_offset + end)
+        return recovered
+
+
+def read_input(path, checkpoint, recipient_field='recipient'):
+    """Lazily read (index, item) pairs from a JSON lines or CSV file, skipping processed items.
+    Processed JSON lines are skipped without being decoded, so resuming a large run is fast."""
+    if path.lower().endswith('.csv'):
+        for index, item in enumerate(promailgate_client.pipeline.read_csv(path, recipient_field=recipient_field)):
+            if not checkpoint.is_done(index):
+                yield index, item
+        return
+
+    with open(path, 'r') as handle:
+        index = 0
+        for line in handle:
+            # Blank lines are skipped by read_jsonl, so are not counted as items
+            if not line.strip():
+                continue
+            if not checkpoint.is_done(index):
+                yield index, loads(line)
+            index += 1
+
+
+class Progress(object):
+    """Periodically write throughput to a stream"""
+
+    def __init__(self, stream, interval=1.0):
+        """Setup variables"""
+        self._stream = stream
+        self._interval = interval
+        self._is_tty = hasattr(stream, 'isatty') and stream.isatty()
+        self._start = time.monotonic()
+        self._last_time = self._start
+        self._last_total = 0
+
+    def update(self, summary, force=False):
+        """Write progress, if interval has elapsed since the last update"""
+        now = time.monotonic()
+        if not force and now - self._last_time < self._interval:
+            return
+        rate = (summary.total - self._last_total) / max(now - self._last_time, 1e-9)
+        average = summary.total / max(now - self._start, 1e-9)
+        self._last_time = now
+        self._last_total = summary.total
+        line = 'sent %d  failed %d  %.1f msg/s  (average %.1f msg/s)' % (
+            summary.sent, summary.failed, rate, average)
+        if self._is_tty:
+            self._stream.write('\r\033[K' + line)
+        else:
+            self._stream.write(line + '\n')
+        self._stream.flush()
+
+    def finish(self, summary):
+        """Write final progress"""
+        self.update(summary, force=True)
+        if self._is_tty:
+            self._stream.write('\n')
+
+
+def create_rate_limiter(rate, directory=None):
+    """Return rate limiter applying a single rate across all API keys.
+    If directory is provided, the rate is shared by all processes using it."""
+    if directory is not None:
+        return promailgate_client.ratelimit.SharedRateLimiter(directory, rate, per_key=False)
+    bucket = promailgate_client.ratelimit.TokenBucket(rate)
+    return promailgate_client.ratelimit.RateLimiter(rate, bucket_factory=lambda key: bucket)
+
+
+def get_parser():
+    """Return argument parser"""
+    parser = argparse.ArgumentParser(
+        prog='promailgate-send',
+        description='Send emails to recipients from a JSON lines or CSV file. '
+                    'Interrupted runs resume from their checkpoint when run again.')
+    parser.add_argument('input', help='JSON lines (.jsonl) or CSV (.csv) file of recipients')
+    endpoint = parser.add_mutually_exclusive_group(required=True)
+    endpoint.add_argument('--url', help='Base URL of Promailgate server')
+    endpoint.add_argument('--host', help='Hostname of Promailgate server, using HTTPS')
+    parser.add_argument('--api-key', default=os.environ.get('PROMAILGATE_API_KEY'),
+                        help='API key for items that do not provide one (default: $PROMAILGATE_API_KEY)')
+    parser.add_argument('--no-verify-ssl', dest='verify_ssl', action='store_false',
+                        help='Do not verify SSL certificate of server')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='Number of parallel sends, per process (default: 10)')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Adapt number of parallel sends to server capacity, up to --concurrency')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Number of worker processes to shard sends between (default: 1)')
+    parser.add_argument('--rate', type=float,
+                        help='Maximum sends per second, across all processes (default: unlimited)')
+    parser.add_argument('--transport', default='requests', choices=['requests', 'http.client'],
+                        help='HTTP transport (default: requests)')
+    parser.add_argument('--suppression',
+                        help='File of suppressed recipients, which is updated with recipients that have unsubscribed')
+    parser.add_argument('--validate-addresses', action='store_true',
+                        help='Fail sends to invalid email addresses without sending them to the server')
+    parser.add_argument('--recipient-field', default='recipient', help='CSV column containing recipient')
+    parser.add_argument('--results', help='JSON lines file results are appended to (default: INPUT.results.jsonl)')
+    parser.add_argument('--checkpoint', help='Checkpoint file (default: RESULTS.checkpoint)')
+    parser.add_argument('--checkpoint-interval', type=float, default=5.0,
+                        help='Seconds between checkpoints (default: 5)')
+    parser.add_argument('--quiet', action='store_true', help='Do not show progress')
+    return parser
+
+
+def run(args, stream=sys.stderr, stop=None):
+    """Send items from input file, returning the CampaignSummary of this run.
+    Sending stops once the stop event is set, after in-flight sends complete."""
+    if stop is None:
+        stop = threading.Event()
+    results_path = args.results or args.input + '.results.jsonl'
+    checkpoint = Checkpoint(args.checkpoint or results_path + '.checkpoint', args.input)
+    if checkpoint.load():
+        recovered = checkpoint.recover(results_path)
+        stream.write('Resuming from checkpoint: %d items already processed (%d recovered from results)\n' % (
+            checkpoint.processed, recovered))
+
+    client_kwargs = {
+        'host': args.host,
+        'url': args.url,
+        'verify_ssl': args.verify_ssl,
+        'default_api_key': args.api_key,
+        'pool_maxsize': args.concurrency,
+        'transport': args.transport,
+    }
+    if args.adaptive:
+        client_kwargs['concurrency_limiter'] = promailgate_client.concurrency.AIMDLimiter(
+            initial=min(10, args.concurrency), max_limit=args.concurrency)
+    if args.suppression or args.validate_addresses:
+        client_kwargs['suppression'] = promailgate_client.suppression.SuppressionList(
+            path=args.suppression, validate_addresses=args.validate_addresses)
+    rate_directory = None
+    if args.rate:
+        if args.processes > 1:
+            # Workers share a single budget, held in a file in a temporary directory
+            rate_directory = tempfile.TemporaryDirectory(prefix='promailgate-rate-')
+        client_kwargs['rate_limiter'] = create_rate_limiter(
+            args.rate, rate_directory.name if rate_directory is not None else None)
+
+    # Map of position in stream of pending items to index in input
+    indexes = {}
+
+    def pending_items():
+        """Yield unprocessed items until stopped"""
+        for position, (index, item) in enumerate(read_input(args.input, checkpoint, args.recipient_field)):
+            if stop.is_set():
+                return
+            indexes[position] = index
+            yield item
+
+    summary = promailgate_client.pipeline.CampaignSummary()
+    progress = None if args.quiet else Progress(stream)
+    results_handle = open(results_path, 'a')
+    sink = promailgate_client.pipeline.JsonlResultSink(results_handle)
+
+    def save():
+        """Flush results and save checkpoint covering them"""
+        results_handle.flush()
+        os.fsync(results_handle.fileno())
+        checkpoint.save(results_handle.tell())
+
+    if args.processes > 1:
+        client = None
+        results = promailgate_client.sharding.ShardedSender(
+            client_kwargs, processes=args.processes, concurrency=args.concurrency
+        ).send_many(pending_items(), ordered=False)
+    else:
+        client = PromailgateClient(**client_kwargs)
+        results = client.send_many(pending_items(), concurrency=args.concurrency, ordered=False)
+    last_save = time.monotonic()
+    try:
+        for result in results:
+            result.index = indexes.pop(result.index)
+            sink.write(result)
+            summary.add(result)
+            checkpoint.mark(result.index)
+            if progress is not None:
+                progress.update(summary)
+            if time.monotonic() - last_save >= args.checkpoint_interval:
+                save()
+                last_save = time.monotonic()
+    finally:
+        results.close()
+        save()
+        sink.close()
+        results_handle.close()
+        if client is not None:
+            client.close()
+        if 'suppression' in client_kwargs:
+            client_kwargs['suppression'].close()
+        if 'rate_limiter' in client_kwargs:
+            client_kwargs['rate_limiter'].close()
+        if rate_directory is not None:
+            rate_directory.cleanup()
+        if progress is not None:
+            progress.finish(summary)
+    return summary
+
+
+def main(argv=None):
+    """Entry point for promailgate-send"""
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        """Stop sending on first signal, aborting on second"""
+        if stop.is_set():
+            raise KeyboardInterrupt
+        stop.set()
+        sys.stderr.write('\nStopping after in-flight sends complete (interrupt again to abort)\n')
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    try:
+        summary = run(args, stop=stop)
+    except promailgate_client.errors.CheckpointError as exc:
+        sys.stderr.write('%s\n' % exc)
+        return 2
+
+    errors = ', '.join('%s: %d' % error for error in sorted(summary.errors.items()))
+    sys.stderr.write('Sent %d, failed %d%s\n' % (summary.sent, summary.failed, ' (%s)' % errors if errors else ''))
+    if stop.is_set():
+        return 130
+    return 1 if summary.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""Adaptive limit of requests in flight"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import threading
+import time
+
+
+class AIMDLimiter(object):
+    """Limit requests in flight, adapting the limit to the capacity of the server
+    using additive increase, multiplicative decrease.
+
+    Whilst requests succeed and the limit is in use, the limit increases by
+    around 1 per limit requests completed. When a request is overloaded (a server
+    error or timeout) or recent latency rises above latency_tolerance times the
+    long-term latency, the limit is multiplied by backoff_ratio, at most once per
+    recent latency, as requests already in flight are affected by the same overload.
+    Short-term and long-term latencies are exponentially weighted moving averages,
+    using smoothing and baseline_smoothing."""
+
+    def __init__(
+            self,
+            initial=10,
+            min_limit=1,
+            max_limit=100,
+            backoff_ratio=0.5,
+            latency_tolerance=2.0,
+            smoothing=0.2,
+            baseline_smoothing=0.01,
+            min_samples=10):
+        """Setup variables"""
+        if not 1 <= min_limit <= initial <= max_limit:
+            raise ValueError('Limits must satisfy 1 <= min_limit <= initial <= max_limit')
+        self._initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self._backoff_ratio = backoff_ratio
+        self._latency_tolerance = latency_tolerance
+        self._smoothing = smoothing
+        self._baseline_smoothing = baseline_smoothing
+        self._min_samples = min_samples
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._samples = 0
+        self._latency = None
+        self._baseline = None
+        self._last_decrease = None
+        self._condition = threading.Condition()
+
+    def __getstate__(self):
+        """Return configuration for pickling, so that each process using a copy adapts its own limit"""
+        return {
+            'initial': self._initial,
+            'min_limit': self.min_limit,
+            'max_limit': self.max_limit,
+            'backoff_ratio': self._backoff_ratio,
+            'latency_tolerance': self._latency_tolerance,
+            'smoothing': self._smoothing,
+            'baseline_smoothing': self._baseline_smoothing,
+            'min_samples': self._min_samples,
+        }
+
+    def __setstate__(self, state):
+        """Create limiter from pickled configuration"""
+        self.__init__(**state)
+
+    @property
+    def limit(self):
+        """Current limit of requests in flight"""
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        """Number of requests in flight"""
+        return self._in_flight
+
+    def acquire(self, timeout=None):
+        """Wait until a request is permitted, returning False if timeout elapses first"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._in_flight < int(self._limit), timeout):
+                return False
+            self._in_flight += 1
+            return True
+
+    def _record_latency(self, latency):
+        """Update moving averages of latency, returning whether latency has spiked"""
+        self._samples += 1
+        if self._latency is None:
+            self._latency = self._baseline = latency
+            return False
+        self._latency += (latency - self._latency) * self._smoothing
+        self._baseline += (latency - self._baseline) * self._baseline_smoothing
+        return self._samples >= self._min_samples and self._latency > self._baseline * self._latency_tolerance
+
+    def _adjust(self, in_flight, latency, overloaded):
+        """Adjust limit following completion of a request, whilst in_flight requests were in flight"""
+        if not overloaded:
+            overloaded = self._record_latency(latency)
+
+        if overloaded:
+            now = time.monotonic()
+            if self._last_decrease is None or now - self._last_decrease >= (self._latency or 0):
+                self._limit = max(self.min_limit, self._limit * self._backoff_ratio)
+                self._last_decrease = now
+        elif in_flight * 2 >= self._limit:
+            # Only increase whilst limit is in use, so that it does not grow without bound under light load
+            self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+
+    def release(self, latency=None, overloaded=False):
+        """Record completion of request that took latency seconds, adjusting limit.
+        overloaded indicates that the request failed due to server overload or timed out.
+        If latency is None, the request was not completed, so the limit is not adjusted."""
+        with self._condition:
+            in_flight = self._in_flight
+            self._in_flight -= 1
+            if overloaded or latency is not None:
+                self._adjust(in_flight, latency, overloaded)
+
+            available = int(self._limit) - self._in_flight
+            if available > 0:
+                self._condition.notify(available)
@@ -0,0 +1,197 @@
+"""Background dispatch of sends from priority lanes"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+from collections import deque
+from concurrent.futures import Future
+import threading
+import time
+
+import promailgate_client.metrics
+
+# Default lanes, from highest to lowest priority
+TRANSACTIONAL = 'transactional'
+BULK = 'bulk'
+DEFAULT_LANES = (TRANSACTIONAL, BULK)
+
+STRICT = 'strict'
+WEIGHTED = 'weighted'
+
+
+class _Lane(object):
+    """Queue of sends waiting in a lane"""
+
+    __slots__ = ('name', 'weight', 'current_weight', 'queue')
+
+    def __init__(self, name, weight):
+        """Setup variables"""
+        self.name = name
+        self.weight = weight
+        self.current_weight = 0
+        self.queue = deque()
+
+
+class Dispatcher(object):
+    """Send emails in the background using a shared pool of worker threads,
+    serving sends from several priority lanes.
+
+    submit returns a concurrent.futures.Future of the result of the send.
+    lanes is a sequence of lane names from highest to lowest priority, or a dict
+    of lane names to weights. With the strict scheduler, a free worker always takes
+    the oldest send from the highest priority lane with sends waiting, so a send in
+    a high priority lane waits, at most, for the first worker to complete its send,
+    however many sends are waiting in lower lanes. With the weighted scheduler,
+    lanes with sends waiting are served in proportion to their weights, so low
+    priority lanes are not starved.
+    If max_queue is provided, submit waits whilst a lane has max_queue sends waiting."""
+
+    def __init__(self, client, lanes=DEFAULT_LANES, workers=10, scheduler=STRICT, max_queue=None):
+        """Setup variables"""
+        if scheduler not in (STRICT, WEIGHTED):
+            raise ValueError('Unknown scheduler: %s' % scheduler)
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+        if not isinstance(lanes, dict):
+            # Weights of unweighted lanes decrease with priority
+            lanes = {name: len(lanes) - position for position, name in enumerate(lanes)}
+        if not lanes:
+            raise ValueError('At least one lane is required')
+
+        self._client = client
+        self._lanes = [_Lane(name, weight) for name, weight in lanes.items()]
+        self._lanes_by_name = {lane.name: lane for lane in self._lanes}
+        self._scheduler = scheduler
+        self._max_queue = max_queue
+        self._metrics = getattr(client, '_metrics', None)
+        lock = threading.Lock()
+        # Workers wait for sends to be queued and, if queues are bounded, submitters wait for space
+        self._work_available = threading.Condition(lock)
+        self._space_available = threading.Condition(lock)
+        self._shutdown = False
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._work, name='promailgate-dispatcher-%s' % index, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def __enter__(self):
+        """Allow dispatcher to be used as a context manager"""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Complete queued sends and stop workers when leaving context"""
+        self.shutdown()
+
+    @property
+    def lanes(self):
+        """Names of lanes, from highest to lowest priority"""
+        return [lane.name for lane in self._lanes]
+
+    def pending(self, lane=None):
+        """Number of sends waiting in lane, or in all lanes if no lane is given"""
+        with self._work_available:
+            if lane is None:
+                return sum(len(entry.queue) for entry in self._lanes)
+            return len(self._get_lane(lane).queue)
+
+    def _get_lane(self, name):
+        """Return lane by name"""
+        lane = self._lanes_by_name.get(name)
+        if lane is None:
+            raise ValueError('Unknown lane: %s' % name)
+        return lane
+
+    def submit(self, recipient, lane=None, template=None, **kwargs):
+        """Queue send to recipient in lane (default: the lowest priority lane),
+        returning a concurrent.futures.Future of the result.
+
+        kwargs are passed to send_email, or to template.send if a template
+        (from prepare_send) is provided."""
+        lane = self._lanes[-1] if lane is None else self._get_lane(lane)
+        if template is None:
+            send = self._client.send_email
+        else:
+            send = template.send
+
+        future = Future()
+        with self._space_available:
+            if self._max_queue is not None:
+                self._space_available.wait_for(lambda: self._shutdown or len(lane.queue) < self._max_queue)
+            if self._shutdown:
+                raise RuntimeError('Cannot submit send after dispatcher has been shut down')
+            lane.queue.append((future, send, recipient, kwargs, time.perf_counter()))
+            if self._metrics is not None:
+                self._metrics.gauge_add(promailgate_client.metrics.DISPATCH_QUEUED, 1, labels={'lane': lane.name})
+            self._work_available.notify()
+        return future
+
+    def _select_lane(self):
+        """Return lane to take next send from, or None if no sends are waiting"""
+        if self._scheduler == STRICT:
+            for lane in self._lanes:
+                if lane.queue:
+                    return lane
+            return None
+
+        # Smooth weighted round robin between lanes with sends waiting
+        selected = None
+        total_weight = 0
+        for lane in self._lanes:
+            if not lane.queue:
+                continue
+            lane.current_weight += lane.weight
+            total_weight += lane.weight
+            if selected is None or lane.current_weight > selected.current_weight:
+                selected = lane
+        if selected is not None:
+            selected.current_weight -= total_weight
+        return selected
+
+    def _work(self):
+        """Perform queued sends until shut down"""
+        while True:
+            with self._work_available:
+                lane = self._select_lane()
+                while lane is None:
+                    if self._shutdown:
+                        return
+                    self._work_available.wait()
+                    lane = self._select_lane()
+                future, send, recipient, kwargs, queued = lane.queue.popleft()
+                if self._metrics is not None:
+                    labels = {'lane': lane.name}
+                    self._metrics.gauge_add(promailgate_client.metrics.DISPATCH_QUEUED, -1, labels=labels)
+                    self._metrics.observe(
+                        promailgate_client.metrics.DISPATCH_WAIT, time.perf_counter() - queued, labels=labels)
+                if self._max_queue is not None:
+                    self._space_available.notify_all()
+
+            # Skip sends cancelled whilst waiting
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(send(recipient, **kwargs))
+            except BaseException as exc:
+                future.set_exception(exc)
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """Stop accepting sends and stop workers once queued sends are complete.
+        If cancel_pending is True, queued sends that have not started are cancelled."""
+        with self._work_available:
+            self._shutdown = True
+            if cancel_pending:
+                for lane in self._lanes:
+                    while lane.queue:
+                        lane.queue.popleft()[0].cancel()
+                        if self._metrics is not None:
+                            self._metrics.gauge_add(
+                                promailgate_client.metrics.DISPATCH_QUEUED, -1, labels={'lane': lane.name})
+            self._work_available.notify_all()
+            self._space_available.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -56,3 +56,57 @@ class UnknownServerError(PromailgateClientException):
     """Unknown server error"""
 
     pass
+
+
+class CircuitOpenError(PromailgateClientException):
+    """Request not attempted, as circuit breaker is open"""
+
+    pass
+
+
+class TransportError(PromailgateClientException, IOError):
+    """Request failed without a response, due to a connection error"""
+
+    pass
+
+
+class TransportTimeoutError(TransportError):
+    """Request timed out whilst connecting or awaiting response"""
+
+    pass
+
+
+class TransportConnectError(TransportError):
+    """Request was not sent, as a connection to the server could not be established"""
+
+    pass
+
+
+class TransportConnectTimeoutError(TransportConnectError, TransportTimeoutError):
+    """Request was not sent, as connecting to the server timed out"""
+
+    pass
+
+
+class CheckpointError(PromailgateClientException):
+    """Checkpoint does not match the input or results of the current run"""
+
+    pass
+
+
+class RecipientSuppressedError(SendError):
+    """Send rejected locally, as the recipient is in the suppression list"""
+
+    pass
+
+
+class InvalidRecipientError(SendError):
+    """Send rejected locally, as the recipient is not a valid email address"""
+
+    pass
+
+
+class DeadlineExceededError(PromailgateClientException):
+    """Call, including any retries, did not complete before its deadline"""
+
+    pass
@@ -0,0 +1,133 @@
+"""Hedged requests, bounding tail latency of idempotent requests"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+from collections import deque
+import threading
+import time
+
+import promailgate_client.errors
+
+
+class LatencyTracker(object):
+    """Track latency percentile over a window of recent requests"""
+
+    def __init__(self, percentile=95.0, window=1000, min_samples=20, update_every=50):
+        """Setup variables
+
+        The percentile is recalculated after every update_every samples,
+        rather than on each request, and is unknown until min_samples have been recorded."""
+        self._percentile = percentile
+        self._samples = deque(maxlen=window)
+        self._min_samples = min_samples
+        self._update_every = update_every
+        self._since_update = 0
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        """Latency at percentile, or None if there are too few samples"""
+        return self._value
+
+    def record(self, latency):
+        """Record latency of completed request"""
+        with self._lock:
+            self._samples.append(latency)
+            self._since_update += 1
+            if len(self._samples) < self._min_samples:
+                return
+            if self._value is not None and self._since_update < self._update_every:
+                return
+            self._since_update = 0
+            samples = sorted(self._samples)
+            index = min(len(samples) - 1, int(round(self._percentile / 100.0 * (len(samples) - 1))))
+            self._value = samples[index]
+
+
+class Hedger(object):
+    """Issue a second request if the first is slower than a latency percentile,
+    returning whichever response arrives first.
+
+    Only suitable for idempotent requests. Hedging starts once enough latencies
+    have been recorded, adding approximately (100 - percentile)% more requests.
+    Requests are run on a pool of up to max_workers threads."""
+
+    def __init__(self, percentile=95.0, min_delay=0.0, max_workers=20, tracker=None):
+        """Setup variables"""
+        self.tracker = tracker or LatencyTracker(percentile=percentile)
+        self._min_delay = min_delay
+        self._max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """Return executor, creating it if it does not yet exist"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self._max_workers, thread_name_prefix='promailgate-hedge')
+        return self._executor
+
+    def _timed(self, func):
+        """Call func, recording its latency if it succeeds"""
+        start = time.perf_counter()
+        result = func()
+        self.tracker.record(time.perf_counter() - start)
+        return result
+
+    def get_delay(self):
+        """Return delay before hedging, or None if hedging is not yet possible"""
+        value = self.tracker.value
+        if value is None:
+            return None
+        return max(value, self._min_delay)
+
+    def call(self, func, timeout=None):
+        """Call func, calling it a second time in parallel if the first call is slow.
+        The result of the first call to succeed is returned, or the first error if both fail.
+        timeout limits the time spent waiting for the calls, after which TransportTimeoutError is raised."""
+        delay = self.get_delay()
+        if delay is None:
+            return self._timed(func)
+
+        from concurrent.futures import wait, FIRST_COMPLETED
+        executor = self._get_executor()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        futures = [executor.submit(self._timed, func)]
+        done, _ = wait(futures, timeout=delay if timeout is None else min(delay, timeout))
+        if not done and (deadline is None or time.monotonic() < deadline):
+            futures.append(executor.submit(self._timed, func))
+
+        error = None
+        pending = set(futures)
+        while pending:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in futures:
+                if future not in done:
+                    continue
+                if future.exception() is None:
+                    return future.result()
+                if error is None:
+                    error = future.exception()
+        if error is not None:
+            raise error
+        raise promailgate_client.errors.TransportTimeoutError(
+            'Hedged request did not complete within %.3f seconds' % timeout)
+
+    def close(self):
+        """Stop executor threads"""
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False)
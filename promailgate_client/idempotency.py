@@ -0,0 +1,106 @@
+"""Client-side idempotency of sends"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+import promailgate_client.cache
+
+
+def get_idempotency_key(body):
+    """Return idempotency key for encoded send request body.
+    Sends with the same API key, recipient, data and return_id have the same key,
+    provided that they are encoded in the same way: data must have the same key order
+    and sends using a SendTemplate have different keys to those using send_email."""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class IdempotencyStore(object):
+    """Record of recently completed sends, preventing duplicate sends.
+
+    Sends with a key completed within the last ttl seconds return the original
+    result, rather than sending again. Concurrent sends with the same key
+    are merged into a single request. Failed sends are not recorded, so may be
+    retried. At most maxsize keys are held, evicting the oldest first."""
+
+    def __init__(self, maxsize=100000, ttl=3600.0):
+        """Setup variables"""
+        self._maxsize = maxsize
+        self._ttl = ttl
+        # Map of key to (expiry time, result), ordered from oldest to newest
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._coalescer = promailgate_client.cache.RequestCoalescer()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        """Number of recorded sends"""
+        return len(self._entries)
+
+    def _expire(self, now):
+        """Remove expired entries, which are the oldest"""
+        entries = self._entries
+        while entries:
+            key, (expires, _) = next(iter(entries.items()))
+            if expires > now:
+                break
+            del entries[key]
+
+    @staticmethod
+    def get_key(body):
+        """Return idempotency key for encoded send request body"""
+        return get_idempotency_key(body)
+
+    def get(self, key):
+        """Return result of completed send with key, or None"""
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(key)
+        return None if entry is None else entry[1]
+
+    def set(self, key, result):
+        """Record result of completed send with key"""
+        with self._lock:
+            now = time.monotonic()
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self._ttl, result)
+            self._expire(now)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Forget send with key, or all sends if no key is given"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def call(self, key, send, deadline=None):
+        """Return result of completed send with key, otherwise call send and record its result.
+        deadline limits waiting for a concurrent send, as for RequestCoalescer.call."""
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+
+        def load():
+            """Send and record result"""
+            # Check again, in case a concurrent send completed after the first check
+            completed = self.get(key)
+            if completed is not None:
+                return completed
+            sent = send()
+            self.set(key, sent)
+            return sent
+
+        return self._coalescer.call(key, load, deadline)
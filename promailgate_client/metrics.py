@@ -0,0 +1,165 @@
+"""Metrics instrumentation for send and status requests"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import bisect
+import threading
+
+# Number of HTTP responses, by operation (send or status) and outcome (status code, unknown or error)
+REQUESTS_TOTAL = 'promailgate_client_requests_total'
+# Duration of send_email and get_message_status calls, including retries
+CALL_DURATION = 'promailgate_client_call_duration_seconds'
+# Calls to send_email and get_message_status in progress
+IN_FLIGHT = 'promailgate_client_in_flight'
+# Number of retried requests
+RETRIES_TOTAL = 'promailgate_client_retries_total'
+# HTTP requests in progress, each holding a pooled connection
+POOL_IN_USE = 'promailgate_client_pool_connections_in_use'
+# Sends waiting in dispatcher, by lane
+DISPATCH_QUEUED = 'promailgate_client_dispatch_queued'
+# Time sends waited in dispatcher before starting, by lane
+DISPATCH_WAIT = 'promailgate_client_dispatch_wait_seconds'
+
+DESCRIPTIONS = {
+    REQUESTS_TOTAL: 'HTTP responses by operation and outcome',
+    CALL_DURATION: 'Duration of client calls, including retries',
+    IN_FLIGHT: 'Client calls in progress',
+    RETRIES_TOTAL: 'Retried requests',
+    POOL_IN_USE: 'HTTP requests in progress on pooled connections',
+    DISPATCH_QUEUED: 'Sends waiting in dispatcher by lane',
+    DISPATCH_WAIT: 'Time sends waited in dispatcher by lane',
+}
+
+# Status codes with a meaning in the Promailgate API, which are reported individually
+KNOWN_STATUS_CODES = frozenset([200, 201, 400, 401, 404, 500])
+
+# Outcome of a request that failed without a response
+OUTCOME_ERROR = 'error'
+OUTCOME_UNKNOWN = 'unknown'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def get_outcome(status_code):
+    """Return outcome label for response status code"""
+    if status_code in KNOWN_STATUS_CODES:
+        return str(status_code)
+    return OUTCOME_UNKNOWN
+
+
+class MetricsSink(object):
+    """Interface for receivers of client metrics"""
+
+    def increment(self, name, value=1, labels=None):
+        """Increment counter"""
+        raise NotImplementedError
+
+    def observe(self, name, value, labels=None):
+        """Record value in histogram"""
+        raise NotImplementedError
+
+    def gauge_add(self, name, value, labels=None):
+        """Add value (which may be negative) to gauge"""
+        raise NotImplementedError
+
+
+def _get_key(name, labels):
+    """Return hashable key for metric and labels"""
+    if not labels:
+        return name, ()
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=None):
+    """Format labels in Prometheus text format"""
+    if extra is not None:
+        labels = labels + (extra,)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels)
+
+
+def _format_value(value):
+    """Format sample value"""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class PrometheusMetrics(MetricsSink):
+    """Thread-safe in-memory metrics, exported in Prometheus text format"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """Setup variables"""
+        self._buckets = tuple(sorted(buckets))
+        self._counters = {}
+        self._gauges = {}
+        # Map of key to [bucket counts, sum, count]
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1, labels=None):
+        """Increment counter"""
+        key = _get_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge_add(self, name, value, labels=None):
+        """Add value to gauge"""
+        key = _get_key(name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        """Record value in histogram"""
+        key = _get_key(name, labels)
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = [[0] * (len(self._buckets) + 1), 0.0, 0]
+                self._histograms[key] = histogram
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def get(self, name, labels=None):
+        """Return value of counter or gauge, or count of histogram"""
+        key = _get_key(name, labels)
+        with self._lock:
+            if key in self._histograms:
+                return self._histograms[key][2]
+            return self._counters.get(key, self._gauges.get(key, 0))
+
+    def render(self):
+        """Return all metrics in Prometheus text exposition format"""
+        with self._lock:
+            samples = {}
+            for values, metric_type in ((self._counters, 'counter'), (self._gauges, 'gauge')):
+                for (name, labels), value in sorted(values.items()):
+                    samples.setdefault((name, metric_type), []).append(
+                        '%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+
+            for (name, labels), (bucket_counts, total, count) in sorted(self._histograms.items()):
+                lines = samples.setdefault((name, 'histogram'), [])
+                cumulative = 0
+                for bound, bucket_count in zip(self._buckets + (float('inf'),), bucket_counts):
+                    cumulative += bucket_count
+                    lines.append('%s_bucket%s %s' % (
+                        name, _format_labels(labels, ('le', _format_value(bound))), cumulative))
+                lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_value(total)))
+                lines.append('%s_count%s %s' % (name, _format_labels(labels), count))
+
+        output = []
+        for (name, metric_type), lines in sorted(samples.items()):
+            description = DESCRIPTIONS.get(name)
+            if description is not None:
+                output.append('# HELP %s %s' % (name, description))
+            output.append('# TYPE %s %s' % (name, metric_type))
+            output.extend(lines)
+        return '\n'.join(output) + '\n'
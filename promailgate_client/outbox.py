@@ -0,0 +1,225 @@
+"""Durable local outbox, spooling sends to SQLite and sending them in the background"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import sqlite3
+import threading
+import time
+
+import promailgate_client.errors
+import promailgate_client.retry
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipient TEXT NOT NULL,
+    api_key TEXT,
+    data BLOB,
+    return_id INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    message_id TEXT,
+    error TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (state, next_attempt, id);
+'''
+
+STATE_PENDING = 'pending'
+STATE_SENT = 'sent'
+STATE_FAILED = 'failed'
+
+
+class Outbox(object):
+    """Spool sends to a local SQLite database and send them from a background thread.
+
+    enqueue only writes to the local database, so returns without waiting on the
+    server. The flusher sends pending rows in batches through client.send_many.
+    Sends that fail with a retryable error are retried with backoff, up to
+    max_attempts, and other failures are marked as failed.
+    Pending rows survive restarts and are sent once the outbox is started again.
+    A send interrupted by a crash, after reaching the server but before its
+    result was recorded, is sent again on restart (at-least-once delivery).
+    Only one Outbox should use a database file at a time."""
+
+    def __init__(
+            self,
+            client,
+            path,
+            batch_size=100,
+            concurrency=10,
+            flush_interval=1.0,
+            max_attempts=5,
+            retry_policy=None,
+            keep_sent=False):
+        """Setup variables
+
+        retry_policy determines which errors are retryable and the delay before
+        retrying. keep_sent retains rows for successful sends, rather than
+        deleting them."""
+        self._client = client
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._flush_interval = flush_interval
+        self._max_attempts = max_attempts
+        if retry_policy is None:
+            retry_policy = promailgate_client.retry.RetryPolicy(backoff_base=1.0, backoff_max=300.0)
+        self._retry_policy = retry_policy
+        self._keep_sent = keep_sent
+        self._serializer = client._serializer
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db_lock = threading.Lock()
+        with self._db_lock:
+            # Write-ahead log allows fast appends, without syncing every transaction to disk
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(_SCHEMA)
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._deadline = None
+        self.last_error = None
+
+    def __enter__(self):
+        """Start flusher when entering context"""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Drain and close outbox when leaving context"""
+        self.close()
+
+    def enqueue(self, recipient, api_key=None, data=None, return_id=True):
+        """Add send to outbox, returning ID of outbox row"""
+        # Basic check to ensure that recipient is not an empty string
+        if not recipient:
+            raise promailgate_client.errors.NoRecipientProvidedError('No recipient has been provided')
+
+        encoded_data = self._serializer.dumps(data if data is not None else {})
+        with self._db_lock:
+            cursor = self._db.execute(
+                'INSERT INTO outbox (recipient, api_key, data, return_id, created) VALUES (?, ?, ?, ?, ?)',
+                (recipient, api_key, encoded_data, int(bool(return_id)), time.time()))
+        self._wake.set()
+        return cursor.lastrowid
+
+    def count(self, state=STATE_PENDING):
+        """Return number of rows in the given state"""
+        with self._db_lock:
+            return self._db.execute('SELECT COUNT(*) FROM outbox WHERE state = ?', (state,)).fetchone()[0]
+
+    def get(self, row_id):
+        """Return state, message ID and error of outbox row"""
+        with self._db_lock:
+            row = self._db.execute(
+                'SELECT state, message_id, error FROM outbox WHERE id = ?', (row_id,)).fetchone()
+        if row is None:
+            return None
+        return {'state': row[0], 'message_id': row[1], 'error': row[2]}
+
+    def _fetch_batch(self):
+        """Return batch of rows that are due to be sent"""
+        with self._db_lock:
+            return self._db.execute(
+                'SELECT id, recipient, api_key, data, return_id, attempts FROM outbox '
+                'WHERE state = ? AND next_attempt <= ? ORDER BY id LIMIT ?',
+                (STATE_PENDING, time.time(), self._batch_size)).fetchall()
+
+    def _get_update(self, row, result, now):
+        """Return SQL statement and parameters recording result of send"""
+        row_id, attempts = row[0], row[5] + 1
+        if result.ok:
+            message_id = result.message_id if result.message_id is not True else None
+            if self._keep_sent:
+                return ('UPDATE outbox SET state = ?, attempts = ?, message_id = ?, error = NULL WHERE id = ?',
+                        (STATE_SENT, attempts, message_id, row_id))
+            return 'DELETE FROM outbox WHERE id = ?', (row_id,)
+
+        error = '%s: %s' % (result.error.__class__.__name__, result.error)
+        if self._retry_policy.is_retryable(result.error) and attempts < self._max_attempts:
+            return ('UPDATE outbox SET attempts = ?, next_attempt = ?, error = ? WHERE id = ?',
+                    (attempts, now + self._retry_policy.get_backoff(attempts), error, row_id))
+        return ('UPDATE outbox SET state = ?, attempts = ?, error = ? WHERE id = ?',
+                (STATE_FAILED, attempts, error, row_id))
+
+    def flush(self):
+        """Send one batch of due rows, returning the number of rows processed"""
+        rows = self._fetch_batch()
+        if not rows:
+            return 0
+
+        items = [{
+            'recipient': row[1],
+            'api_key': row[2],
+            'data': self._serializer.loads(row[3]),
+            'return_id': bool(row[4])
+        } for row in rows]
+        results = list(self._client.send_many(items, concurrency=self._concurrency))
+
+        now = time.time()
+        updates = [self._get_update(row, result, now) for row, result in zip(rows, results)]
+        with self._db_lock:
+            self._db.execute('BEGIN')
+            try:
+                for statement, parameters in updates:
+                    self._db.execute(statement, parameters)
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return len(rows)
+
+    def _run(self):
+        """Flush outbox until stopped, then drain until deadline"""
+        while True:
+            stopping = self._stop.is_set()
+            if stopping and self._deadline is not None and time.monotonic() >= self._deadline:
+                return
+
+            try:
+                processed = self.flush()
+            except Exception as exc:
+                # Keep flusher running, e.g. whilst the database is locked, and retry after interval
+                self.last_error = exc
+                processed = 0
+
+            if not processed:
+                if stopping:
+                    return
+                self._wake.wait(self._flush_interval)
+                self._wake.clear()
+
+    def start(self):
+        """Start background flusher"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._deadline = None
+        self._thread = threading.Thread(target=self._run, name='promailgate-outbox', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop background flusher, first sending due rows for up to timeout seconds.
+        A batch in progress at the deadline is completed and rows not sent
+        before the deadline remain in the outbox."""
+        if self._thread is None:
+            return
+        if timeout is not None:
+            self._deadline = time.monotonic() + timeout
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def close(self, timeout=None):
+        """Stop flusher, draining due rows for up to timeout seconds, and close database"""
+        self.stop(timeout=timeout)
+        with self._db_lock:
+            self._db.close()
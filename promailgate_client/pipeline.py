@@ -0,0 +1,172 @@
+"""Streaming campaign pipeline, reading recipients from files and writing results to sinks"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import csv
+from json import dumps, loads
+
+
+def _open(path_or_file, mode):
+    """Return file object and whether it was opened by us"""
+    if hasattr(path_or_file, 'read') or hasattr(path_or_file, 'write'):
+        return path_or_file, False
+    return open(path_or_file, mode, newline='' if 'b' not in mode else None), True
+
+
+def read_jsonl(path_or_file):
+    """Lazily read send items from a JSON lines file.
+    Each line must be an object containing send_email arguments."""
+    handle, opened = _open(path_or_file, 'r')
+    try:
+        for line in handle:
+            line = line.strip()
+            if line:
+                yield loads(line)
+    finally:
+        if opened:
+            handle.close()
+
+
+def _parse_bool(value):
+    """Convert CSV value to boolean"""
+    return value.strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def read_csv(path_or_file, recipient_field='recipient'):
+    """Lazily read send items from a CSV file with a header row.
+    The recipient_field column provides the recipient, api_key and return_id
+    columns are used if present and all other columns are passed in data."""
+    handle, opened = _open(path_or_file, 'r')
+    try:
+        for row in csv.DictReader(handle):
+            item = {'recipient': row.pop(recipient_field)}
+            if 'api_key' in row:
+                item['api_key'] = row.pop('api_key') or None
+            if 'return_id' in row:
+                item['return_id'] = _parse_bool(row.pop('return_id'))
+            item['data'] = row
+            yield item
+    finally:
+        if opened:
+            handle.close()
+
+
+def read_items(path):
+    """Lazily read send items from a file, using the file extension to determine the format"""
+    if path.lower().endswith('.csv'):
+        return read_csv(path)
+    return read_jsonl(path)
+
+
+class ResultSink(object):
+    """Base class for destinations of send results"""
+
+    def write(self, result):
+        """Write a single promailgate_client.bulk.SendResult"""
+        raise NotImplementedError
+
+    def close(self):
+        """Flush and close sink"""
+        pass
+
+    def __enter__(self):
+        """Allow sink to be used as a context manager"""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close sink when leaving context"""
+        self.close()
+
+
+def result_to_dict(result):
+    """Convert send result to a JSON-serialisable dict"""
+    if result.ok:
+        return {'index': result.index, 'recipient': result.recipient, 'message_id': result.message_id}
+    return {
+        'index': result.index,
+        'recipient': result.recipient,
+        'error': result.error.__class__.__name__,
+        'reason': str(result.error)
+    }
+
+
+class JsonlResultSink(ResultSink):
+    """Write results to a JSON lines file"""
+
+    def __init__(self, path_or_file, flush_every=1000):
+        """Setup variables"""
+        self._handle, self._opened = _open(path_or_file, 'a')
+        self._flush_every = flush_every
+        self._unflushed = 0
+
+    def write(self, result):
+        """Write result as a single line"""
+        self._handle.write(dumps(result_to_dict(result)) + '\n')
+        self._unflushed += 1
+        if self._unflushed >= self._flush_every:
+            self._handle.flush()
+            self._unflushed = 0
+
+    def close(self):
+        """Flush and close file"""
+        self._handle.flush()
+        if self._opened:
+            self._handle.close()
+
+
+class CallbackResultSink(ResultSink):
+    """Pass each result to a callback"""
+
+    def __init__(self, callback):
+        """Setup variables"""
+        self._callback = callback
+
+    def write(self, result):
+        """Pass result to callback"""
+        self._callback(result)
+
+
+class CampaignSummary(object):
+    """Counts of results from a campaign"""
+
+    def __init__(self):
+        """Setup variables"""
+        self.sent = 0
+        self.failed = 0
+        self.errors = {}
+
+    @property
+    def total(self):
+        """Total number of processed items"""
+        return self.sent + self.failed
+
+    def add(self, result):
+        """Update counts from a send result"""
+        if result.ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+            error_name = result.error.__class__.__name__
+            self.errors[error_name] = self.errors.get(error_name, 0) + 1
+
+
+def run_campaign(client, items, sink, concurrency=10, max_in_flight=None, ordered=False):
+    """Send all items through client, writing each result to sink as it completes.
+
+    items may be any iterable (e.g. read_jsonl or read_csv) and is consumed lazily,
+    with at most max_in_flight sends (default: twice the concurrency) pending,
+    so memory use does not depend on the number of items.
+    Returns a CampaignSummary."""
+    summary = CampaignSummary()
+    results = client.send_many(items, concurrency=concurrency, ordered=ordered, window=max_in_flight)
+    try:
+        for result in results:
+            sink.write(result)
+            summary.add(result)
+    finally:
+        results.close()
+    return summary
@@ -0,0 +1,194 @@
+"""Client-side token bucket rate limiting"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket, permitting rate requests per second with bursts of up to capacity.
+
+    Blocking acquires reserve their token immediately and then sleep until it is due,
+    so waiting callers are served in order and the lock is never held whilst sleeping."""
+
+    def __init__(self, rate, capacity=None):
+        """Setup variables"""
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self._rate = float(rate)
+        self._capacity = float(capacity if capacity is not None else max(1, rate))
+        self._tokens = self._capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, tokens, blocking, timeout):
+        """Take tokens from up to date bucket, returning delay until reserved tokens
+        are available, or None if tokens could not be reserved"""
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0
+        if not blocking:
+            return None
+        delay = (tokens - self._tokens) / self._rate
+        if timeout is not None and delay > timeout:
+            return None
+        # Reserve tokens, leaving bucket in debt until they have accrued
+        self._tokens -= tokens
+        return delay
+
+    def _reserve(self, tokens, blocking, timeout):
+        """Update bucket and take tokens, returning delay or None"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            return self._take(tokens, blocking, timeout)
+
+    def acquire(self, tokens=1, blocking=True, timeout=None):
+        """Take tokens from bucket, waiting until they are available if blocking.
+        Returns whether tokens were acquired."""
+        delay = self._reserve(tokens, blocking, timeout)
+        if delay is None:
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+
+class FileTokenBucket(TokenBucket):
+    """Token bucket with state held in a memory-mapped file, shared between processes on one host.
+
+    All processes using the same path share a single budget.
+    Updates are serialised with an exclusive file lock (POSIX only)."""
+
+    _STATE = struct.Struct('dd')
+
+    def __init__(self, path, rate, capacity=None):
+        """Setup variables"""
+        if fcntl is None:
+            raise RuntimeError('FileTokenBucket requires fcntl, which is not available on this platform')
+        super(FileTokenBucket, self).__init__(rate, capacity=capacity)
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # Initialise state for first process to use the file
+            if os.fstat(self._fd).st_size < self._STATE.size:
+                os.ftruncate(self._fd, self._STATE.size)
+                os.pwrite(self._fd, self._STATE.pack(self._capacity, time.time()), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, self._STATE.size)
+
+    def _reserve(self, tokens, blocking, timeout):
+        """Update shared bucket, returning delay or None"""
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._tokens, last = self._STATE.unpack_from(self._map)
+                # Wall clock is used, as monotonic clocks are not comparable between processes
+                now = time.time()
+                self._tokens = min(self._capacity, self._tokens + max(0, now - last) * self._rate)
+                delay = self._take(tokens, blocking, timeout)
+                self._STATE.pack_into(self._map, 0, self._tokens, now)
+                return delay
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        """Close shared state file"""
+        self._map.close()
+        os.close(self._fd)
+
+
+class RateLimiter(object):
+    """Rate limit requests separately for each key (API key), using a token bucket per key"""
+
+    def __init__(self, rate, capacity=None, bucket_factory=None):
+        """Setup variables
+
+        bucket_factory, if provided, is called with the key to create its bucket.
+        By default, an in-process TokenBucket is used."""
+        self._rate = rate
+        self._capacity = capacity
+        self._bucket_factory = bucket_factory
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _create_bucket(self, key):
+        """Create bucket for key"""
+        if self._bucket_factory is not None:
+            return self._bucket_factory(key)
+        return TokenBucket(self._rate, self._capacity)
+
+    def get_bucket(self, key):
+        """Return bucket for key, creating it if it does not exist"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._create_bucket(key)
+                    self._buckets[key] = bucket
+        return bucket
+
+    def acquire(self, key, tokens=1, blocking=True, timeout=None):
+        """Take tokens from bucket for key, returning whether tokens were acquired"""
+        return self.get_bucket(key).acquire(tokens=tokens, blocking=blocking, timeout=timeout)
+
+    def close(self):
+        """Close all buckets holding resources"""
+        with self._lock:
+            for bucket in self._buckets.values():
+                if hasattr(bucket, 'close'):
+                    bucket.close()
+            self._buckets = {}
+
+
+class SharedRateLimiter(RateLimiter):
+    """Rate limiter whose budget per key is shared by all processes using the same directory.
+    If per_key is False, a single budget is shared by all keys."""
+
+    def __init__(self, directory, rate, capacity=None, per_key=True):
+        """Setup variables"""
+        super(SharedRateLimiter, self).__init__(rate, capacity=capacity)
+        self._directory = directory
+        self._per_key = per_key
+
+    def __getstate__(self):
+        """Return state for pickling, allowing limiter to be passed to worker processes.
+        Buckets are reopened from their files, rather than copied."""
+        return {
+            'directory': self._directory,
+            'rate': self._rate,
+            'capacity': self._capacity,
+            'per_key': self._per_key,
+        }
+
+    def __setstate__(self, state):
+        """Restore limiter from pickled state"""
+        self.__init__(**state)
+
+    def get_bucket(self, key):
+        """Return bucket for key, creating it if it does not exist"""
+        return super(SharedRateLimiter, self).get_bucket(key if self._per_key else '')
+
+    def _create_bucket(self, key):
+        """Create file-backed bucket for key.
+        The file is named after a hash of the key, to avoid writing API keys to disk."""
+        file_name = 'promailgate-%s.bucket' % hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+        return FileTokenBucket(os.path.join(self._directory, file_name), self._rate, self._capacity)
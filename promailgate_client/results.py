@@ -0,0 +1,395 @@
+"""Compact columnar store of send results, for campaigns too large to hold as Python objects"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+from array import array
+from bisect import bisect_left
+from collections import Counter
+import csv
+import hashlib
+import itertools
+from json import dumps, loads
+import mmap
+import os
+
+import promailgate_client.pipeline
+import promailgate_client.tracker
+
+# Code of rows without an error or status
+NO_CODE = -1
+
+# Name of file holding interned strings of a persisted store
+STRINGS_FILE = 'strings.json'
+
+
+def _hash_message_id(message_id):
+    """Return 64 bit hash of message ID, used to index rows"""
+    return int.from_bytes(hashlib.blake2b(message_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class _Interner(object):
+    """Map of repeated values to integer codes"""
+
+    def __init__(self, values=()):
+        """Setup variables"""
+        self.values = []
+        self._codes = {}
+        for value in values:
+            self.intern(value)
+
+    def intern(self, value):
+        """Return code for value, assigning one if it has not been seen"""
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self._codes[value] = code
+        return code
+
+    def get(self, code):
+        """Return value for code"""
+        return None if code == NO_CODE else self.values[code]
+
+
+class _Column(object):
+    """Column of fixed-size values, held in an array and optionally spilled to a memory-mapped file"""
+
+    def __init__(self, typecode, path=None, writable=False):
+        """Setup variables"""
+        self._typecode = typecode
+        self._path = path
+        self._writable = writable
+        self._buffer = array(typecode)
+        self._file_length = 0
+        self._mmap = None
+        self._view = None
+        if path is not None and os.path.exists(path):
+            self._file_length = os.path.getsize(path) // self._buffer.itemsize
+
+    def __len__(self):
+        """Number of values"""
+        return self._file_length + len(self._buffer)
+
+    def _get_view(self):
+        """Return view of values in file, mapping file if it is not yet mapped"""
+        if self._view is None:
+            with open(self._path, 'r+b' if self._writable else 'rb') as handle:
+                self._mmap = mmap.mmap(
+                    handle.fileno(), 0, access=mmap.ACCESS_WRITE if self._writable else mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap).cast(self._typecode)
+        return self._view
+
+    def __getitem__(self, index):
+        """Return value at index"""
+        if index < self._file_length:
+            return self._get_view()[index]
+        return self._buffer[index - self._file_length]
+
+    def __setitem__(self, index, value):
+        """Replace value at index"""
+        if index < self._file_length:
+            self._get_view()[index] = value
+        else:
+            self._buffer[index - self._file_length] = value
+
+    def __iter__(self):
+        """Iterate over values"""
+        if not self._file_length:
+            return iter(self._buffer)
+        return itertools.chain(self._get_view(), self._buffer)
+
+    def get_bytes(self, start, end):
+        """Return values from start to end as bytes.
+        Values are spilled together, so do not span the file and buffer."""
+        if start >= self._file_length:
+            return self._buffer[start - self._file_length:end - self._file_length].tobytes()
+        return self._get_view()[start:end].tobytes()
+
+    def append(self, value):
+        """Append value"""
+        self._buffer.append(value)
+
+    def extend(self, data):
+        """Append values from bytes"""
+        self._buffer.frombytes(data)
+
+    def _unmap(self):
+        """Unmap file, flushing any changes"""
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+            if self._writable:
+                self._mmap.flush()
+            self._mmap.close()
+            self._mmap = None
+
+    def spill(self):
+        """Append buffered values to file"""
+        if self._path is None or not self._buffer:
+            return
+        self._unmap()
+        with open(self._path, 'ab') as handle:
+            self._buffer.tofile(handle)
+        self._file_length += len(self._buffer)
+        self._buffer = array(self._typecode)
+
+    def close(self):
+        """Spill buffered values and unmap file"""
+        self.spill()
+        self._unmap()
+
+
+class _StringColumn(object):
+    """Column of strings, stored as concatenated UTF-8 data and an end offset column"""
+
+    def __init__(self, path=None):
+        """Setup variables"""
+        self._path = path
+        self._offsets = _Column('q', None if path is None else path + '.off')
+        self._data = _Column('B', None if path is None else path + '.dat')
+        self._size = self._offsets[len(self._offsets) - 1] if len(self._offsets) else 0
+
+    def __len__(self):
+        """Number of strings"""
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        """Return string at index"""
+        start = self._offsets[index - 1] if index else 0
+        value = self._data.get_bytes(start, self._offsets[index])
+        return value.decode('utf-8')
+
+    def append(self, value):
+        """Append string"""
+        encoded = value.encode('utf-8')
+        self._data.extend(encoded)
+        self._size += len(encoded)
+        self._offsets.append(self._size)
+
+    def spill(self):
+        """Append buffered strings to file"""
+        self._data.spill()
+        self._offsets.spill()
+
+    def close(self):
+        """Spill buffered strings and unmap files"""
+        self._data.close()
+        self._offsets.close()
+
+
+class ResultRecord(object):
+    """Send result read from a ResultStore"""
+
+    __slots__ = ('row', 'index', 'recipient', 'message_id', 'error', 'reason', 'state')
+
+    def __init__(self, row, index, recipient, message_id, error, reason, state):
+        """Setup variables"""
+        self.row = row
+        self.index = index
+        self.recipient = recipient
+        self.message_id = message_id
+        self.error = error
+        self.reason = reason
+        self.state = state
+
+    @property
+    def ok(self):
+        """Whether the send succeeded"""
+        return self.error is None
+
+    def __repr__(self):
+        """Return representation of record"""
+        return 'ResultRecord(index=%r, recipient=%r, message_id=%r, error=%r, state=%r)' % (
+            self.index, self.recipient, self.message_id, self.error, self.state)
+
+
+class ResultStore(promailgate_client.pipeline.ResultSink):
+    """Columnar record of send results, using around 100 bytes per result.
+
+    Each result is stored as a row of typed arrays, with error names and message
+    states interned as integer codes, rather than as Python objects. Error reasons
+    are stored in a string column, rather than interned, as they may include the recipient.
+    If path is provided, columns are stored in files in that directory: rows are
+    spilled to the files every spill_rows results and the files are memory-mapped
+    for reading, so the store may be much larger than memory. An existing store
+    at path is appended to.
+    Message states from get_message_status may be joined to the results with
+    join_statuses, for producing campaign reports."""
+
+    def __init__(self, path=None, spill_rows=100000):
+        """Setup variables"""
+        self._path = path
+        self._spill_rows = spill_rows
+        strings = {'errors': [], 'states': []}
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            strings_path = os.path.join(path, STRINGS_FILE)
+            if os.path.exists(strings_path):
+                with open(strings_path, 'r') as handle:
+                    strings = loads(handle.read())
+
+        self._errors = _Interner(strings['errors'])
+        self._states = _Interner(strings['states'])
+        self._index = _Column('q', self._get_column_path('index'))
+        self._recipients = _StringColumn(self._get_column_path('recipient'))
+        self._message_ids = _StringColumn(self._get_column_path('message_id'))
+        self._error_codes = _Column('i', self._get_column_path('error'))
+        self._reasons = _StringColumn(self._get_column_path('reason'))
+        self._state_codes = _Column('i', self._get_column_path('state'), writable=True)
+        self._columns = (
+            self._index, self._recipients, self._message_ids, self._error_codes, self._reasons, self._state_codes)
+        self._unspilled = 0
+        # Sorted message ID hashes and their rows, built when first joining
+        self._id_hashes = None
+        self._id_rows = None
+
+    def _get_column_path(self, name):
+        """Return path of column file, or None if the store is held in memory"""
+        return None if self._path is None else os.path.join(self._path, name)
+
+    def __len__(self):
+        """Number of results"""
+        return len(self._index)
+
+    def write(self, result):
+        """Record a single promailgate_client.bulk.SendResult"""
+        self._index.append(result.index)
+        self._recipients.append(result.recipient or '')
+        # Sends made with return_id disabled have no message ID
+        self._message_ids.append(result.message_id if isinstance(result.message_id, str) else '')
+        if result.ok:
+            self._error_codes.append(NO_CODE)
+            self._reasons.append('')
+        else:
+            self._error_codes.append(self._errors.intern(result.error.__class__.__name__))
+            self._reasons.append(str(result.error))
+        self._state_codes.append(NO_CODE)
+        self._id_hashes = None
+
+        self._unspilled += 1
+        if self._path is not None and self._unspilled >= self._spill_rows:
+            self.flush()
+
+    def __getitem__(self, row):
+        """Return ResultRecord for row"""
+        if not 0 <= row < len(self):
+            raise IndexError('Row out of range: %s' % row)
+        error = self._errors.get(self._error_codes[row])
+        return ResultRecord(
+            row=row,
+            index=self._index[row],
+            recipient=self._recipients[row],
+            message_id=self._message_ids[row] or None,
+            error=error,
+            reason=None if error is None else self._reasons[row],
+            state=self._states.get(self._state_codes[row]))
+
+    def __iter__(self):
+        """Iterate over records"""
+        for row in range(len(self)):
+            yield self[row]
+
+    def _build_id_index(self):
+        """Build sorted index of message ID hashes to rows"""
+        keys = sorted(
+            (_hash_message_id(self._message_ids[row]) << 32) | row
+            for row in range(len(self))
+            if self._error_codes[row] == NO_CODE and self._message_ids[row])
+        self._id_hashes = array('Q', (key >> 32 for key in keys))
+        self._id_rows = array('Q', (key & 0xFFFFFFFF for key in keys))
+
+    def find(self, message_id):
+        """Return row of result with message ID, or None"""
+        if self._id_hashes is None:
+            self._build_id_index()
+        id_hash = _hash_message_id(message_id)
+        position = bisect_left(self._id_hashes, id_hash)
+        # Check message ID of each row with the same hash, in case of collisions
+        while position < len(self._id_hashes) and self._id_hashes[position] == id_hash:
+            row = self._id_rows[position]
+            if self._message_ids[row] == message_id:
+                return row
+            position += 1
+        return None
+
+    def update_status(self, message_id, status):
+        """Record message state from status returned by get_message_status,
+        returning whether the message was found"""
+        row = self.find(message_id)
+        if row is None:
+            return False
+        state = promailgate_client.tracker.get_state(status)
+        self._state_codes[row] = NO_CODE if state is None else self._states.intern(state)
+        return True
+
+    def join_statuses(self, statuses):
+        """Record message states from an iterable of promailgate_client.tracker.StatusUpdate
+        objects (e.g. from StatusTracker) or (message ID, status) pairs.
+        Returns the number of statuses matching a result."""
+        matched = 0
+        for status in statuses:
+            if isinstance(status, promailgate_client.tracker.StatusUpdate):
+                if status.status is None:
+                    continue
+                status = (status.message_id, status.status)
+            matched += self.update_status(*status)
+        return matched
+
+    def get_summary(self):
+        """Return dict of counts of sent and failed results, errors and message states,
+        calculated from the code columns without reading each record"""
+        error_counts = Counter(self._error_codes)
+        sent = error_counts.pop(NO_CODE, 0)
+        errors = Counter()
+        for code, count in error_counts.items():
+            errors[self._errors.get(code)] += count
+        state_counts = Counter(self._state_codes)
+        unknown = state_counts.pop(NO_CODE, 0)
+        states = {self._states.get(code): count for code, count in state_counts.items()}
+        if unknown:
+            states[None] = unknown
+        return {'sent': sent, 'failed': len(self) - sent, 'errors': dict(errors), 'states': states}
+
+    def write_csv(self, path_or_file):
+        """Write report of each result and its message state to a CSV file"""
+        handle, opened = promailgate_client.pipeline._open(path_or_file, 'w')
+        try:
+            writer = csv.writer(handle)
+            writer.writerow(['index', 'recipient', 'message_id', 'error', 'reason', 'state'])
+            for record in self:
+                writer.writerow([
+                    record.index, record.recipient, record.message_id or '',
+                    record.error or '', record.reason or '', record.state or ''])
+        finally:
+            if opened:
+                handle.close()
+
+    def _write_strings(self):
+        """Atomically write interned strings to file"""
+        strings_path = os.path.join(self._path, STRINGS_FILE)
+        with open(strings_path + '.tmp', 'w') as handle:
+            handle.write(dumps({'errors': self._errors.values, 'states': self._states.values}))
+        os.replace(strings_path + '.tmp', strings_path)
+
+    def flush(self):
+        """Write buffered results and interned strings to files"""
+        if self._path is None:
+            return
+        for column in self._columns:
+            column.spill()
+        self._write_strings()
+        self._unspilled = 0
+
+    def close(self):
+        """Write buffered results and unmap files"""
+        if self._path is None:
+            return
+        # Strings are written last, as states may have been updated in mapped files
+        for column in self._columns:
+            column.close()
+        self._write_strings()
+        self._unspilled = 0
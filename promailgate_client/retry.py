@@ -0,0 +1,267 @@
+"""Retry policies, retry budget and circuit breaker"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import random
+import threading
+import time
+
+import promailgate_client.errors
+
+# Errors indicating that the server or network, rather than the request, failed
+DEFAULT_RETRY_EXCEPTIONS = (
+    promailgate_client.errors.UnknownSendError,
+    promailgate_client.errors.UnknownServerError,
+    promailgate_client.errors.TransportError,
+)
+
+# Transport errors raised before the request was sent, after which requests that
+# are not idempotent may be retried without risk of the server processing them twice
+UNSENT_EXCEPTIONS = (
+    promailgate_client.errors.TransportConnectError,
+)
+
+
+class RetryBudget(object):
+    """Limit retries across all requests to a proportion of requests made.
+
+    Each request deposits ratio into the budget and each retry withdraws 1.
+    The budget is also topped up at min_retries_per_second, so that
+    occasional failures may be retried when there is little traffic.
+    During an outage, retries are therefore limited to roughly ratio of
+    normal traffic, rather than multiplying load by the number of attempts."""
+
+    def __init__(self, ratio=0.1, min_retries_per_second=1.0, max_balance=10.0):
+        """Setup variables"""
+        self._ratio = ratio
+        self._min_retries_per_second = min_retries_per_second
+        self._max_balance = max_balance
+        self._balance = max_balance
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        """Top up budget with retries accrued over time"""
+        self._balance = min(
+            self._max_balance,
+            self._balance + (now - self._last_refill) * self._min_retries_per_second)
+        self._last_refill = now
+
+    def record_request(self):
+        """Deposit into budget for an initial request"""
+        with self._lock:
+            self._balance = min(self._max_balance, self._balance + self._ratio)
+
+    def try_withdraw(self):
+        """Withdraw a retry from budget, returning whether retry is permitted"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._balance >= 1:
+                self._balance -= 1
+                return True
+            return False
+
+
+class RetryPolicy(object):
+    """Determine which errors are retried and the delay between attempts.
+
+    Delays use exponential backoff with full jitter: a random delay between 0 and
+    backoff_base * 2 ^ (attempt - 1), capped at backoff_max.
+    Requests that are not idempotent, such as sends without an idempotency key, are
+    only retried after transport errors if the request was not sent (unsent_exceptions),
+    as the server may otherwise have processed the request before the connection failed."""
+
+    def __init__(
+            self,
+            max_attempts=3,
+            backoff_base=0.1,
+            backoff_max=10.0,
+            jitter=True,
+            retry_exceptions=DEFAULT_RETRY_EXCEPTIONS,
+            budget=None,
+            unsent_exceptions=UNSENT_EXCEPTIONS):
+        """Setup variables"""
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be at least 1')
+        self.max_attempts = max_attempts
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._jitter = jitter
+        self._retry_exceptions = retry_exceptions
+        self._budget = budget
+        self._unsent_exceptions = unsent_exceptions
+
+    def is_retryable(self, exc, idempotent=True):
+        """Return whether error may be retried, for an idempotent request or otherwise"""
+        if not isinstance(exc, self._retry_exceptions):
+            return False
+        if idempotent or not isinstance(exc, promailgate_client.errors.TransportError):
+            return True
+        return isinstance(exc, self._unsent_exceptions)
+
+    def get_backoff(self, attempt):
+        """Return delay before retrying, after the given number of failed attempts"""
+        delay = min(self._backoff_max, self._backoff_base * (2 ** (attempt - 1)))
+        if self._jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def record_request(self):
+        """Record initial request in retry budget"""
+        if self._budget is not None:
+            self._budget.record_request()
+
+    def allow_retry(self):
+        """Return whether the retry budget permits a retry"""
+        return self._budget is None or self._budget.try_withdraw()
+
+
+class CircuitBreaker(object):
+    """Fail fast whilst the endpoint is unhealthy.
+
+    After failure_threshold consecutive failures, the circuit opens and requests
+    raise promailgate_client.errors.CircuitOpenError without being sent.
+    Once reset_timeout has elapsed, up to half_open_max_calls trial requests are
+    permitted; a successful trial closes the circuit and a failure re-opens it."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+            self,
+            failure_threshold=5,
+            reset_timeout=30.0,
+            half_open_max_calls=1,
+            failure_exceptions=DEFAULT_RETRY_EXCEPTIONS):
+        """Setup variables"""
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._half_open_max_calls = half_open_max_calls
+        self._failure_exceptions = failure_exceptions
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._half_open_calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """Current state of circuit"""
+        with self._lock:
+            self._update_state(time.monotonic())
+            return self._state
+
+    def _update_state(self, now):
+        """Move from open to half-open once reset timeout has elapsed"""
+        if self._state == self.OPEN and now - self._opened_at >= self._reset_timeout:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+
+    def _open(self, now):
+        """Open circuit"""
+        self._state = self.OPEN
+        self._opened_at = now
+
+    def before_call(self):
+        """Raise CircuitOpenError if a request is not currently permitted"""
+        with self._lock:
+            self._update_state(time.monotonic())
+            if self._state == self.OPEN:
+                raise promailgate_client.errors.CircuitOpenError('Circuit breaker is open')
+            if self._state == self.HALF_OPEN:
+                if self._half_open_calls >= self._half_open_max_calls:
+                    raise promailgate_client.errors.CircuitOpenError('Circuit breaker is open')
+                self._half_open_calls += 1
+
+    def is_failure(self, exc):
+        """Return whether error indicates that the endpoint is unhealthy.
+        A deadline exceeded whilst awaiting a response is a failure of the
+        error that cut the request short, such as a timeout."""
+        if isinstance(exc, promailgate_client.errors.DeadlineExceededError) and exc.__cause__ is not None:
+            exc = exc.__cause__
+        return isinstance(exc, self._failure_exceptions)
+
+    def record_success(self):
+        """Record successful request, closing circuit"""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_cancelled(self):
+        """Record request that did not complete, which shows neither success nor failure,
+        releasing its trial if the circuit is half-open"""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._half_open_calls:
+                self._half_open_calls -= 1
+
+    def record_failure(self):
+        """Record failed request, opening circuit if threshold is reached"""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.HALF_OPEN:
+                self._open(now)
+                return
+            self._failures += 1
+            if self._failures >= self._failure_threshold:
+                self._open(now)
+
+
+def call_with_retry(func, policy=None, circuit_breaker=None, on_retry=None, deadline=None, idempotent=True):
+    """Call func, retrying according to policy and guarded by circuit_breaker.
+    idempotent indicates whether func may be repeated after it may have reached the server.
+
+    on_retry, if provided, is called with the attempt number and error before each retry.
+    deadline, if provided, is the time.monotonic() time by which the call must complete.
+    DeadlineExceededError is raised, rather than retrying, if the deadline has passed
+    or would pass during the backoff delay. func is responsible for limiting each
+    attempt to the time remaining."""
+    if policy is not None:
+        policy.record_request()
+
+    attempt = 0
+    while True:
+        attempt += 1
+        if deadline is not None and time.monotonic() >= deadline:
+            raise promailgate_client.errors.DeadlineExceededError('Deadline exceeded before request was attempted')
+        if circuit_breaker is not None:
+            circuit_breaker.before_call()
+
+        try:
+            result = func()
+        except Exception as exc:
+            if circuit_breaker is not None:
+                if circuit_breaker.is_failure(exc):
+                    circuit_breaker.record_failure()
+                elif isinstance(exc, promailgate_client.errors.DeadlineExceededError):
+                    # Deadline passed before a request completed, e.g. whilst waiting for the rate limit
+                    circuit_breaker.record_cancelled()
+                else:
+                    circuit_breaker.record_success()
+
+            # Raise error if it cannot be retried or no attempts remain
+            if (policy is None or
+                    not policy.is_retryable(exc, idempotent) or
+                    attempt >= policy.max_attempts):
+                raise
+
+            backoff = policy.get_backoff(attempt)
+            # Give up early, without using retry budget, if the retry could not start before the deadline
+            if deadline is not None and time.monotonic() + backoff >= deadline:
+                raise promailgate_client.errors.DeadlineExceededError(
+                    'Deadline exceeded after %s attempts' % attempt) from exc
+            if not policy.allow_retry():
+                raise
+
+            if on_retry is not None:
+                on_retry(attempt, exc)
+            time.sleep(backoff)
+            continue
+
+        if circuit_breaker is not None:
+            circuit_breaker.record_success()
+        return result
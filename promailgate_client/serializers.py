@@ -0,0 +1,69 @@
+"""JSON serializers for request and response bodies"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Serializer(object):
+    """Interface for serializers, which encode request payloads to bytes and decode response bodies"""
+
+    name = None
+
+    def dumps(self, obj):
+        """Encode object to JSON bytes"""
+        raise NotImplementedError
+
+    def loads(self, data):
+        """Decode JSON bytes or string to object"""
+        raise NotImplementedError
+
+
+class JsonSerializer(Serializer):
+    """Serializer using the standard library json module"""
+
+    name = 'json'
+
+    def dumps(self, obj):
+        """Encode object to JSON bytes"""
+        return json.dumps(obj).encode('utf-8')
+
+    def loads(self, data):
+        """Decode JSON bytes or string to object"""
+        return json.loads(data)
+
+
+class OrjsonSerializer(Serializer):
+    """Serializer using orjson, which is considerably faster for large payloads"""
+
+    name = 'orjson'
+
+    def __init__(self):
+        """Ensure orjson is available"""
+        if orjson is None:
+            raise RuntimeError('orjson is not installed')
+
+    def dumps(self, obj):
+        """Encode object to JSON bytes.
+        Non-string keys are permitted, to match behaviour of the json module."""
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data):
+        """Decode JSON bytes or string to object"""
+        return orjson.loads(data)
+
+
+def get_default_serializer():
+    """Return fastest available serializer"""
+    if orjson is not None:
+        return OrjsonSerializer()
+    return JsonSerializer()
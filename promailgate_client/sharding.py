@@ -0,0 +1,281 @@
+"""Sharded sending across a pool of worker processes"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import multiprocessing
+import os
+import pickle
+import queue
+import signal
+import threading
+import time
+import zlib
+
+import promailgate_client.bulk
+import promailgate_client.errors
+import promailgate_client.pipeline
+
+# Message types sent from workers to the parent process
+_RESULTS = 'results'
+_DONE = 'done'
+
+
+def get_shard(recipient, shards):
+    """Return shard for recipient.
+    A stable hash is used, as hash() of strings differs between processes."""
+    return zlib.crc32(str(recipient).encode('utf-8')) % shards
+
+
+def _picklable_error(error):
+    """Return error, or a copy of it that can be sent to the parent process"""
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return promailgate_client.errors.PromailgateClientException('%s: %s' % (error.__class__.__name__, error))
+
+
+def _worker(shard, client_kwargs, concurrency, input_queue, output_queue, batch_size):
+    """Send items from input_queue using a client owned by this process, sending results to output_queue.
+
+    Each input message is a list of (index, item) tuples, terminated by None.
+    Results are forwarded as soon as they complete, batching together
+    results that complete whilst the previous batch is being sent."""
+    # Imported here, so that the client is only created within the worker
+    from concurrent.futures import ThreadPoolExecutor
+    from promailgate_client import PromailgateClient
+
+    # Interrupts are handled by the parent process, which stops sending items to workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    client = PromailgateClient(**client_kwargs)
+    summary = promailgate_client.pipeline.CampaignSummary()
+    completed = queue.Queue()
+
+    def forward():
+        """Forward completed results to parent"""
+        finished = False
+        while not finished:
+            batch = []
+            result = completed.get()
+            while result is not None:
+                summary.add(result)
+                batch.append((result.index, result.recipient, result.message_id,
+                              None if result.ok else _picklable_error(result.error)))
+                if len(batch) >= batch_size:
+                    break
+                try:
+                    result = completed.get_nowait()
+                except queue.Empty:
+                    break
+            finished = result is None
+            if batch:
+                output_queue.put((_RESULTS, shard, batch))
+
+    def send(index, item):
+        """Perform send, queueing result"""
+        completed.put(promailgate_client.bulk._send_item(
+            client.send_email, index, promailgate_client.bulk.normalise_item(item)))
+
+    forwarder = threading.Thread(target=forward, name='promailgate-shard-forwarder', daemon=True)
+    forwarder.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            items = input_queue.get()
+            if items is None:
+                break
+            for index, item in items:
+                executor.submit(send, index, item)
+
+    completed.put(None)
+    forwarder.join()
+    client.close()
+    output_queue.put((_DONE, shard, (summary, time.perf_counter() - start)))
+
+
+class ShardedSender(object):
+    """Send items from a pool of worker processes, each with its own PromailgateClient
+    and connection pool, so that encoding and request handling are not limited by
+    a single interpreter.
+
+    Items are assigned to a shard (worker) by a hash of their recipient, so all
+    sends to a recipient are made by the same worker. Results are merged back into
+    a single stream of promailgate_client.bulk.SendResult objects."""
+
+    def __init__(
+            self,
+            client_kwargs,
+            processes=None,
+            concurrency=10,
+            batch_size=100,
+            max_in_flight=None,
+            start_method='spawn'):
+        """Setup variables
+
+        client_kwargs are the arguments used to create the PromailgateClient in each
+        worker and must be picklable. Each of the processes (default: number of CPUs)
+        performs up to concurrency sends at once. Items are sent to workers in batches
+        of up to batch_size and at most max_in_flight items (default: four times the
+        total concurrency) are pending at once.
+        start_method is the multiprocessing start method, defaulting to spawn, which
+        is safe when the parent process uses threads."""
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if processes < 1:
+            raise ValueError('processes must be at least 1')
+        self._client_kwargs = client_kwargs
+        self._processes = processes
+        self._concurrency = concurrency
+        self._batch_size = batch_size
+        self._max_in_flight = max_in_flight or processes * concurrency * 4
+        self._context = multiprocessing.get_context(start_method)
+
+        # Summary of results yielded by the last send_many and map of shard
+        # to the summary and elapsed time reported by its worker
+        self.summary = promailgate_client.pipeline.CampaignSummary()
+        self.shard_summaries = {}
+
+    def _start_workers(self, output_queue):
+        """Start worker processes, returning their processes and input queues"""
+        workers = []
+        for shard in range(self._processes):
+            input_queue = self._context.Queue()
+            process = self._context.Process(
+                target=_worker,
+                args=(shard, self._client_kwargs, self._concurrency, input_queue, output_queue, self._batch_size),
+                name='promailgate-shard-%s' % shard,
+                daemon=True)
+            process.start()
+            workers.append((process, input_queue))
+        return workers
+
+    def _handle_message(self, message, buffer):
+        """Handle message from worker, adding results to buffer and returning number of results"""
+        message_type, shard, payload = message
+        if message_type == _DONE:
+            self.shard_summaries[shard] = payload
+            return 0
+        for index, recipient, message_id, error in payload:
+            buffer[index] = promailgate_client.bulk.SendResult(index, recipient, message_id=message_id, error=error)
+        return len(payload)
+
+    def _receive(self, output_queue, workers, buffer):
+        """Wait for message from workers, raising an error if a worker exits unexpectedly"""
+        while True:
+            try:
+                return self._handle_message(output_queue.get(timeout=1), buffer)
+            except queue.Empty:
+                for shard, (process, _) in enumerate(workers):
+                    if not process.is_alive() and shard not in self.shard_summaries:
+                        raise RuntimeError('Worker process for shard %s exited with code %s' % (
+                            shard, process.exitcode))
+
+    def send_many(self, items, ordered=True):
+        """Send items, yielding a SendResult per item, in input order if ordered is True.
+        Each item is either a recipient or a dict of send_email arguments."""
+        self.summary = promailgate_client.pipeline.CampaignSummary()
+        self.shard_summaries = {}
+        output_queue = self._context.Queue()
+        workers = self._start_workers(output_queue)
+        batches = [[] for _ in range(self._processes)]
+        buffer = {}
+        next_index = 0
+        submitted = 0
+        received = 0
+        yielded = 0
+        finished = False
+
+        def flush(shard):
+            """Send batch of items to worker"""
+            if batches[shard]:
+                workers[shard][1].put(batches[shard])
+                batches[shard] = []
+
+        def wait_for_results():
+            """Receive at least one message from workers"""
+            received_count = self._receive(output_queue, workers, buffer)
+            # Receive any further messages without blocking, to reduce wakeups
+            while True:
+                try:
+                    received_count += self._handle_message(output_queue.get_nowait(), buffer)
+                except queue.Empty:
+                    return received_count
+
+        items = iter(enumerate(items))
+        try:
+            exhausted = False
+            while True:
+                # Top up pending sends from input. Results buffered until earlier
+                # results arrive remain in flight, bounding the size of the buffer.
+                while not exhausted and submitted - yielded < self._max_in_flight:
+                    try:
+                        index, item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    kwargs = promailgate_client.bulk.normalise_item(item)
+                    shard = get_shard(kwargs.get('recipient'), self._processes)
+                    batches[shard].append((index, kwargs))
+                    submitted += 1
+                    if len(batches[shard]) >= self._batch_size:
+                        flush(shard)
+
+                # Send partial batches before waiting, as their results may be required
+                for shard in range(self._processes):
+                    flush(shard)
+
+                if received == submitted:
+                    if exhausted:
+                        break
+                    continue
+
+                received += wait_for_results()
+                if ordered:
+                    while next_index in buffer:
+                        result = buffer.pop(next_index)
+                        next_index += 1
+                        yielded += 1
+                        self.summary.add(result)
+                        yield result
+                else:
+                    for result in buffer.values():
+                        yielded += 1
+                        self.summary.add(result)
+                        yield result
+                    buffer.clear()
+            finished = True
+        finally:
+            for process, input_queue in workers:
+                if not finished:
+                    # Discard queued items if the caller stops consuming results
+                    try:
+                        while True:
+                            input_queue.get_nowait()
+                    except queue.Empty:
+                        pass
+                input_queue.put(None)
+
+            # Wait for workers to complete in-flight sends and report their summaries
+            deadline = time.monotonic() + 60
+            while len(self.shard_summaries) < len(workers) and time.monotonic() < deadline:
+                try:
+                    self._handle_message(output_queue.get(timeout=1), {})
+                except queue.Empty:
+                    if not any(process.is_alive() for process, _ in workers):
+                        break
+            for process, _ in workers:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+
+
+def send_sharded(client_kwargs, items, processes=None, concurrency=10, ordered=True, batch_size=100):
+    """Send items from a pool of worker processes, yielding a SendResult per item.
+    See ShardedSender."""
+    sender = ShardedSender(client_kwargs, processes=processes, concurrency=concurrency, batch_size=batch_size)
+    return sender.send_many(items, ordered=ordered)
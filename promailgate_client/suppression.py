@@ -0,0 +1,222 @@
+"""Local suppression of recipients permanently rejected by the server"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import hashlib
+import math
+import os
+import re
+import threading
+
+import promailgate_client.errors
+
+# Send error reasons indicating that all future sends to the recipient will be rejected
+DEFAULT_PERMANENT_REASONS = ('unsubscribed',)
+
+# Pragmatic check of address syntax, rejecting addresses the server could never deliver to
+ADDRESS_RE = re.compile(r'^[^@\s]+@[^@\s.]+(\.[^@\s.]+)+$')
+MAX_ADDRESS_LENGTH = 254
+
+
+def normalise_recipient(recipient):
+    """Return recipient in the form stored in suppression lists"""
+    return recipient.strip().lower()
+
+
+def get_key_id(api_key):
+    """Return identifier of API key that suppressions are recorded against,
+    so that API keys are not written to suppression files"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+def is_valid_address(recipient):
+    """Whether recipient is a syntactically valid email address"""
+    return len(recipient) <= MAX_ADDRESS_LENGTH and ADDRESS_RE.match(recipient) is not None
+
+
+class BloomFilter(object):
+    """Compact probabilistic set of strings.
+
+    Membership tests never return false negatives, but return false positives
+    at approximately error_rate once capacity items have been added. Uses
+    about 1.2 bytes per item at the default error rate of 0.1%."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        """Setup variables"""
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be between 0 and 1')
+        self._size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hash_count = max(1, int(round(self._size / float(capacity) * math.log(2))))
+        self._bits = bytearray((self._size + 7) // 8)
+        self.count = 0
+
+    def _get_positions(self, item):
+        """Return bit positions for item, using double hashing of a single digest"""
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + index * second) % self._size for index in range(self._hash_count)]
+
+    def add(self, item):
+        """Add item to filter"""
+        for position in self._get_positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        """Whether item may have been added to filter"""
+        bits = self._bits
+        for position in self._get_positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        """Number of items added"""
+        return self.count
+
+
+class SuppressionList(object):
+    """Index of recipients that sends fail for locally, without a request to the server.
+
+    Recipients are added when the server rejects a send with a permanent reason
+    (see DEFAULT_PERMANENT_REASONS) or by calling add. If path is provided,
+    suppressions are appended to that file and loaded from it when created, so
+    they are remembered between runs.
+    As an unsubscribe applies to the sender, learned suppressions only apply to
+    sends using the same API key, unless per_api_key is False. Recipients added
+    without an API key are suppressed for all API keys.
+    By default, recipients are held in a set. If bloom_capacity is provided, a
+    BloomFilter is used instead, which is much smaller for millions of recipients
+    but suppresses around bloom_error_rate of other recipients.
+    If validate_addresses is True, syntactically invalid addresses are also rejected."""
+
+    def __init__(
+            self,
+            path=None,
+            permanent_reasons=DEFAULT_PERMANENT_REASONS,
+            validate_addresses=False,
+            bloom_capacity=None,
+            bloom_error_rate=0.001,
+            per_api_key=True):
+        """Setup variables"""
+        self._path = path
+        self._per_api_key = per_api_key
+        self._permanent_reasons = tuple(reason.lower() for reason in permanent_reasons)
+        self._validate_addresses = validate_addresses
+        self._bloom_capacity = bloom_capacity
+        self._bloom_error_rate = bloom_error_rate
+        if bloom_capacity is None:
+            self._index = set()
+        else:
+            self._index = BloomFilter(bloom_capacity, bloom_error_rate)
+        self._lock = threading.Lock()
+        self._handle = None
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        """Load suppressions from file and open it for appending"""
+        if os.path.exists(self._path):
+            with open(self._path, 'r') as handle:
+                for line in handle:
+                    # Lines are recipient, reason and, for suppressions of a single API key, its key ID
+                    fields = line.rstrip('\n').split('\t')
+                    recipient = fields[0].strip()
+                    if recipient:
+                        self._index.add(self._get_entry(recipient, fields[2] if len(fields) > 2 else None))
+        self._handle = open(self._path, 'a')
+
+    def __getstate__(self):
+        """Return state for pickling, allowing list to be passed to worker processes.
+        Persisted lists are reloaded from file, rather than copied."""
+        return {
+            'path': self._path,
+            'permanent_reasons': self._permanent_reasons,
+            'validate_addresses': self._validate_addresses,
+            'bloom_capacity': self._bloom_capacity,
+            'bloom_error_rate': self._bloom_error_rate,
+            'per_api_key': self._per_api_key,
+            'index': self._index if self._path is None else None,
+        }
+
+    def __setstate__(self, state):
+        """Restore list from pickled state"""
+        index = state.pop('index')
+        self.__init__(**state)
+        if index is not None:
+            self._index = index
+
+    def __len__(self):
+        """Number of suppressed recipients"""
+        return len(self._index)
+
+    def __contains__(self, recipient):
+        """Whether recipient is suppressed for all API keys"""
+        return normalise_recipient(recipient) in self._index
+
+    @staticmethod
+    def _get_entry(recipient, key_id):
+        """Return index entry of normalised recipient, for the API key with key_id or all API keys"""
+        if not key_id:
+            return recipient
+        return '%s\t%s' % (key_id, recipient)
+
+    def is_suppressed(self, recipient, api_key=None):
+        """Whether sends to recipient using api_key are suppressed"""
+        recipient = normalise_recipient(recipient)
+        if recipient in self._index:
+            return True
+        return api_key is not None and self._get_entry(recipient, get_key_id(api_key)) in self._index
+
+    def add(self, recipient, reason='', api_key=None):
+        """Suppress recipient for api_key, or all API keys if not provided,
+        recording it to file if the list is persisted"""
+        recipient = normalise_recipient(recipient)
+        key_id = None if api_key is None else get_key_id(api_key)
+        entry = self._get_entry(recipient, key_id)
+        with self._lock:
+            if entry in self._index:
+                return
+            self._index.add(entry)
+            if self._handle is not None:
+                # Reasons are stored for reference, on a single line
+                line = '%s\t%s' % (recipient, ' '.join(reason.split()))
+                if key_id is not None:
+                    line += '\t' + key_id
+                self._handle.write(line + '\n')
+                self._handle.flush()
+
+    def check(self, recipient, api_key=None):
+        """Raise an error if sends to recipient using api_key would be rejected"""
+        if self._validate_addresses and not is_valid_address(recipient.strip()):
+            raise promailgate_client.errors.InvalidRecipientError('Invalid recipient address: %s' % recipient)
+        if self.is_suppressed(recipient, api_key):
+            raise promailgate_client.errors.RecipientSuppressedError('Recipient is suppressed: %s' % recipient)
+
+    def is_permanent(self, error):
+        """Whether error shows that all sends to the recipient will be rejected"""
+        if not isinstance(error, promailgate_client.errors.SendError):
+            return False
+        if isinstance(error, promailgate_client.errors.RecipientSuppressedError):
+            return False
+        message = str(error).lower()
+        return any(reason in message for reason in self._permanent_reasons)
+
+    def learn(self, recipient, error, api_key=None):
+        """Suppress recipient if error from a send to it using api_key is permanent"""
+        if self.is_permanent(error):
+            self.add(recipient, str(error), api_key=api_key if self._per_api_key else None)
+
+    def close(self):
+        """Close suppression file"""
+        with self._lock:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
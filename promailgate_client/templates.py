@@ -0,0 +1,89 @@
+"""Prepared send templates with pre-encoded common payload"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import promailgate_client.errors
+
+
+class SendTemplate(object):
+    """Send request with the API key, return_id and common data encoded once.
+
+    Each send splices the encoded recipient and per-recipient data into the
+    pre-encoded request body, rather than re-encoding the whole payload."""
+
+    def __init__(self, client, api_key, data=None, return_id=True):
+        """Encode common parts of request
+
+        data may be a dict or the JSON encoding of an object as bytes.
+        When pre-encoded bytes are used, per-recipient data keys must not
+        duplicate keys in the common data, as they cannot be checked."""
+        self._client = client
+        self._api_key = api_key
+        self._serializer = client._serializer
+
+        if data is None:
+            data = {}
+        if isinstance(data, (bytes, bytearray)):
+            self._data = None
+            encoded_data = bytes(data).strip()
+            if not (encoded_data.startswith(b'{') and encoded_data.endswith(b'}')):
+                raise ValueError('Pre-encoded data must be a JSON object')
+        else:
+            self._data = data
+            encoded_data = self._serializer.dumps(data)
+
+        # Encoded data with closing brace removed, so that further keys can be appended
+        self._encoded_data = encoded_data
+        self._data_open = encoded_data[:-1].rstrip()
+        self._data_empty = not encoded_data[1:-1].strip()
+
+        self._prefix = b''.join([
+            b'{"api_key":', self._serializer.dumps(api_key),
+            b',"return_id":', self._serializer.dumps(bool(return_id)),
+            b',"data":'
+        ])
+
+    @property
+    def api_key(self):
+        """API key used for sends"""
+        return self._api_key
+
+    def _encode_data(self, data):
+        """Return encoded data, combining common and per-recipient data"""
+        if not data:
+            return self._encoded_data
+
+        # Overriding common keys requires the data to be merged and fully re-encoded
+        if self._data is not None and not self._data.keys().isdisjoint(data):
+            merged = dict(self._data)
+            merged.update(data)
+            return self._serializer.dumps(merged)
+
+        extra = self._serializer.dumps(data)
+        if self._data_empty:
+            return extra
+        return self._data_open + b',' + extra[1:]
+
+    def encode(self, recipient, data=None):
+        """Return encoded send request body for recipient, with optional per-recipient data"""
+        # Basic check to ensure that recipient is not an empty string
+        if not recipient:
+            raise promailgate_client.errors.NoRecipientProvidedError('No recipient has been provided')
+
+        return b''.join([
+            self._prefix,
+            self._encode_data(data),
+            b',"recipient":', self._serializer.dumps(recipient),
+            b'}'
+        ])
+
+    def send(self, recipient, data=None, idempotency_key=None):
+        """Send email to recipient using template, with optional per-recipient data.
+        Returns the same as PromailgateClient.send_email."""
+        self._client._check_recipient(recipient, self._api_key)
+        return self._client._send_body(
+            self.encode(recipient, data=data), self._api_key, recipient, idempotency_key=idempotency_key)
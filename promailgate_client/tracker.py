@@ -0,0 +1,172 @@
+"""Concurrent polling of message statuses"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import heapq
+import itertools
+import time
+
+import promailgate_client.errors
+
+# Key of status returned by get_message_status containing the message state
+STATUS_KEY = 'MessageStatus'
+
+# Message states that may still change.
+# Any other state is treated as final.
+PENDING_STATUSES = frozenset(['PENDING', 'QUEUED', 'SENDING'])
+
+
+def get_state(status):
+    """Return message state from status returned by get_message_status"""
+    if status is None:
+        return None
+    return status.get(STATUS_KEY)
+
+
+def is_terminal_status(status, pending_statuses=PENDING_STATUSES):
+    """Return whether a message status is final"""
+    return get_state(status) not in pending_statuses
+
+
+class StatusUpdate(object):
+    """Change in the status of a tracked message"""
+
+    __slots__ = ('message_id', 'status', 'previous_status', 'error', 'terminal')
+
+    def __init__(self, message_id, status, previous_status=None, error=None, terminal=False):
+        """Setup variables"""
+        self.message_id = message_id
+        self.status = status
+        self.previous_status = previous_status
+        self.error = error
+        self.terminal = terminal
+
+    @property
+    def state(self):
+        """Message state of new status"""
+        return get_state(self.status)
+
+    def __repr__(self):
+        """Return representation of update"""
+        return 'StatusUpdate(message_id=%r, state=%r, terminal=%r, error=%r)' % (
+            self.message_id, self.state, self.terminal, self.error)
+
+
+class _TrackedMessage(object):
+    """Polling state of a single message"""
+
+    __slots__ = ('message_id', 'first_seen', 'status')
+
+    def __init__(self, message_id, first_seen):
+        """Setup variables"""
+        self.message_id = message_id
+        self.first_seen = first_seen
+        self.status = None
+
+
+class StatusTracker(object):
+    """Poll statuses of many messages concurrently until each reaches a final state.
+
+    Messages that remain pending are polled less often the longer they have been
+    pending: the interval between polls is backoff_factor multiplied by the time
+    since tracking started, bounded by min_interval and max_interval."""
+
+    def __init__(
+            self,
+            client,
+            message_ids,
+            concurrency=10,
+            min_interval=1.0,
+            max_interval=60.0,
+            backoff_factor=0.5,
+            pending_statuses=PENDING_STATUSES):
+        """Setup variables"""
+        self._client = client
+        self._concurrency = concurrency
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._backoff_factor = backoff_factor
+        self._pending_statuses = pending_statuses
+
+        # Heap of (due time, sequence, message), ordered by time of next poll
+        self._sequence = itertools.count()
+        self._queue = []
+        now = time.monotonic()
+        for message_id in message_ids:
+            self._schedule(_TrackedMessage(message_id, now), now)
+
+    def __len__(self):
+        """Number of messages still to be polled"""
+        return len(self._queue)
+
+    def _schedule(self, message, due):
+        """Schedule message to be polled at due time"""
+        heapq.heappush(self._queue, (due, next(self._sequence), message))
+
+    def _get_interval(self, message, now):
+        """Return delay before next poll of a pending message"""
+        interval = (now - message.first_seen) * self._backoff_factor
+        return min(self._max_interval, max(self._min_interval, interval))
+
+    def _handle_result(self, message, future, now):
+        """Process result of status poll, returning a StatusUpdate if the status changed"""
+        try:
+            status = future.result()
+        except promailgate_client.errors.NoSuchMessageError as exc:
+            # Message will never exist, so stop tracking it
+            return StatusUpdate(message.message_id, None, previous_status=message.status,
+                                error=exc, terminal=True)
+        except Exception:
+            # Temporary failure, so poll again later
+            self._schedule(message, now + self._get_interval(message, now))
+            return None
+
+        terminal = is_terminal_status(status, self._pending_statuses)
+        if not terminal:
+            self._schedule(message, now + self._get_interval(message, now))
+
+        if message.status is not None and get_state(status) == get_state(message.status):
+            return None
+
+        update = StatusUpdate(message.message_id, status, previous_status=message.status, terminal=terminal)
+        message.status = status
+        return update
+
+    def track(self):
+        """Poll messages until all have reached a final state,
+        yielding a StatusUpdate each time the state of a message changes"""
+        executor = ThreadPoolExecutor(max_workers=self._concurrency)
+        in_flight = {}
+        try:
+            while self._queue or in_flight:
+                # Start polls for all messages that are due, up to the concurrency limit
+                now = time.monotonic()
+                while self._queue and len(in_flight) < self._concurrency and self._queue[0][0] <= now:
+                    _, _, message = heapq.heappop(self._queue)
+                    future = executor.submit(self._client.get_message_status, message.message_id)
+                    in_flight[future] = message
+
+                # Wait for a poll to complete or the next poll to become due
+                timeout = None
+                if self._queue and len(in_flight) < self._concurrency:
+                    timeout = max(0, self._queue[0][0] - now)
+
+                if not in_flight:
+                    time.sleep(timeout)
+                    continue
+
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                now = time.monotonic()
+                for future in done:
+                    update = self._handle_result(in_flight.pop(future), future, now)
+                    if update is not None:
+                        yield update
+        finally:
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=True)
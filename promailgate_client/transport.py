@@ -0,0 +1,338 @@
+"""HTTP transports used by PromailgateClient"""
+
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import queue
+import threading
+from urllib.parse import urlsplit
+
+import promailgate_client.errors
+
+# Modules used by transports are imported when a transport is created,
+# so that importing the client does not import requests or http.client.
+
+# Methods that may be sent again if the connection is closed before a response is received
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+
+class Response(object):
+    """Response returned by a transport"""
+
+    __slots__ = ('status_code', 'content')
+
+    def __init__(self, status_code, content):
+        """Setup variables"""
+        self.status_code = status_code
+        self.content = content
+
+
+class Transport(object):
+    """Interface for transports, which perform HTTP requests over pooled connections.
+
+    request must return an object with status_code and content (bytes) attributes
+    and raise promailgate_client.errors.TransportError if no response is received,
+    or promailgate_client.errors.TransportConnectError if the request was not sent
+    as a connection could not be established."""
+
+    name = None
+
+    def request(self, method, url, body=None, headers=None, verify=True, timeout=None):
+        """Perform HTTP request.
+        timeout is a number of seconds or a (connect timeout, read timeout) tuple."""
+        raise NotImplementedError
+
+    def warmup(self, base_url, connections=0, verify=True, connect_timeout=None):
+        """Import modules and create resources used by transport, so that the
+        first request is not delayed, opening up to connections connections to
+        base_url if supported by the transport, each within connect_timeout seconds"""
+        pass
+
+    def close(self):
+        """Close pooled connections"""
+        pass
+
+
+class RequestsTransport(Transport):
+    """Transport using a requests session with a keep-alive connection pool"""
+
+    name = 'requests'
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False):
+        """Setup variables
+
+        pool_connections is the number of per-host connection pools to cache,
+        pool_maxsize is the maximum number of kept-alive connections per host and
+        pool_block causes requests to wait for a free connection, rather than
+        opening a temporary one, once pool_maxsize is reached."""
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._pool_block = pool_block
+
+        # HTTP session is created on first use and shared by all threads using the transport
+        self._session = None
+        self._session_lock = threading.Lock()
+
+        import requests.exceptions
+        import urllib3.exceptions
+        self._connect_timeout_errors = requests.exceptions.ConnectTimeout
+        self._timeout_errors = requests.exceptions.Timeout
+        self._connection_errors = (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError)
+        # Reasons for connection errors raised before the request was sent, including failures to connect
+        self._connect_error_reasons = urllib3.exceptions.ConnectTimeoutError
+
+    def _create_session(self):
+        """Create requests session with keep-alive connection pool"""
+        import requests
+        import requests.adapters
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self._pool_connections,
+            pool_maxsize=self._pool_maxsize,
+            pool_block=self._pool_block
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _get_session(self):
+        """Return HTTP session, creating it if it does not yet exist"""
+        session = self._session
+        if session is None:
+            with self._session_lock:
+                # Check again, in case another thread created the session whilst waiting for lock
+                if self._session is None:
+                    self._session = self._create_session()
+                session = self._session
+        return session
+
+    def request(self, method, url, body=None, headers=None, verify=True, timeout=None):
+        """Perform HTTP request using session"""
+        kwargs = {'headers': headers, 'verify': verify}
+        if body is not None:
+            kwargs['data'] = body
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+
+        try:
+            return getattr(self._get_session(), method.lower())(url, **kwargs)
+        except self._connect_timeout_errors as exc:
+            raise promailgate_client.errors.TransportConnectTimeoutError('Connection timed out: %s' % exc) from exc
+        except self._timeout_errors as exc:
+            raise promailgate_client.errors.TransportTimeoutError('Request timed out: %s' % exc) from exc
+        except self._connection_errors as exc:
+            if exc.args and isinstance(getattr(exc.args[0], 'reason', None), self._connect_error_reasons):
+                raise promailgate_client.errors.TransportConnectError('Connection error: %s' % exc) from exc
+            raise promailgate_client.errors.TransportError('Connection error: %s' % exc) from exc
+
+    def warmup(self, base_url, connections=0, verify=True, connect_timeout=None):
+        """Create session. Connections are opened on first use, as requests does not support opening them in advance"""
+        self._get_session()
+
+    def close(self):
+        """Close pooled connections.
+        The transport may still be used afterwards, which will open a new pool."""
+        with self._session_lock:
+            session = self._session
+            self._session = None
+        if session is not None:
+            session.close()
+
+
+class HttpClientTransport(Transport):
+    """Lightweight transport using persistent http.client connections.
+
+    Avoids the per-request overhead of requests (hooks, adapters, header
+    merging and cookie handling). Up to pool_maxsize idle connections are
+    kept alive for each host and reused by any thread."""
+
+    name = 'http.client'
+
+    def __init__(self, pool_maxsize=10):
+        """Setup variables"""
+        import http.client
+        import select
+        import socket
+
+        self._http_client = http.client
+        self._select = select
+        self._socket = socket
+        # Errors indicating that a reused keep-alive connection was closed by the server
+        self._stale_connection_errors = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+        self._pool_maxsize = pool_maxsize
+        # Map of (scheme, host, port, verify) to queue of idle connections
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._ssl_contexts = {}
+
+    def _get_ssl_context(self, verify):
+        """Return SSL context for connections"""
+        context = self._ssl_contexts.get(verify)
+        if context is None:
+            import ssl
+            context = ssl.create_default_context() if verify else ssl._create_unverified_context()
+            self._ssl_contexts[verify] = context
+        return context
+
+    def _get_pool(self, key):
+        """Return queue of idle connections for host"""
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.setdefault(key, queue.LifoQueue(maxsize=self._pool_maxsize))
+        return pool
+
+    def _create_connection(self, key, connect_timeout):
+        """Create new connection to host"""
+        scheme, host, port, verify = key
+        if scheme == 'https':
+            return self._http_client.HTTPSConnection(
+                host, port, timeout=connect_timeout, context=self._get_ssl_context(verify))
+        return self._http_client.HTTPConnection(host, port, timeout=connect_timeout)
+
+    @staticmethod
+    def _split_timeout(timeout):
+        """Return connect and read timeouts"""
+        if isinstance(timeout, tuple):
+            return timeout
+        return timeout, timeout
+
+    def _connect(self, connection):
+        """Open connection"""
+        connection.connect()
+        # Disable Nagle's algorithm, as headers and body may be written separately
+        connection.sock.setsockopt(self._socket.IPPROTO_TCP, self._socket.TCP_NODELAY, 1)
+
+    def _write(self, connection, method, path, body, headers, read_timeout):
+        """Send request on connection"""
+        if connection.sock is None:
+            try:
+                self._connect(connection)
+            except self._socket.timeout as exc:
+                raise promailgate_client.errors.TransportConnectTimeoutError(
+                    'Connection timed out: %s' % exc) from exc
+            except OSError as exc:
+                raise promailgate_client.errors.TransportConnectError('Connection error: %s' % exc) from exc
+        connection.sock.settimeout(read_timeout)
+        connection.request(method, path, body=body, headers=headers or {})
+
+    @staticmethod
+    def _read(connection):
+        """Read response from connection"""
+        response = connection.getresponse()
+        return response, response.read()
+
+    def _is_dropped(self, connection):
+        """Return whether idle connection has been closed by the server.
+        An idle connection is only readable once the server has closed it."""
+        if connection.sock is None:
+            return False
+        try:
+            return bool(self._select.select([connection.sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return True
+
+    def _get_connection(self, pool, key, connect_timeout):
+        """Return idle connection from pool, discarding those closed by the server,
+        or a new connection, and whether the connection is reused"""
+        while True:
+            try:
+                connection = pool.get_nowait()
+            except queue.Empty:
+                return self._create_connection(key, connect_timeout), False
+            if not self._is_dropped(connection):
+                return connection, True
+            connection.close()
+
+    @staticmethod
+    def _get_key(parts, verify):
+        """Return pool key for split URL"""
+        return parts.scheme, parts.hostname, parts.port, bool(verify)
+
+    def request(self, method, url, body=None, headers=None, verify=True, timeout=None):
+        """Perform HTTP request on a pooled connection"""
+        parts = urlsplit(url)
+        key = self._get_key(parts, verify)
+        path = parts.path or '/'
+        if parts.query:
+            path = '%s?%s' % (path, parts.query)
+        connect_timeout, read_timeout = self._split_timeout(timeout)
+        pool = self._get_pool(key)
+        connection, reused = self._get_connection(pool, key, connect_timeout)
+
+        try:
+            try:
+                written = False
+                self._write(connection, method, path, body, headers, read_timeout)
+                written = True
+                response, content = self._read(connection)
+            except self._stale_connection_errors:
+                # Server closed reused keep-alive connection, so retry once on a new connection,
+                # unless the server may have received and processed a request that is not idempotent
+                if not reused or (written and method.upper() not in IDEMPOTENT_METHODS):
+                    raise
+                connection.close()
+                connection = self._create_connection(key, connect_timeout)
+                self._write(connection, method, path, body, headers, read_timeout)
+                response, content = self._read(connection)
+        except promailgate_client.errors.TransportError:
+            connection.close()
+            raise
+        except self._socket.timeout as exc:
+            connection.close()
+            raise promailgate_client.errors.TransportTimeoutError('Request timed out: %s' % exc) from exc
+        except (OSError, self._http_client.HTTPException) as exc:
+            connection.close()
+            raise promailgate_client.errors.TransportError('Connection error: %s' % exc) from exc
+
+        # Return connection to pool for reuse, unless server is closing it
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                pool.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+        return Response(response.status, content)
+
+    def warmup(self, base_url, connections=0, verify=True, connect_timeout=None):
+        """Open connections to base_url and add them to the pool"""
+        key = self._get_key(urlsplit(base_url), verify)
+        pool = self._get_pool(key)
+        for _ in range(min(connections, self._pool_maxsize - pool.qsize())):
+            connection = self._create_connection(key, connect_timeout)
+            try:
+                self._connect(connection)
+            except self._socket.timeout as exc:
+                connection.close()
+                raise promailgate_client.errors.TransportTimeoutError('Connection timed out: %s' % exc) from exc
+            except OSError as exc:
+                connection.close()
+                raise promailgate_client.errors.TransportError('Connection error: %s' % exc) from exc
+            try:
+                pool.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+                break
+
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools = {}
+        for pool in pools:
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except queue.Empty:
+                    break
+
+
+TRANSPORTS = {
+    RequestsTransport.name: RequestsTransport,
+    HttpClientTransport.name: HttpClientTransport,
+}
@@ -0,0 +1,6 @@
+#!/bin/bash
+
+. ./build-env/bin/activate
+
+python -m benchmarks.run --output bench_results.json "$@"
+
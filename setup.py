@@ -10,6 +10,14 @@ setup(
     name='promailgate-client',
     version='1.0.2',
     packages=['promailgate_client'],
+    install_requires=['requests>=2.20.0'],
+    extras_require={
+        'async': ['aiohttp>=3.6'],
+        'fast-json': ['orjson>=3.0'],
+    },
+    entry_points={
+        'console_scripts': ['promailgate-send=promailgate_client.cli:main'],
+    },
     url='https://phabricator.dockstudios.co.uk/',
     license='',
     author='Matt Comben',
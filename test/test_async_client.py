@@ -0,0 +1,138 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import asyncio
+from json import loads, dumps
+from unittest import mock, IsolatedAsyncioTestCase, skipIf
+
+try:
+    import aiohttp
+    from promailgate_client.async_client import AsyncPromailgateClient
+except ImportError:
+    AsyncPromailgateClient = None
+import promailgate_client.errors
+
+
+@skipIf(AsyncPromailgateClient is None, 'aiohttp is not installed')
+class TestAsyncPromailgateClient(IsolatedAsyncioTestCase):
+    """Test AsyncPromailgateClient class"""
+
+    async def test_send_email(self):
+        """Test send_email"""
+        client = AsyncPromailgateClient(host='sendemail.local.host', default_api_key='1234')
+
+        def mocked_request(method, url, data=None, headers=None):
+            payload = loads(data)
+            if payload['recipient'] == 'unsub@example.com':
+                return 400, dumps({'status': 'Error', 'Reason': 'Recipient has unsubscribed'}).encode()
+            if payload['recipient'] == 'error@example.com':
+                return 500, b'{}'
+            if payload['return_id']:
+                return 201, dumps({'status': 'OK', 'message_id': 'test-id'}).encode()
+            return 200, b'{"status": "OK"}'
+
+        with mock.patch.object(client, '_request', side_effect=mocked_request) as mocked:
+            self.assertEqual(await client.send_email('alice@example.com', data={'a': 1}), 'test-id')
+            mocked.assert_called_once_with(
+                'POST', 'https://sendemail.local.host/api/message/send', data=mock.ANY,
+                headers={'Content-type': 'application/json'})
+            self.assertEqual(
+                loads(mocked.call_args[1]['data']),
+                {'api_key': '1234', 'recipient': 'alice@example.com', 'data': {'a': 1}, 'return_id': True}
+            )
+
+            self.assertEqual(await client.send_email('alice@example.com', return_id=False), True)
+
+            with self.assertRaises(promailgate_client.errors.SendError):
+                await client.send_email('unsub@example.com')
+
+            with self.assertRaises(promailgate_client.errors.UnknownSendError):
+                await client.send_email('error@example.com')
+
+            with self.assertRaises(promailgate_client.errors.NoRecipientProvidedError):
+                await client.send_email('')
+
+        client = AsyncPromailgateClient(host='sendemail.local.host')
+        with self.assertRaises(promailgate_client.errors.NoApiKeyProvidedError):
+            await client.send_email('alice@example.com')
+
+    async def test_get_message_status(self):
+        """Test get_message_status"""
+        client = AsyncPromailgateClient(url='http://test-endpoint:1534')
+
+        with mock.patch.object(client, '_request', return_value=(200, b'{"MessageStatus": "SENT"}')) as mocked:
+            self.assertEqual(await client.get_message_status('abc'), {'MessageStatus': 'SENT'})
+            mocked.assert_called_once_with('GET', 'http://test-endpoint:1534/api/message/status/abc')
+
+        with mock.patch.object(client, '_request', return_value=(404, b'{}')):
+            with self.assertRaises(promailgate_client.errors.NoSuchMessageError):
+                await client.get_message_status('abc')
+
+        with mock.patch.object(client, '_request', return_value=(500, b'{}')):
+            with self.assertRaises(promailgate_client.errors.UnknownServerError):
+                await client.get_message_status('abc')
+
+        with mock.patch.object(client, '_request', return_value=(123, b'{}')):
+            with self.assertRaises(promailgate_client.errors.UnknownResponseError):
+                await client.get_message_status('abc')
+
+    async def test_concurrency_limit(self):
+        """Test that in-flight requests are limited by semaphore"""
+        client = AsyncPromailgateClient(host='test', default_api_key='1234', max_concurrency=3)
+        state = {'in_flight': 0, 'max_in_flight': 0}
+
+        class MockResponse:
+            status = 200
+
+            async def __aenter__(self):
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+                await asyncio.sleep(0.01)
+                return self
+
+            async def __aexit__(self, *args):
+                state['in_flight'] -= 1
+
+            async def read(self):
+                return b'{}'
+
+        session = mock.MagicMock()
+        session.request.side_effect = lambda *args, **kwargs: MockResponse()
+        with mock.patch.object(client, '_get_session', return_value=session):
+            results = await asyncio.gather(*[
+                client.send_email('user%s@example.com' % i, return_id=False) for i in range(10)])
+
+        self.assertEqual(results, [True] * 10)
+        self.assertEqual(state['max_in_flight'], 3)
+        session.request.assert_called_with(
+            'POST', 'https://test/api/message/send',
+            headers={'Content-type': 'application/json'}, data=mock.ANY, ssl=True)
+
+    async def test_transport_errors(self):
+        """Test aiohttp errors are raised as TransportError"""
+        client = AsyncPromailgateClient(host='test', default_api_key='1234')
+        session = mock.MagicMock()
+        with mock.patch.object(client, '_get_session', return_value=session):
+            session.request.side_effect = aiohttp.SocketTimeoutError()
+            with self.assertRaises(promailgate_client.errors.TransportTimeoutError):
+                await client.send_email('alice@example.com')
+
+            session.request.side_effect = asyncio.TimeoutError()
+            with self.assertRaises(promailgate_client.errors.TransportTimeoutError):
+                await client.get_message_status('abc')
+
+            session.request.side_effect = aiohttp.ClientConnectionError()
+            with self.assertRaises(promailgate_client.errors.TransportError) as context:
+                await client.send_email('alice@example.com')
+            self.assertNotIsInstance(context.exception, promailgate_client.errors.TransportTimeoutError)
+
+    async def test_close(self):
+        """Test session lifecycle"""
+        async with AsyncPromailgateClient(host='test') as client:
+            session = client._get_session()
+            self.assertIs(client._get_session(), session)
+        self.assertTrue(session.closed)
+        self.assertIsNone(client._session)
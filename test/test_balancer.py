@@ -0,0 +1,131 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import threading
+from unittest import mock, TestCase
+
+import requests.exceptions
+
+from promailgate_client import PromailgateClient
+import promailgate_client.balancer
+import promailgate_client.errors
+
+
+class TestLoadBalancer(TestCase):
+    """Test LoadBalancer class"""
+
+    def test_least_outstanding(self):
+        """Test requests go to endpoint with fewest requests in progress"""
+        balancer = promailgate_client.balancer.LoadBalancer(['http://a', 'http://b/'])
+        first = balancer.acquire()
+        second = balancer.acquire()
+        self.assertNotEqual(first.url, second.url)
+        self.assertEqual(sorted([first.url, second.url]), ['http://a', 'http://b'])
+
+        balancer.release(first, 0.01, failed=False)
+        self.assertIs(balancer.acquire(), first)
+
+    def test_latency(self):
+        """Test requests go to endpoint with lowest latency"""
+        balancer = promailgate_client.balancer.LoadBalancer(
+            ['http://a', 'http://b'], strategy=promailgate_client.balancer.LoadBalancer.LATENCY)
+        slow, fast = balancer.endpoints
+        for endpoint, latency in ((slow, 0.5), (fast, 0.01)):
+            endpoint.outstanding += 1
+            balancer.release(endpoint, latency, failed=False)
+
+        self.assertIs(balancer.acquire(), fast)
+        # Fast endpoint remains preferred whilst its load-adjusted latency is lower
+        self.assertIs(balancer.acquire(), fast)
+
+        # Ensure quickly failing requests are not treated as fast
+        fast.outstanding += 1
+        balancer.release(fast, 0.001, failed=True)
+        self.assertIs(balancer.acquire(), slow)
+
+        with self.assertRaises(ValueError):
+            promailgate_client.balancer.LoadBalancer(['http://a'], strategy='random')
+        with self.assertRaises(ValueError):
+            promailgate_client.balancer.LoadBalancer([])
+
+    def test_ejection_and_probe(self):
+        """Test failing endpoints are ejected and re-admitted after a successful probe"""
+        probed = threading.Event()
+        probe = mock.MagicMock(side_effect=lambda url: probed.set() or True)
+        balancer = promailgate_client.balancer.LoadBalancer(
+            ['http://a', 'http://b'], failure_threshold=2, ejection_time=10, probe=probe)
+        bad, good = balancer.endpoints
+
+        with mock.patch('promailgate_client.balancer.time.monotonic', return_value=100):
+            for _ in range(2):
+                bad.outstanding += 1
+                balancer.release(bad, 0.01, failed=True)
+            self.assertFalse(bad.healthy)
+
+            for _ in range(5):
+                endpoint = balancer.acquire()
+                self.assertIs(endpoint, good)
+                balancer.release(endpoint, 0.01, failed=False)
+            probe.assert_not_called()
+
+        with mock.patch('promailgate_client.balancer.time.monotonic', return_value=111):
+            balancer.release(balancer.acquire(), 0.01, failed=False)
+            self.assertTrue(probed.wait(5))
+
+        for _ in range(50):
+            if bad.healthy:
+                break
+            threading.Event().wait(0.01)
+        self.assertTrue(bad.healthy)
+        probe.assert_called_once_with('http://a')
+
+    def test_all_ejected(self):
+        """Test that requests are still sent when all endpoints are ejected"""
+        balancer = promailgate_client.balancer.LoadBalancer(['http://a'], failure_threshold=1)
+        endpoint = balancer.acquire()
+        balancer.release(endpoint, 0.01, failed=True)
+        self.assertFalse(endpoint.healthy)
+        self.assertIs(balancer.acquire(), endpoint)
+
+
+class TestClientLoadBalancing(TestCase):
+    """Test load balancing in PromailgateClient"""
+
+    def test_failover(self):
+        """Test failing endpoint is ejected from client requests"""
+        client = PromailgateClient(endpoints=['http://a:1534', 'http://b:1534'], default_api_key='1234')
+        client._balancer._failure_threshold = 1
+
+        def mocked_post(url, **kwargs):
+            if url.startswith('http://a:1534'):
+                raise requests.exceptions.ConnectionError()
+            return mock.MagicMock(status_code=200)
+
+        with mock.patch('requests.Session.post', side_effect=mocked_post) as mocked_request:
+            results = []
+            for _ in range(10):
+                try:
+                    results.append(client.send_email('alice@example.com', return_id=False))
+                except promailgate_client.errors.TransportError:
+                    results.append(None)
+
+        # At most one request fails before endpoint is ejected
+        self.assertGreaterEqual(results.count(True), 9)
+        mocked_request.assert_called_with(
+            'http://b:1534/api/message/send', data=mock.ANY,
+            headers={'Content-type': 'application/json'}, verify=True, timeout=(10.0, 30.0))
+
+    def test_probe(self):
+        """Test endpoint probe uses status endpoint"""
+        client = PromailgateClient(endpoints=['http://a'], probe_timeout=2)
+        with mock.patch('requests.Session.get', return_value=mock.MagicMock(status_code=404)) as mocked_request:
+            self.assertTrue(client._balancer.probe('http://a'))
+            mocked_request.assert_called_once_with(
+                'http://a/api/message/status/healthcheck',
+                headers={'Content-type': 'application/json'}, verify=True, timeout=2)
+
+        with mock.patch('requests.Session.get', return_value=mock.MagicMock(status_code=502)):
+            self.assertFalse(client._balancer.probe('http://a'))
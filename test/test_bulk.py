@@ -0,0 +1,86 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import threading
+import time
+from unittest import mock, TestCase
+
+from promailgate_client import PromailgateClient
+import promailgate_client.bulk
+import promailgate_client.errors
+
+
+class TestSendMany(TestCase):
+    """Test send_many"""
+
+    @staticmethod
+    def mocked_send_email(recipient, api_key=None, data=None, return_id=True):
+        """Mock send, failing for unsubscribed recipients"""
+        # Sleep for a time inversely proportional to index, to cause sends to complete out of order
+        index = int(''.join(char for char in recipient.split('@')[0] if char.isdigit()))
+        time.sleep(0.001 * (10 - index % 10))
+        if recipient.startswith('unsub'):
+            raise promailgate_client.errors.SendError('Send error: Recipient has unsubscribed')
+        return 'id-%s' % recipient
+
+    def test_send_many_ordered(self):
+        """Test results are returned in input order with errors captured"""
+        client = PromailgateClient(host='test', default_api_key='1234')
+        items = ['user%s@example.com' % i for i in range(20)]
+        items[5] = {'recipient': 'unsub5@example.com', 'data': {'a': 1}}
+
+        with mock.patch.object(client, 'send_email', side_effect=self.mocked_send_email) as mocked:
+            results = list(client.send_many(items, concurrency=4))
+
+        self.assertEqual([result.index for result in results], list(range(20)))
+        self.assertEqual(results[0].message_id, 'id-user0@example.com')
+        self.assertTrue(results[0].ok)
+        self.assertFalse(results[5].ok)
+        self.assertIsInstance(results[5].error, promailgate_client.errors.SendError)
+        self.assertEqual(results[5].recipient, 'unsub5@example.com')
+        self.assertEqual(mocked.call_count, 20)
+        mocked.assert_any_call(recipient='unsub5@example.com', data={'a': 1})
+
+    def test_send_many_unordered(self):
+        """Test results are returned as they complete"""
+        client = PromailgateClient(host='test', default_api_key='1234')
+        items = ['user%s@example.com' % i for i in range(20)]
+
+        with mock.patch.object(client, 'send_email', side_effect=self.mocked_send_email):
+            results = list(client.send_many(items, concurrency=4, ordered=False))
+
+        self.assertEqual(sorted(result.index for result in results), list(range(20)))
+        self.assertTrue(all(result.ok for result in results))
+
+    def test_send_many_bounded(self):
+        """Test that input is consumed lazily and concurrency is limited"""
+        state = {'consumed': 0, 'in_flight': 0, 'max_in_flight': 0}
+        lock = threading.Lock()
+
+        def items():
+            for i in range(1000):
+                state['consumed'] += 1
+                yield 'user%s@example.com' % i
+
+        def send(recipient):
+            with lock:
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+            time.sleep(0.001)
+            with lock:
+                state['in_flight'] -= 1
+            return True
+
+        results = promailgate_client.bulk.send_many(send, items(), concurrency=3, window=6)
+        for _ in range(10):
+            next(results)
+        self.assertLessEqual(state['consumed'], 16)
+        results.close()
+
+        self.assertLessEqual(state['max_in_flight'], 3)
+
+        with self.assertRaises(ValueError):
+            list(promailgate_client.bulk.send_many(send, [], concurrency=0))
@@ -0,0 +1,127 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from unittest import mock, TestCase
+
+from promailgate_client import PromailgateClient
+import promailgate_client.cache
+import promailgate_client.errors
+
+
+class TestStatusCache(TestCase):
+    """Test StatusCache class"""
+
+    @mock.patch('promailgate_client.cache.time.monotonic', return_value=100)
+    def test_ttl(self, mocked_monotonic):
+        """Test pending statuses expire and final statuses do not"""
+        cache = promailgate_client.cache.StatusCache(pending_ttl=5)
+        cache.set('pending', {'MessageStatus': 'PENDING'})
+        cache.set('sent', {'MessageStatus': 'SENT'})
+
+        mocked_monotonic.return_value = 104
+        self.assertEqual(cache.get('pending'), {'MessageStatus': 'PENDING'})
+
+        mocked_monotonic.return_value = 106
+        self.assertIsNone(cache.get('pending'))
+        self.assertEqual(cache.get('sent'), {'MessageStatus': 'SENT'})
+        self.assertEqual(len(cache), 1)
+
+        # Ensure returned status is a copy
+        cache.get('sent')['MessageStatus'] = 'Changed'
+        self.assertEqual(cache.get('sent'), {'MessageStatus': 'SENT'})
+
+    def test_lru_eviction(self):
+        """Test least recently used entries are evicted"""
+        cache = promailgate_client.cache.StatusCache(maxsize=2)
+        cache.set('msg-1', {'MessageStatus': 'SENT'})
+        cache.set('msg-2', {'MessageStatus': 'SENT'})
+        cache.get('msg-1')
+        cache.set('msg-3', {'MessageStatus': 'SENT'})
+
+        self.assertIsNotNone(cache.get('msg-1'))
+        self.assertIsNone(cache.get('msg-2'))
+        self.assertIsNotNone(cache.get('msg-3'))
+
+        cache.invalidate('msg-1')
+        self.assertIsNone(cache.get('msg-1'))
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+    def test_coalescing(self):
+        """Test concurrent lookups are merged into one request"""
+        cache = promailgate_client.cache.StatusCache()
+        started = threading.Event()
+        release = threading.Event()
+        loader = mock.MagicMock()
+
+        def load():
+            loader()
+            started.set()
+            release.wait(5)
+            return {'MessageStatus': 'SENT'}
+
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            futures = [executor.submit(cache.get_or_load, 'msg-1', load)]
+            started.wait(5)
+            futures += [executor.submit(cache.get_or_load, 'msg-1', load) for _ in range(9)]
+            release.set()
+            results = [future.result() for future in futures]
+
+        self.assertEqual(results, [{'MessageStatus': 'SENT'}] * 10)
+        loader.assert_called_once_with()
+
+    def test_coalescing_deadline(self):
+        """Test lookups waiting for an in-progress lookup give up at their deadline"""
+        client = PromailgateClient(host='test', status_cache=promailgate_client.cache.StatusCache())
+        started = threading.Event()
+        release = threading.Event()
+        response = mock.MagicMock(status_code=200, content=b'{"MessageStatus": "SENT"}')
+
+        def get(url, **kwargs):
+            started.set()
+            release.wait(5)
+            return response
+
+        with mock.patch('requests.Session.get', side_effect=get) as mocked_request:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(client.get_message_status, 'msg-1')
+                started.wait(5)
+                start = time.monotonic()
+                with self.assertRaises(promailgate_client.errors.DeadlineExceededError):
+                    client.get_message_status('msg-1', deadline=0.05)
+                self.assertLess(time.monotonic() - start, 1)
+                release.set()
+                self.assertEqual(future.result(), {'MessageStatus': 'SENT'})
+            mocked_request.assert_called_once()
+
+    def test_errors_not_cached(self):
+        """Test that errors are raised and not cached"""
+        cache = promailgate_client.cache.StatusCache()
+        loader = mock.MagicMock(side_effect=[
+            promailgate_client.errors.NoSuchMessageError('No such message'), {'MessageStatus': 'SENT'}])
+
+        with self.assertRaises(promailgate_client.errors.NoSuchMessageError):
+            cache.get_or_load('msg-1', loader)
+        self.assertEqual(cache.get_or_load('msg-1', loader), {'MessageStatus': 'SENT'})
+        self.assertEqual(cache.get_or_load('msg-1', loader), {'MessageStatus': 'SENT'})
+        self.assertEqual(loader.call_count, 2)
+        self.assertEqual(cache.hits, 1)
+
+    def test_client_status_cache(self):
+        """Test get_message_status uses cache"""
+        client = PromailgateClient(host='test', status_cache=promailgate_client.cache.StatusCache())
+        response = mock.MagicMock(status_code=200, content=b'{"MessageStatus": "SENT"}')
+        with mock.patch('requests.Session.get', return_value=response) as mocked_request:
+            self.assertEqual(client.get_message_status('msg-1'), {'MessageStatus': 'SENT'})
+            self.assertEqual(client.get_message_status('msg-1'), {'MessageStatus': 'SENT'})
+            mocked_request.assert_called_once_with(
+                'https://test/api/message/status/msg-1',
+                headers={'Content-type': 'application/json'}, verify=True,
+                timeout=(10.0, 30.0)
+            )
@@ -0,0 +1,162 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import io
+import os
+import tempfile
+import threading
+from json import dumps, loads
+from unittest import mock, TestCase
+
+import promailgate_client.cli
+import promailgate_client.errors
+
+
+class MockResponse(object):
+    """Mock send response"""
+
+    def __init__(self, recipient):
+        """Setup variables"""
+        if recipient.startswith('unsub'):
+            self.status_code = 400
+            self.content = b'{"Reason": "Recipient has unsubscribed"}'
+        else:
+            self.status_code = 201
+            self.content = dumps({'message_id': 'id-' + recipient}).encode('utf-8')
+
+
+class TestCli(TestCase):
+    """Test command line sender"""
+
+    def setUp(self):
+        """Create input file"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.temp_dir.name, 'recipients.jsonl')
+        with open(self.input_path, 'w') as handle:
+            for index in range(50):
+                recipient = 'unsub%s@example.com' % index if index == 7 else 'user%s@example.com' % index
+                handle.write(dumps({'recipient': recipient, 'data': {'index': index}}) + '\n')
+                if index == 20:
+                    handle.write('\n')
+        self.results_path = self.input_path + '.results.jsonl'
+        self.checkpoint_path = self.results_path + '.checkpoint'
+
+    def tearDown(self):
+        """Remove temporary files"""
+        self.temp_dir.cleanup()
+
+    def _get_args(self, *extra):
+        """Return parsed arguments"""
+        return promailgate_client.cli.get_parser().parse_args(
+            [self.input_path, '--url', 'http://test', '--api-key', '1234', '--quiet', '--concurrency', '4']
+            + list(extra))
+
+    def _read_results(self):
+        """Return results written to results file"""
+        with open(self.results_path) as handle:
+            return [loads(line) for line in handle]
+
+    def test_run(self):
+        """Test all items are sent and results written"""
+        def mocked_post(url, data, **kwargs):
+            return MockResponse(loads(data)['recipient'])
+
+        with mock.patch('requests.Session.post', side_effect=mocked_post):
+            summary = promailgate_client.cli.run(self._get_args(), stream=io.StringIO())
+
+        self.assertEqual((summary.sent, summary.failed), (49, 1))
+        results = sorted(self._read_results(), key=lambda result: result['index'])
+        self.assertEqual([result['index'] for result in results], list(range(50)))
+        self.assertEqual(results[3]['message_id'], 'id-user3@example.com')
+        self.assertEqual(results[7]['error'], 'SendError')
+
+        with open(self.checkpoint_path) as handle:
+            checkpoint = loads(handle.read())
+        self.assertEqual(checkpoint['watermark'], 50)
+        self.assertEqual(checkpoint['completed'], [])
+        self.assertEqual(checkpoint['results_offset'], os.path.getsize(self.results_path))
+
+    def test_adaptive(self):
+        """Test sends are made within adaptive concurrency limit"""
+        def mocked_post(url, data, **kwargs):
+            return MockResponse(loads(data)['recipient'])
+
+        args = self._get_args('--adaptive')
+        with mock.patch('requests.Session.post', side_effect=mocked_post):
+            with mock.patch('promailgate_client.concurrency.AIMDLimiter.acquire', return_value=True) as mocked_acquire:
+                summary = promailgate_client.cli.run(args, stream=io.StringIO())
+
+        self.assertEqual((summary.sent, summary.failed), (49, 1))
+        self.assertEqual(mocked_acquire.call_count, 50)
+
+    def test_resume(self):
+        """Test an interrupted run resumes without re-sending items"""
+        sent = []
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def mocked_post(url, data, **kwargs):
+            recipient = loads(data)['recipient']
+            with lock:
+                sent.append(recipient)
+                if len(sent) == 20:
+                    stop.set()
+            return MockResponse(recipient)
+
+        with mock.patch('requests.Session.post', side_effect=mocked_post):
+            first = promailgate_client.cli.run(self._get_args(), stream=io.StringIO(), stop=stop)
+            self.assertLess(first.total, 50)
+            self.assertEqual(first.total, len(sent))
+
+            # Simulate crash whilst writing a result, after the checkpoint was saved
+            with open(self.results_path, 'a') as handle:
+                handle.write('{"index": 49, "recipient": "user49@example.com", "message_id": "id-user49@example.com"}\n')
+                handle.write('{"index": 48, "recip')
+
+            stream = io.StringIO()
+            second = promailgate_client.cli.run(self._get_args(), stream=stream)
+
+        self.assertIn('1 recovered from results', stream.getvalue())
+        self.assertEqual(first.total + second.total, 49)
+        self.assertEqual(len(sent), 49)
+        self.assertEqual(len(set(sent)), 49)
+        self.assertNotIn('user49@example.com', sent)
+        results = self._read_results()
+        self.assertEqual(sorted(result['index'] for result in results), list(range(50)))
+
+    def test_checkpoint_input_mismatch(self):
+        """Test checkpoint for a different input is rejected"""
+        checkpoint = promailgate_client.cli.Checkpoint(self.checkpoint_path, 'other.jsonl')
+        checkpoint.save(0)
+        with self.assertRaises(promailgate_client.errors.CheckpointError):
+            promailgate_client.cli.run(self._get_args(), stream=io.StringIO())
+
+    def test_checkpoint_watermark(self):
+        """Test watermark advances past contiguous processed items"""
+        checkpoint = promailgate_client.cli.Checkpoint(self.checkpoint_path, self.input_path)
+        for index in (1, 2, 4):
+            checkpoint.mark(index)
+        self.assertEqual((checkpoint.watermark, checkpoint.completed), (0, {1, 2, 4}))
+        checkpoint.mark(0)
+        self.assertEqual((checkpoint.watermark, checkpoint.completed), (3, {4}))
+        self.assertTrue(checkpoint.is_done(2))
+        self.assertFalse(checkpoint.is_done(3))
+
+    def test_rate_limiter(self):
+        """Test rate limit is shared between API keys"""
+        limiter = promailgate_client.cli.create_rate_limiter(5)
+        self.assertIs(limiter.get_bucket('a'), limiter.get_bucket('b'))
+
+    def test_main(self):
+        """Test exit code reflects failures"""
+        def mocked_post(url, data, **kwargs):
+            return MockResponse(loads(data)['recipient'])
+
+        with mock.patch('requests.Session.post', side_effect=mocked_post), \
+                mock.patch('signal.signal'), mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            self.assertEqual(promailgate_client.cli.main(
+                [self.input_path, '--url', 'http://test', '--api-key', '1234', '--quiet']), 1)
+        self.assertIn('Sent 49, failed 1 (SendError: 1)', stderr.getvalue())
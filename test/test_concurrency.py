@@ -0,0 +1,147 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import pickle
+import threading
+import time
+from unittest import mock, TestCase
+
+from promailgate_client import PromailgateClient
+import promailgate_client.concurrency
+import promailgate_client.errors
+import promailgate_client.transport
+
+
+class CapacityTransport(promailgate_client.transport.Transport):
+    """Transport simulating a server that fails requests beyond its capacity"""
+
+    def __init__(self, capacity, latency):
+        """Setup variables"""
+        self._capacity = capacity
+        self._latency = latency
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.max_in_flight = 0
+
+    def request(self, method, url, body=None, headers=None, verify=True, timeout=None):
+        """Return server error if capacity is exceeded"""
+        with self._lock:
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            overloaded = self._in_flight > self._capacity
+        try:
+            time.sleep(self._latency)
+            if overloaded:
+                return promailgate_client.transport.Response(500, b'')
+            return promailgate_client.transport.Response(200, b'')
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+
+class TestAIMDLimiter(TestCase):
+    """Test AIMDLimiter class"""
+
+    def _complete(self, limiter, count, latency=0.01, overloaded=False):
+        """Acquire and release limiter count times, with limit in use"""
+        for _ in range(count):
+            limiter._in_flight = limiter.limit - 1
+            self.assertTrue(limiter.acquire(0))
+            limiter.release(latency, overloaded)
+        limiter._in_flight = 0
+
+    def test_increase(self):
+        """Test limit increases by around 1 per limit requests, only whilst in use"""
+        limiter = promailgate_client.concurrency.AIMDLimiter(initial=4, max_limit=6)
+        self._complete(limiter, 4)
+        self.assertEqual(limiter.limit, 4)
+        self._complete(limiter, 1)
+        self.assertEqual(limiter.limit, 5)
+        self._complete(limiter, 100)
+        self.assertEqual(limiter.limit, 6)
+
+        limiter = promailgate_client.concurrency.AIMDLimiter(initial=4)
+        for _ in range(100):
+            limiter.acquire()
+            limiter.release(0.01)
+        self.assertEqual(limiter.limit, 4)
+
+    @mock.patch('promailgate_client.concurrency.time.monotonic')
+    def test_decrease(self, mocked_monotonic):
+        """Test limit is halved on overload, at most once per recent latency"""
+        mocked_monotonic.return_value = 100
+        limiter = promailgate_client.concurrency.AIMDLimiter(initial=16, min_limit=3)
+        self._complete(limiter, 1, latency=0.5)
+        self._complete(limiter, 3, overloaded=True)
+        self.assertEqual(limiter.limit, 8)
+
+        mocked_monotonic.return_value = 101
+        self._complete(limiter, 1, overloaded=True)
+        self.assertEqual(limiter.limit, 4)
+        mocked_monotonic.return_value = 102
+        self._complete(limiter, 1, overloaded=True)
+        self.assertEqual(limiter.limit, 3)
+
+        # Requests that were not completed do not change the limit
+        limiter.acquire()
+        limiter.release()
+        self.assertEqual((limiter.limit, limiter.in_flight), (3, 0))
+
+    def test_latency_spike(self):
+        """Test limit is decreased when latency rises above baseline"""
+        limiter = promailgate_client.concurrency.AIMDLimiter(initial=20, max_limit=20)
+        self._complete(limiter, 50, latency=0.01)
+        self.assertEqual(limiter.limit, 20)
+        self._complete(limiter, 10, latency=0.1)
+        self.assertLess(limiter.limit, 20)
+
+    def test_acquire(self):
+        """Test acquire waits for a request to complete"""
+        limiter = promailgate_client.concurrency.AIMDLimiter(initial=1)
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire(timeout=0.01))
+
+        threading.Timer(0.05, limiter.release, args=(0.01,)).start()
+        self.assertTrue(limiter.acquire(timeout=5))
+
+        with self.assertRaises(ValueError):
+            promailgate_client.concurrency.AIMDLimiter(initial=5, max_limit=4)
+
+    def test_pickle(self):
+        """Test copies are created with initial limit"""
+        limiter = promailgate_client.concurrency.AIMDLimiter(initial=4, max_limit=50)
+        self._complete(limiter, 20)
+        copied = pickle.loads(pickle.dumps(limiter))
+        self.assertEqual((copied.limit, copied.max_limit), (4, 50))
+
+
+class TestClientConcurrencyLimiter(TestCase):
+    """Test adaptive concurrency in PromailgateClient"""
+
+    def test_send_many(self):
+        """Test limit settles around capacity of server"""
+        transport = CapacityTransport(capacity=8, latency=0.005)
+        limiter = promailgate_client.concurrency.AIMDLimiter(initial=2, max_limit=64)
+        client = PromailgateClient(
+            host='test', default_api_key='1234', transport=transport, concurrency_limiter=limiter)
+
+        items = [{'recipient': 'user%s@example.com' % index, 'return_id': False} for index in range(600)]
+        results = list(client.send_many(items))
+        failed = sum(not result.ok for result in results)
+        self.assertLess(failed, 100)
+        self.assertLessEqual(transport.max_in_flight, 64)
+        self.assertTrue(2 <= limiter.limit <= 16)
+
+    def test_overload_errors(self):
+        """Test transport errors are counted as overload"""
+        transport = mock.MagicMock(spec=promailgate_client.transport.Transport)
+        transport.request.side_effect = promailgate_client.errors.TransportTimeoutError()
+        limiter = promailgate_client.concurrency.AIMDLimiter(initial=8)
+        client = PromailgateClient(
+            host='test', default_api_key='1234', transport=transport, concurrency_limiter=limiter)
+        with self.assertRaises(promailgate_client.errors.TransportTimeoutError):
+            client.send_email('alice@example.com')
+        self.assertEqual((limiter.limit, limiter.in_flight), (4, 0))
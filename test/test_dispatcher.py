@@ -0,0 +1,134 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import threading
+import time
+from unittest import mock, TestCase
+
+from promailgate_client import PromailgateClient
+import promailgate_client.dispatcher
+import promailgate_client.errors
+import promailgate_client.metrics
+
+
+class TestDispatcher(TestCase):
+    """Test Dispatcher class"""
+
+    def setUp(self):
+        """Create client, with sends that block until released"""
+        self.client = PromailgateClient(host='test', default_api_key='1234')
+        self.release = threading.Event()
+        self.sent = []
+
+        def send_email(recipient, **kwargs):
+            """Record send once released"""
+            self.release.wait(5)
+            self.sent.append(recipient)
+            if recipient == 'fail@example.com':
+                raise promailgate_client.errors.SendError('Send error: Recipient has unsubscribed')
+            return 'id-%s' % recipient
+
+        patcher = mock.patch.object(self.client, 'send_email', side_effect=send_email)
+        self.send_email = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.release.set)
+
+    def _get_dispatcher(self, **kwargs):
+        """Return dispatcher with a single worker, occupied until released"""
+        dispatcher = promailgate_client.dispatcher.Dispatcher(self.client, workers=1, **kwargs)
+        self.addCleanup(dispatcher.shutdown, cancel_pending=True)
+        self.blocking = dispatcher.submit('first@example.com', lane=dispatcher.lanes[-1])
+        while dispatcher.pending():
+            time.sleep(0.001)
+        return dispatcher
+
+    def test_submit(self):
+        """Test futures hold results and errors of sends"""
+        self.release.set()
+        with promailgate_client.dispatcher.Dispatcher(self.client, workers=2) as dispatcher:
+            future = dispatcher.submit('alice@example.com', lane='transactional', data={'a': 1})
+            failed = dispatcher.submit('fail@example.com')
+            self.assertEqual(future.result(5), 'id-alice@example.com')
+            self.assertIsInstance(failed.exception(5), promailgate_client.errors.SendError)
+        self.send_email.assert_any_call('alice@example.com', data={'a': 1})
+
+        with self.assertRaises(RuntimeError):
+            dispatcher.submit('bob@example.com')
+        with self.assertRaises(ValueError):
+            promailgate_client.dispatcher.Dispatcher(self.client, scheduler='random')
+
+    def test_strict(self):
+        """Test transactional sends are sent before queued bulk sends"""
+        dispatcher = self._get_dispatcher()
+        bulk = [dispatcher.submit('bulk%s@example.com' % index) for index in range(20)]
+        transactional = dispatcher.submit('reset@example.com', lane='transactional')
+        self.assertEqual(dispatcher.pending('bulk'), 20)
+
+        self.release.set()
+        self.assertEqual(transactional.result(5), 'id-reset@example.com')
+        for future in bulk:
+            future.result(5)
+        self.assertEqual(self.sent[:2], ['first@example.com', 'reset@example.com'])
+
+        with self.assertRaises(ValueError):
+            dispatcher.submit('alice@example.com', lane='unknown')
+
+    def test_weighted(self):
+        """Test lanes are served in proportion to their weights"""
+        dispatcher = self._get_dispatcher(lanes={'high': 3, 'low': 1}, scheduler='weighted')
+        futures = [dispatcher.submit('%s%s@example.com' % (lane, index), lane=lane)
+                   for index in range(8) for lane in ('low', 'high')]
+
+        self.release.set()
+        for future in futures:
+            future.result(5)
+        lanes = [recipient[:3] for recipient in self.sent[1:]]
+        self.assertEqual(lanes[:8].count('hig'), 6)
+        self.assertEqual(lanes[-4:], ['low'] * 4)
+
+    def test_cancel(self):
+        """Test cancelled and pending sends are not sent"""
+        dispatcher = self._get_dispatcher()
+        cancelled = dispatcher.submit('cancelled@example.com')
+        self.assertTrue(cancelled.cancel())
+        pending = dispatcher.submit('pending@example.com')
+
+        dispatcher.shutdown(wait=False, cancel_pending=True)
+        self.release.set()
+        self.assertEqual(self.blocking.result(5), 'id-first@example.com')
+        self.assertTrue(pending.cancelled())
+        dispatcher.shutdown()
+        self.assertEqual(self.sent, ['first@example.com'])
+
+    def test_max_queue(self):
+        """Test submit waits whilst lane is full"""
+        dispatcher = self._get_dispatcher(max_queue=1)
+        dispatcher.submit('queued@example.com')
+        submitted = threading.Event()
+        thread = threading.Thread(target=lambda: dispatcher.submit('waiting@example.com') and submitted.set())
+        thread.start()
+
+        # Other lanes are not affected by full lane
+        dispatcher.submit('reset@example.com', lane='transactional')
+        self.assertFalse(submitted.wait(0.05))
+        self.release.set()
+        self.assertTrue(submitted.wait(5))
+        thread.join(5)
+
+    def test_metrics(self):
+        """Test queued sends and wait times are recorded by lane"""
+        self.client._metrics = promailgate_client.metrics.PrometheusMetrics()
+        dispatcher = self._get_dispatcher()
+        future = dispatcher.submit('bulk@example.com')
+        self.assertEqual(
+            self.client._metrics.get(promailgate_client.metrics.DISPATCH_QUEUED, labels={'lane': 'bulk'}), 1)
+
+        self.release.set()
+        future.result(5)
+        self.assertEqual(
+            self.client._metrics.get(promailgate_client.metrics.DISPATCH_QUEUED, labels={'lane': 'bulk'}), 0)
+        self.assertEqual(
+            self.client._metrics.get(promailgate_client.metrics.DISPATCH_WAIT, labels={'lane': 'bulk'}), 2)
@@ -0,0 +1,125 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import threading
+import time
+from unittest import mock, TestCase
+
+from promailgate_client import PromailgateClient
+import promailgate_client.errors
+import promailgate_client.hedging
+
+
+class TestLatencyTracker(TestCase):
+    """Test LatencyTracker class"""
+
+    def test_value(self):
+        """Test percentile is unknown until enough samples are recorded, then updated periodically"""
+        tracker = promailgate_client.hedging.LatencyTracker(percentile=90, window=100, min_samples=10, update_every=10)
+        for latency in range(1, 10):
+            tracker.record(latency)
+        self.assertIsNone(tracker.value)
+
+        tracker.record(10)
+        self.assertEqual(tracker.value, 9)
+
+        # Value is only recalculated after update_every samples
+        for _ in range(9):
+            tracker.record(100)
+        self.assertEqual(tracker.value, 9)
+        tracker.record(100)
+        self.assertEqual(tracker.value, 100)
+
+
+class TestHedger(TestCase):
+    """Test Hedger class"""
+
+    def _get_hedger(self, delay):
+        """Return hedger that hedges after delay seconds"""
+        tracker = promailgate_client.hedging.LatencyTracker(min_samples=1)
+        tracker.record(delay)
+        hedger = promailgate_client.hedging.Hedger(tracker=tracker)
+        self.addCleanup(hedger.close)
+        return hedger
+
+    def test_no_samples(self):
+        """Test calls are not hedged until latencies are known"""
+        hedger = promailgate_client.hedging.Hedger()
+        func = mock.MagicMock(return_value='result')
+        self.assertEqual(hedger.call(func), 'result')
+        func.assert_called_once_with()
+        self.assertIsNone(hedger._executor)
+
+    def test_hedge_slow_call(self):
+        """Test a slow call is hedged and the first result is returned"""
+        hedger = self._get_hedger(0.01)
+        release = threading.Event()
+        results = iter([lambda: release.wait(5) and 'slow', lambda: 'fast'])
+        lock = threading.Lock()
+
+        def func():
+            """Block on first call only"""
+            with lock:
+                call = next(results)
+            return call()
+
+        self.assertEqual(hedger.call(func), 'fast')
+        release.set()
+
+    def test_fast_call_not_hedged(self):
+        """Test calls faster than the delay are not hedged"""
+        hedger = self._get_hedger(5)
+        func = mock.MagicMock(return_value='result')
+        self.assertEqual(hedger.call(func), 'result')
+        func.assert_called_once_with()
+
+    def test_errors(self):
+        """Test error is raised once both calls fail and timeout is applied"""
+        hedger = self._get_hedger(0.01)
+
+        def func():
+            """Fail slowly"""
+            time.sleep(0.05)
+            raise promailgate_client.errors.UnknownServerError()
+
+        with self.assertRaises(promailgate_client.errors.UnknownServerError):
+            hedger.call(func)
+
+        release = threading.Event()
+        with self.assertRaises(promailgate_client.errors.TransportTimeoutError):
+            hedger.call(lambda: release.wait(5), timeout=0.05)
+        release.set()
+
+
+class TestClientHedging(TestCase):
+    """Test hedged status requests in PromailgateClient"""
+
+    def test_get_message_status(self):
+        """Test slow status request is hedged"""
+        client = PromailgateClient(host='test', hedge_percentile=95)
+        self.addCleanup(client.close)
+        client._hedger.tracker.record = mock.MagicMock()
+        client._hedger.tracker._value = 0.01
+
+        release = threading.Event()
+        responses = iter([
+            (release, mock.MagicMock(status_code=500, content=b'{}')),
+            (None, mock.MagicMock(status_code=200, content=b'{"status": "sent"}')),
+        ])
+        lock = threading.Lock()
+
+        def request(*args, **kwargs):
+            """Return responses, blocking on first request"""
+            with lock:
+                event, response = next(responses)
+            if event is not None:
+                event.wait(5)
+            return response
+
+        with mock.patch('requests.Session.get', side_effect=request) as mocked_request:
+            self.assertEqual(client.get_message_status('1234'), {'status': 'sent'})
+            release.set()
+        self.assertEqual(mocked_request.call_count, 2)
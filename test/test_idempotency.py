@@ -0,0 +1,133 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import threading
+import time
+from unittest import mock, TestCase
+
+from promailgate_client import PromailgateClient
+import promailgate_client.errors
+import promailgate_client.idempotency
+
+
+class TestIdempotencyStore(TestCase):
+    """Test IdempotencyStore class"""
+
+    def test_call(self):
+        """Test completed sends are returned and failed sends are not recorded"""
+        store = promailgate_client.idempotency.IdempotencyStore()
+        send = mock.MagicMock(return_value='message-id')
+        self.assertEqual(store.call('key', send), 'message-id')
+        self.assertEqual(store.call('key', send), 'message-id')
+        send.assert_called_once_with()
+        self.assertEqual((store.hits, store.misses), (1, 1))
+
+        failing = mock.MagicMock(side_effect=promailgate_client.errors.UnknownSendError())
+        for _ in range(2):
+            with self.assertRaises(promailgate_client.errors.UnknownSendError):
+                store.call('other', failing)
+        self.assertEqual(failing.call_count, 2)
+
+        store.invalidate('key')
+        store.call('key', send)
+        self.assertEqual(send.call_count, 2)
+
+    def test_bounds(self):
+        """Test entries expire after ttl and oldest entries are evicted beyond maxsize"""
+        store = promailgate_client.idempotency.IdempotencyStore(maxsize=2, ttl=10)
+        with mock.patch('promailgate_client.idempotency.time.monotonic', return_value=100):
+            for key in ('a', 'b', 'c'):
+                store.set(key, key)
+            self.assertEqual(len(store), 2)
+            self.assertIsNone(store.get('a'))
+            self.assertEqual(store.get('c'), 'c')
+
+        with mock.patch('promailgate_client.idempotency.time.monotonic', return_value=110):
+            self.assertIsNone(store.get('c'))
+            self.assertEqual(len(store), 0)
+
+    def test_concurrent(self):
+        """Test concurrent sends with the same key result in a single send"""
+        store = promailgate_client.idempotency.IdempotencyStore()
+        started = threading.Event()
+        release = threading.Event()
+
+        def send():
+            """Block until released"""
+            started.set()
+            release.wait(5)
+            return 'message-id'
+
+        send = mock.MagicMock(side_effect=send)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(store.call('key', send))) for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, ['message-id'] * 5)
+        send.assert_called_once_with()
+
+    def test_concurrent_deadline(self):
+        """Test sends waiting for a concurrent send with the same key give up at their deadline"""
+        store = promailgate_client.idempotency.IdempotencyStore()
+        started = threading.Event()
+        release = threading.Event()
+
+        def send():
+            """Block until released"""
+            started.set()
+            release.wait(5)
+            return 'message-id'
+
+        thread = threading.Thread(target=store.call, args=('key', send))
+        thread.start()
+        started.wait(5)
+        with self.assertRaises(promailgate_client.errors.DeadlineExceededError):
+            store.call('key', send, deadline=time.monotonic() + 0.05)
+        release.set()
+        thread.join(5)
+        self.assertEqual(store.get('key'), 'message-id')
+
+
+class TestClientIdempotency(TestCase):
+    """Test idempotency in PromailgateClient"""
+
+    def test_send_email(self):
+        """Test repeated identical sends are only sent once"""
+        client = PromailgateClient(
+            host='test', default_api_key='1234',
+            idempotency=promailgate_client.idempotency.IdempotencyStore())
+        response = mock.MagicMock(status_code=201, content=b'{"message_id": "message-1"}')
+
+        with mock.patch('requests.Session.post', return_value=response) as mocked_request:
+            self.assertEqual(client.send_email('alice@example.com', data={'a': 1}), 'message-1')
+            self.assertEqual(client.send_email('alice@example.com', data={'a': 1}), 'message-1')
+            self.assertEqual(mocked_request.call_count, 1)
+            key = mocked_request.call_args[1]['headers']['Idempotency-Key']
+
+            template = client.prepare_send(data={'a': 1})
+            for _ in range(2):
+                self.assertEqual(template.send('bob@example.com'), 'message-1')
+            self.assertEqual(mocked_request.call_count, 2)
+
+            # Different sends and explicit keys are sent separately
+            client.send_email('alice@example.com', data={'a': 2})
+            client.send_email('alice@example.com', data={'a': 1}, idempotency_key='job-1')
+            client.send_email('alice@example.com', data={'a': 3}, idempotency_key='job-1')
+            self.assertEqual(mocked_request.call_count, 4)
+            self.assertNotEqual(mocked_request.call_args_list[2][1]['headers']['Idempotency-Key'], key)
+            self.assertEqual(mocked_request.call_args[1]['headers']['Idempotency-Key'], 'job-1')
+
+        # Ensure no key is sent by default
+        client = PromailgateClient(host='test', default_api_key='1234')
+        with mock.patch('requests.Session.post', return_value=response) as mocked_request:
+            client.send_email('alice@example.com')
+            self.assertNotIn('Idempotency-Key', mocked_request.call_args[1]['headers'])
@@ -0,0 +1,92 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+from unittest import mock, TestCase
+
+import requests.exceptions
+
+from promailgate_client import PromailgateClient
+import promailgate_client.errors
+import promailgate_client.metrics
+import promailgate_client.retry
+
+
+class TestPrometheusMetrics(TestCase):
+    """Test PrometheusMetrics class"""
+
+    def test_render(self):
+        """Test Prometheus text output"""
+        metrics = promailgate_client.metrics.PrometheusMetrics(buckets=(0.1, 1))
+        metrics.increment(promailgate_client.metrics.REQUESTS_TOTAL, labels={'operation': 'send', 'outcome': '201'})
+        metrics.increment(promailgate_client.metrics.REQUESTS_TOTAL, labels={'operation': 'send', 'outcome': '201'})
+        metrics.gauge_add(promailgate_client.metrics.POOL_IN_USE, 2)
+        metrics.gauge_add(promailgate_client.metrics.POOL_IN_USE, -1)
+        metrics.observe(promailgate_client.metrics.CALL_DURATION, 0.05, labels={'operation': 'send'})
+        metrics.observe(promailgate_client.metrics.CALL_DURATION, 0.5, labels={'operation': 'send'})
+        metrics.observe(promailgate_client.metrics.CALL_DURATION, 5, labels={'operation': 'send'})
+
+        self.assertEqual(metrics.render(), '\n'.join([
+            '# HELP promailgate_client_call_duration_seconds Duration of client calls, including retries',
+            '# TYPE promailgate_client_call_duration_seconds histogram',
+            'promailgate_client_call_duration_seconds_bucket{operation="send",le="0.1"} 1',
+            'promailgate_client_call_duration_seconds_bucket{operation="send",le="1"} 2',
+            'promailgate_client_call_duration_seconds_bucket{operation="send",le="+Inf"} 3',
+            'promailgate_client_call_duration_seconds_sum{operation="send"} 5.55',
+            'promailgate_client_call_duration_seconds_count{operation="send"} 3',
+            '# HELP promailgate_client_pool_connections_in_use HTTP requests in progress on pooled connections',
+            '# TYPE promailgate_client_pool_connections_in_use gauge',
+            'promailgate_client_pool_connections_in_use 1',
+            '# HELP promailgate_client_requests_total HTTP responses by operation and outcome',
+            '# TYPE promailgate_client_requests_total counter',
+            'promailgate_client_requests_total{operation="send",outcome="201"} 2',
+        ]) + '\n')
+
+    def test_get_outcome(self):
+        """Test outcome labels"""
+        self.assertEqual(promailgate_client.metrics.get_outcome(201), '201')
+        self.assertEqual(promailgate_client.metrics.get_outcome(503), 'unknown')
+
+
+class TestClientMetrics(TestCase):
+    """Test metrics integration in PromailgateClient"""
+
+    @mock.patch('promailgate_client.retry.time.sleep')
+    def test_send_metrics(self, mocked_sleep):
+        """Test metrics are recorded for sends and status requests"""
+        metrics = promailgate_client.metrics.PrometheusMetrics()
+        client = PromailgateClient(
+            host='test', default_api_key='1234', metrics=metrics,
+            retry_policy=promailgate_client.retry.RetryPolicy(max_attempts=3))
+
+        responses = [
+            requests.exceptions.ConnectTimeout(),
+            mock.MagicMock(status_code=500, content=b'{}'),
+            mock.MagicMock(status_code=201, content=b'{"message_id": "test-id"}'),
+            mock.MagicMock(status_code=400, content=b'{"Reason": "Recipient has unsubscribed"}'),
+        ]
+        with mock.patch('requests.Session.post', side_effect=responses):
+            self.assertEqual(client.send_email('alice@example.com'), 'test-id')
+            with self.assertRaises(promailgate_client.errors.SendError):
+                client.send_email('unsub@example.com')
+
+        with mock.patch('requests.Session.get', return_value=mock.MagicMock(status_code=404, content=b'{}')):
+            with self.assertRaises(promailgate_client.errors.NoSuchMessageError):
+                client.get_message_status('test-id')
+
+        def requests_total(operation, outcome):
+            return metrics.get(promailgate_client.metrics.REQUESTS_TOTAL,
+                               labels={'operation': operation, 'outcome': outcome})
+
+        self.assertEqual(requests_total('send', 'error'), 1)
+        self.assertEqual(requests_total('send', '500'), 1)
+        self.assertEqual(requests_total('send', '201'), 1)
+        self.assertEqual(requests_total('send', '400'), 1)
+        self.assertEqual(requests_total('status', '404'), 1)
+        self.assertEqual(metrics.get(promailgate_client.metrics.RETRIES_TOTAL, labels={'operation': 'send'}), 2)
+        self.assertEqual(metrics.get(promailgate_client.metrics.CALL_DURATION, labels={'operation': 'send'}), 2)
+        self.assertEqual(metrics.get(promailgate_client.metrics.CALL_DURATION, labels={'operation': 'status'}), 1)
+        self.assertEqual(metrics.get(promailgate_client.metrics.IN_FLIGHT, labels={'operation': 'send'}), 0)
+        self.assertEqual(metrics.get(promailgate_client.metrics.POOL_IN_USE), 0)
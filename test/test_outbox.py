@@ -0,0 +1,111 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import os
+import tempfile
+import time
+from unittest import mock, TestCase
+
+from promailgate_client import PromailgateClient
+import promailgate_client.errors
+import promailgate_client.outbox
+import promailgate_client.retry
+
+
+class TestOutbox(TestCase):
+    """Test Outbox class"""
+
+    def setUp(self):
+        """Create temporary directory for spool"""
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._temp_dir.name, 'outbox.sqlite')
+        self.client = PromailgateClient(host='test', default_api_key='1234')
+
+    def tearDown(self):
+        """Remove temporary directory"""
+        self._temp_dir.cleanup()
+
+    @staticmethod
+    def mocked_send_email(recipient, api_key=None, data=None, return_id=True):
+        """Mock send, failing for some recipients"""
+        if recipient.startswith('unsub'):
+            raise promailgate_client.errors.SendError('Send error: Recipient has unsubscribed')
+        if recipient.startswith('error'):
+            raise promailgate_client.errors.UnknownSendError('Internal server error')
+        return 'id-%s-%s' % (recipient, data.get('i'))
+
+    def test_flush(self):
+        """Test rows are sent and results recorded"""
+        outbox = promailgate_client.outbox.Outbox(
+            self.client, self.path, max_attempts=2, keep_sent=True,
+            retry_policy=promailgate_client.retry.RetryPolicy(backoff_base=0, jitter=False))
+        sent_id = outbox.enqueue('alice@example.com', data={'i': 1})
+        unsub_id = outbox.enqueue('unsub@example.com')
+        error_id = outbox.enqueue('error@example.com', api_key='other-key')
+        self.assertEqual(outbox.count(), 3)
+
+        with self.assertRaises(promailgate_client.errors.NoRecipientProvidedError):
+            outbox.enqueue('')
+
+        with mock.patch.object(self.client, 'send_email', side_effect=self.mocked_send_email) as mocked_send:
+            self.assertEqual(outbox.flush(), 3)
+            mocked_send.assert_any_call(
+                recipient='alice@example.com', api_key=None, data={'i': 1}, return_id=True)
+            mocked_send.assert_any_call(
+                recipient='error@example.com', api_key='other-key', data={}, return_id=True)
+
+            self.assertEqual(outbox.get(sent_id), {
+                'state': 'sent', 'message_id': 'id-alice@example.com-1', 'error': None})
+            self.assertEqual(outbox.get(unsub_id), {
+                'state': 'failed', 'message_id': None,
+                'error': 'SendError: Send error: Recipient has unsubscribed'})
+            self.assertEqual(outbox.get(error_id)['state'], 'pending')
+
+            # Retryable error is retried until max attempts
+            self.assertEqual(outbox.flush(), 1)
+            self.assertEqual(outbox.get(error_id)['state'], 'failed')
+            self.assertEqual(outbox.flush(), 0)
+
+        self.assertEqual(outbox.count(), 0)
+        self.assertEqual(outbox.count('failed'), 2)
+        outbox.close()
+
+    def test_resume(self):
+        """Test pending rows survive restart and are drained on close"""
+        outbox = promailgate_client.outbox.Outbox(self.client, self.path)
+        row_ids = [outbox.enqueue('user%s@example.com' % i, data={'i': i}) for i in range(25)]
+        outbox.close()
+
+        outbox = promailgate_client.outbox.Outbox(self.client, self.path, batch_size=10, flush_interval=10)
+        self.assertEqual(outbox.count(), 25)
+        with mock.patch.object(self.client, 'send_email', side_effect=self.mocked_send_email) as mocked_send:
+            outbox.start()
+            outbox.close(timeout=10)
+        self.assertEqual(mocked_send.call_count, 25)
+
+        outbox = promailgate_client.outbox.Outbox(self.client, self.path)
+        self.assertEqual(outbox.count(), 0)
+        # Sent rows are removed, by default
+        self.assertIsNone(outbox.get(row_ids[0]))
+        outbox.close()
+
+    def test_close_deadline(self):
+        """Test that drain stops at deadline, leaving rows pending"""
+        outbox = promailgate_client.outbox.Outbox(self.client, self.path, batch_size=1, flush_interval=10)
+        for i in range(5):
+            outbox.enqueue('user%s@example.com' % i)
+
+        def slow_send_email(**kwargs):
+            time.sleep(0.05)
+            return 'id'
+
+        with mock.patch.object(self.client, 'send_email', side_effect=slow_send_email):
+            outbox.start()
+            outbox.close(timeout=0)
+
+        outbox = promailgate_client.outbox.Outbox(self.client, self.path)
+        self.assertGreater(outbox.count(), 0)
+        outbox.close()
@@ -0,0 +1,99 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import io
+import os
+import tempfile
+from json import loads
+from unittest import mock, TestCase
+
+from promailgate_client import PromailgateClient
+import promailgate_client.errors
+import promailgate_client.pipeline
+
+
+class TestPipeline(TestCase):
+    """Test streaming campaign pipeline"""
+
+    def test_read_jsonl(self):
+        """Test reading items from JSON lines"""
+        handle = io.StringIO(
+            '{"recipient": "alice@example.com", "data": {"name": "Alice"}}\n'
+            '\n'
+            '{"recipient": "bob@example.com", "return_id": false}\n'
+        )
+        self.assertEqual(list(promailgate_client.pipeline.read_jsonl(handle)), [
+            {'recipient': 'alice@example.com', 'data': {'name': 'Alice'}},
+            {'recipient': 'bob@example.com', 'return_id': False}
+        ])
+
+    def test_read_csv(self):
+        """Test reading items from CSV"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'recipients.csv')
+            with open(path, 'w') as handle:
+                handle.write('recipient,name,return_id\nalice@example.com,Alice,true\nbob@example.com,Bob,0\n')
+
+            self.assertEqual(list(promailgate_client.pipeline.read_items(path)), [
+                {'recipient': 'alice@example.com', 'return_id': True, 'data': {'name': 'Alice'}},
+                {'recipient': 'bob@example.com', 'return_id': False, 'data': {'name': 'Bob'}}
+            ])
+
+    def test_run_campaign(self):
+        """Test items are streamed through client to sink"""
+        client = PromailgateClient(host='test', default_api_key='1234')
+        consumed = []
+
+        def items():
+            for i in range(50):
+                consumed.append(i)
+                yield {'recipient': 'user%s@example.com' % i, 'data': {'i': i}}
+
+        def mocked_send_email(recipient, data=None):
+            if data['i'] % 10 == 0:
+                raise promailgate_client.errors.SendError('Send error: Recipient has unsubscribed')
+            return 'id-%s' % data['i']
+
+        output = io.StringIO()
+        sink = promailgate_client.pipeline.JsonlResultSink(output, flush_every=7)
+        with mock.patch.object(client, 'send_email', side_effect=mocked_send_email):
+            summary = promailgate_client.pipeline.run_campaign(
+                client, items(), sink, concurrency=4, max_in_flight=8)
+        sink.close()
+
+        self.assertEqual(summary.total, 50)
+        self.assertEqual(summary.sent, 45)
+        self.assertEqual(summary.failed, 5)
+        self.assertEqual(summary.errors, {'SendError': 5})
+
+        lines = [loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(len(lines), 50)
+        by_index = {line['index']: line for line in lines}
+        self.assertEqual(by_index[1], {'index': 1, 'recipient': 'user1@example.com', 'message_id': 'id-1'})
+        self.assertEqual(by_index[10], {
+            'index': 10, 'recipient': 'user10@example.com', 'error': 'SendError',
+            'reason': 'Send error: Recipient has unsubscribed'})
+
+    def test_run_campaign_backpressure(self):
+        """Test that input is not read ahead of sink by more than max_in_flight"""
+        client = PromailgateClient(host='test', default_api_key='1234')
+        state = {'consumed': 0, 'written': 0}
+
+        def items():
+            for i in range(200):
+                # Ensure reader never gets far ahead of the sink
+                self.assertLessEqual(state['consumed'] - state['written'], 5)
+                state['consumed'] += 1
+                yield 'user%s@example.com' % i
+
+        def write(result):
+            state['written'] += 1
+
+        with mock.patch.object(client, 'send_email', return_value=True):
+            summary = promailgate_client.pipeline.run_campaign(
+                client, items(), promailgate_client.pipeline.CallbackResultSink(write),
+                concurrency=2, max_in_flight=4)
+        self.assertEqual(summary.sent, 200)
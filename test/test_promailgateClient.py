@@ -4,11 +4,18 @@
 #  Proprietary and confidential
 #  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
 
+import gzip
+import time
 from json import loads, dumps
 from unittest import mock, TestCase, skip
 
+import requests.exceptions
+
 from promailgate_client import PromailgateClient
+import promailgate_client.concurrency
 import promailgate_client.errors
+import promailgate_client.retry
+import promailgate_client.transport
 
 
 class TestPromailgateClient(TestCase):
@@ -110,6 +117,7 @@ class TestPromailgateClient(TestCase):
                 def __init__(self, json_data, status_code):
                     self.json_data = json_data
                     self.status_code = status_code
+                    self.content = dumps(json_data).encode('utf-8')
 
                 def json(self):
                     return self.json_data
@@ -117,9 +125,9 @@ class TestPromailgateClient(TestCase):
             # Ensure required arguments are present
             self.assertTrue('data' in kwargs)
             self.assertTrue('verify' in kwargs)
-            self.assertTrue('return_id' in kwargs['data'])
-            self.assertTrue('recipient' in kwargs['data'])
-            self.assertTrue('api_key' in kwargs['data'])
+            self.assertTrue('return_id' in loads(kwargs['data']))
+            self.assertTrue('recipient' in loads(kwargs['data']))
+            self.assertTrue('api_key' in loads(kwargs['data']))
 
             if loads(kwargs['data'])['api_key'] == invalid_api_key:
                 return MockResponse({'status': 'Error', 'Reason': 'Invalid API Key'}, 401)
@@ -158,14 +166,15 @@ class TestPromailgateClient(TestCase):
             verify_ssl=True,
             default_api_key=None
         )
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             send_r = client.send_email(recipient=test_recipient_1, return_id=False,
                                        data={}, api_key=test_valid_api_key_1)
             self.assertEqual(send_r, True)
             mocked_request.assert_called_once_with(
                 'http://%s/api/message/send' % test_hostname,
                 data=mock.ANY,
-                headers={'Content-type': 'application/json'}, verify=True
+                headers={'Content-type': 'application/json'}, verify=True,
+                timeout=(10.0, 30.0)
             )
             self.assertEqual(
                 loads(mocked_request.call_args[1]['data']),
@@ -180,14 +189,15 @@ class TestPromailgateClient(TestCase):
             verify_ssl=True,
             default_api_key=None
         )
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             send_r = client.send_email(recipient=test_recipient_1, return_id=False,
                                        data={}, api_key=test_valid_api_key_1)
             self.assertEqual(send_r, True)
             mocked_request.assert_called_once_with(
                 'https://%s/api/message/send' % test_hostname,
                 data=mock.ANY,
-                headers={'Content-type': 'application/json'}, verify=True
+                headers={'Content-type': 'application/json'}, verify=True,
+                timeout=(10.0, 30.0)
             )
             self.assertEqual(
                 loads(mocked_request.call_args[1]['data']),
@@ -201,14 +211,15 @@ class TestPromailgateClient(TestCase):
             use_ssl=True,
             default_api_key=None
         )
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             send_r = client.send_email(recipient=test_recipient_1, return_id=False,
                                        data={}, api_key=test_valid_api_key_1)
             self.assertEqual(send_r, True)
             mocked_request.assert_called_once_with(
                 'https://%s/api/message/send' % test_hostname,
                 data=mock.ANY,
-                headers={'Content-type': 'application/json'}, verify=True
+                headers={'Content-type': 'application/json'}, verify=True,
+                timeout=(10.0, 30.0)
             )
             self.assertEqual(
                 loads(mocked_request.call_args[1]['data']),
@@ -223,14 +234,15 @@ class TestPromailgateClient(TestCase):
             verify_ssl=False,
             default_api_key=None
         )
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             send_r = client.send_email(recipient=test_recipient_2, return_id=False,
                                        data={}, api_key=test_valid_api_key_2)
             self.assertEqual(send_r, True)
             mocked_request.assert_called_once_with(
                 'https://%s/api/message/send' % test_hostname,
                 data=mock.ANY,
-                headers={'Content-type': 'application/json'}, verify=False
+                headers={'Content-type': 'application/json'}, verify=False,
+                timeout=(10.0, 30.0)
             )
             self.assertEqual(
                 loads(mocked_request.call_args[1]['data']),
@@ -245,14 +257,15 @@ class TestPromailgateClient(TestCase):
             verify_ssl=True,
             default_api_key=test_valid_api_key_3
         )
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             send_r = client.send_email(recipient=test_recipient_1, return_id=False,
                                        data={})
             self.assertEqual(send_r, True)
             mocked_request.assert_called_once_with(
                 'https://%s/api/message/send' % test_hostname,
                 data=mock.ANY,
-                headers={'Content-type': 'application/json'}, verify=True
+                headers={'Content-type': 'application/json'}, verify=True,
+                timeout=(10.0, 30.0)
             )
             self.assertEqual(
                 loads(mocked_request.call_args[1]['data']),
@@ -267,14 +280,15 @@ class TestPromailgateClient(TestCase):
             verify_ssl=True,
             default_api_key=test_valid_api_key_2
         )
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             send_r = client.send_email(recipient=test_recipient_1, return_id=False,
                                        data={}, api_key=test_valid_api_key_2)
             self.assertEqual(send_r, True)
             mocked_request.assert_called_once_with(
                 'http://%s/api/message/send' % test_hostname,
                 data=mock.ANY,
-                headers={'Content-type': 'application/json'}, verify=True
+                headers={'Content-type': 'application/json'}, verify=True,
+                timeout=(10.0, 30.0)
             )
             self.assertEqual(
                 loads(mocked_request.call_args[1]['data']),
@@ -289,14 +303,15 @@ class TestPromailgateClient(TestCase):
             verify_ssl=True,
             default_api_key=test_valid_api_key_2
         )
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             send_r = client.send_email(recipient=test_recipient_1, return_id=False,
                                        data={}, api_key=test_valid_api_key_2)
             self.assertEqual(send_r, True)
             mocked_request.assert_called_once_with(
                 'http://test-endpoint:1534/api/message/send',
                 data=mock.ANY,
-                headers={'Content-type': 'application/json'}, verify=True
+                headers={'Content-type': 'application/json'}, verify=True,
+                timeout=(10.0, 30.0)
             )
             self.assertEqual(
                 loads(mocked_request.call_args[1]['data']),
@@ -311,14 +326,15 @@ class TestPromailgateClient(TestCase):
             verify_ssl=True,
             default_api_key=None
         )
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             send_r = client.send_email(recipient=test_recipient_1, return_id=True,
                                        data={}, api_key=test_valid_api_key_1)
             self.assertEqual(send_r, test_message_id)
             mocked_request.assert_called_once_with(
                 'https://%s/api/message/send' % test_hostname,
                 data=mock.ANY,
-                headers={'Content-type': 'application/json'}, verify=True
+                headers={'Content-type': 'application/json'}, verify=True,
+                timeout=(10.0, 30.0)
             )
             self.assertEqual(
                 loads(mocked_request.call_args[1]['data']),
@@ -327,38 +343,39 @@ class TestPromailgateClient(TestCase):
             )
 
         # Test with send error
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             with self.assertRaises(promailgate_client.errors.SendError):
                 client.send_email(recipient=test_unsub_recipient, return_id=True,
                                   data={}, api_key=test_valid_api_key_1)
 
         # Test with internal server error
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             with self.assertRaises(promailgate_client.errors.UnknownSendError):
                 client.send_email(recipient=test_server_error_recp, return_id=True,
                                   data={}, api_key=test_valid_api_key_1)
 
         # Test with internal web-server error
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             with self.assertRaises(promailgate_client.errors.SendError):
                 client.send_email(recipient=test_web_server_error_recp, return_id=True,
                                   data={}, api_key=test_valid_api_key_1)
 
         # Test with unknown response code
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             with self.assertRaises(promailgate_client.errors.UnknownResponseError):
                 client.send_email(recipient=test_unknown_response_recp, return_id=True,
                                   data={}, api_key=test_valid_api_key_1)
 
         # Test with data
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             send_r = client.send_email(recipient=test_recipient_1, return_id=False,
                                        data=test_message_data_1, api_key=test_valid_api_key_1)
             self.assertEqual(send_r, True)
             mocked_request.assert_called_once_with(
                 'https://%s/api/message/send' % test_hostname,
                 data=mock.ANY,
-                headers={'Content-type': 'application/json'}, verify=True
+                headers={'Content-type': 'application/json'}, verify=True,
+                timeout=(10.0, 30.0)
             )
             self.assertEqual(
                 loads(mocked_request.call_args[1]['data']),
@@ -367,14 +384,15 @@ class TestPromailgateClient(TestCase):
             )
 
         # Test without data parameter
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             send_r = client.send_email(recipient=test_recipient_1, return_id=False,
                                        api_key=test_valid_api_key_1)
             self.assertEqual(send_r, True)
             mocked_request.assert_called_once_with(
                 'https://%s/api/message/send' % test_hostname,
                 data=mock.ANY,
-                headers={'Content-type': 'application/json'}, verify=True
+                headers={'Content-type': 'application/json'}, verify=True,
+                timeout=(10.0, 30.0)
             )
             self.assertEqual(
                 loads(mocked_request.call_args[1]['data']),
@@ -383,14 +401,15 @@ class TestPromailgateClient(TestCase):
             )
 
         # Test invalid API key
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             with self.assertRaises(promailgate_client.errors.InvalidAPIKeyError):
                 client.send_email(recipient=test_recipient_1, return_id=False,
                                   api_key=invalid_api_key, data={})
             mocked_request.assert_called_once_with(
                 'https://%s/api/message/send' % test_hostname,
                 data=mock.ANY,
-                headers={'Content-type': 'application/json'}, verify=True
+                headers={'Content-type': 'application/json'}, verify=True,
+                timeout=(10.0, 30.0)
             )
             self.assertEqual(
                 loads(mocked_request.call_args[1]['data']),
@@ -405,7 +424,7 @@ class TestPromailgateClient(TestCase):
             verify_ssl=True,
             default_api_key=None
         )
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             with self.assertRaises(promailgate_client.errors.NoApiKeyProvidedError):
                 client.send_email(recipient=test_recipient_1, return_id=False, data={})
 
@@ -419,7 +438,7 @@ class TestPromailgateClient(TestCase):
             verify_ssl=True,
             default_api_key=None
         )
-        with mock.patch('requests.post', side_effect=mocked_requests_post) as mocked_request:
+        with mock.patch('requests.Session.post', side_effect=mocked_requests_post) as mocked_request:
             with self.assertRaises(promailgate_client.errors.NoRecipientProvidedError):
                 client.send_email(recipient='', api_key=test_valid_api_key_1, return_id=False, data={})
 
@@ -444,6 +463,7 @@ class TestPromailgateClient(TestCase):
                 def __init__(self, json_data, status_code):
                     self.json_data = json_data
                     self.status_code = status_code
+                    self.content = dumps(json_data).encode('utf-8')
 
                 def json(self):
                     return self.json_data
@@ -477,12 +497,13 @@ class TestPromailgateClient(TestCase):
             verify_ssl=True,
             default_api_key=None
         )
-        with mock.patch('requests.get', side_effect=mocked_requests_get) as mocked_request:
+        with mock.patch('requests.Session.get', side_effect=mocked_requests_get) as mocked_request:
             test_status = client.get_message_status(http_working_message_id)
             self.assertEqual(test_status, http_message_status)
             mocked_request.assert_called_once_with(
                 'http://%s/api/message/status/%s' % (test_hostname, http_working_message_id),
-                headers={'Content-type': 'application/json'}, verify=True
+                headers={'Content-type': 'application/json'}, verify=True,
+                timeout=(10.0, 30.0)
             )
 
         # Check SSL no-verify
@@ -492,12 +513,13 @@ class TestPromailgateClient(TestCase):
             verify_ssl=False,
             default_api_key=None
         )
-        with mock.patch('requests.get', side_effect=mocked_requests_get) as mocked_request:
+        with mock.patch('requests.Session.get', side_effect=mocked_requests_get) as mocked_request:
             test_status = client.get_message_status(https_working_message_id)
             self.assertEqual(test_status, https_message_status)
             mocked_request.assert_called_once_with(
                 'https://%s/api/message/status/%s' % (test_hostname, https_working_message_id),
-                headers={'Content-type': 'application/json'}, verify=False
+                headers={'Content-type': 'application/json'}, verify=False,
+                timeout=(10.0, 30.0)
             )
 
         # Check HTTPS endpoint
@@ -508,15 +530,16 @@ class TestPromailgateClient(TestCase):
             default_api_key=None
         )
 
-        with mock.patch('requests.get', side_effect=mocked_requests_get) as mocked_request:
+        with mock.patch('requests.Session.get', side_effect=mocked_requests_get) as mocked_request:
             test_status = client.get_message_status(https_working_message_id)
             self.assertEqual(test_status, https_message_status)
             mocked_request.assert_called_once_with(
                 'https://%s/api/message/status/%s' % (test_hostname, https_working_message_id),
-                 headers={'Content-type': 'application/json'}, verify=True
+                 headers={'Content-type': 'application/json'}, verify=True,
+                timeout=(10.0, 30.0)
             )
 
-        with mock.patch('requests.get', side_effect=mocked_requests_get) as mocked_request:
+        with mock.patch('requests.Session.get', side_effect=mocked_requests_get) as mocked_request:
             # Check error cases
             #  - Unknown message
             with self.assertRaises(promailgate_client.errors.NoSuchMessageError):
@@ -529,3 +552,136 @@ class TestPromailgateClient(TestCase):
             #  - Unhandled response code
             with self.assertRaises(promailgate_client.errors.UnknownResponseError):
                 client.get_message_status(unknown_error_message_id)
+
+    def test_send_email_compression(self):
+        """Test large send request bodies are gzip compressed"""
+        client = PromailgateClient(host='test', default_api_key='1234', compress_threshold=1000, compress_level=9)
+        large_data = {'html': '<p>Hello</p>' * 500}
+
+        with mock.patch('requests.Session.post', return_value=mock.MagicMock(status_code=200)) as mocked_request:
+            client.send_email('alice@example.com', data=large_data, return_id=False)
+            kwargs = mocked_request.call_args[1]
+            self.assertEqual(kwargs['headers'], {'Content-type': 'application/json', 'Content-Encoding': 'gzip'})
+            self.assertLess(len(kwargs['data']), 1000)
+            self.assertEqual(loads(gzip.decompress(kwargs['data']))['data'], large_data)
+
+            # Ensure small bodies are not compressed
+            client.send_email('alice@example.com', data={'a': 1}, return_id=False)
+            kwargs = mocked_request.call_args[1]
+            self.assertEqual(kwargs['headers'], {'Content-type': 'application/json'})
+            self.assertEqual(loads(kwargs['data'])['data'], {'a': 1})
+
+        # Ensure bodies are not compressed by default
+        client = PromailgateClient(host='test', default_api_key='1234')
+        with mock.patch('requests.Session.post', return_value=mock.MagicMock(status_code=200)) as mocked_request:
+            client.send_email('alice@example.com', data=large_data, return_id=False)
+            self.assertEqual(loads(mocked_request.call_args[1]['data'])['data'], large_data)
+
+    def test_timeouts(self):
+        """Test requests are made with timeouts, limited by deadline"""
+        client = PromailgateClient(
+            host='test', default_api_key='1234', connect_timeout=2, read_timeout=20, deadline=5)
+        response = mock.MagicMock(status_code=200)
+
+        with mock.patch('requests.Session.post', return_value=response) as mocked_request:
+            client.send_email('alice@example.com', return_id=False, deadline=60)
+            self.assertEqual(mocked_request.call_args[1]['timeout'], (2, 20))
+
+            client.send_email('alice@example.com', return_id=False)
+            connect_timeout, read_timeout = mocked_request.call_args[1]['timeout']
+            self.assertEqual(connect_timeout, 2)
+            self.assertTrue(4 < read_timeout <= 5)
+
+        # Ensure timeouts from exceeding deadline are not retried
+        client = PromailgateClient(
+            host='test', default_api_key='1234', deadline=0.05,
+            retry_policy=promailgate_client.retry.RetryPolicy(max_attempts=5, backoff_base=1, jitter=False))
+        with mock.patch('requests.Session.get', side_effect=requests.exceptions.ReadTimeout()) as mocked_request:
+            with self.assertRaises(promailgate_client.errors.DeadlineExceededError) as context:
+                client.get_message_status('1234')
+            self.assertIsInstance(context.exception.__cause__, promailgate_client.errors.TransportTimeoutError)
+            self.assertEqual(mocked_request.call_count, 1)
+
+    def test_deadline_timeout(self):
+        """Test requests cut short by the deadline raise DeadlineExceededError, without counting as failures"""
+        limiter = promailgate_client.concurrency.AIMDLimiter(initial=8)
+        client = PromailgateClient(
+            endpoints=['https://a', 'https://b'], default_api_key='1234', concurrency_limiter=limiter)
+
+        def post(url, timeout, **kwargs):
+            """Time out once read timeout has elapsed"""
+            time.sleep(timeout[1])
+            raise requests.exceptions.ReadTimeout()
+
+        with mock.patch('requests.Session.post', side_effect=post):
+            for _ in range(5):
+                with self.assertRaises(promailgate_client.errors.DeadlineExceededError) as context:
+                    client.send_email('alice@example.com', deadline=0.01)
+                self.assertIsInstance(context.exception.__cause__, promailgate_client.errors.TransportTimeoutError)
+        self.assertTrue(all(endpoint.healthy for endpoint in client._balancer.endpoints))
+        self.assertEqual((limiter.limit, limiter.in_flight), (8, 0))
+
+        # Ensure timeouts before the deadline are raised as TransportTimeoutError
+        client = PromailgateClient(host='test', default_api_key='1234', deadline=60)
+        with mock.patch('requests.Session.get', side_effect=requests.exceptions.ReadTimeout()):
+            with self.assertRaises(promailgate_client.errors.TransportTimeoutError):
+                client.get_message_status('1234')
+
+
+    def test_deadline_circuit_breaker(self):
+        """Test requests to a stalled server cut short by the deadline open the circuit"""
+        breaker = promailgate_client.retry.CircuitBreaker(failure_threshold=2)
+        client = PromailgateClient(host='test', default_api_key='1234', circuit_breaker=breaker, deadline=0.05)
+
+        def post(url, timeout, **kwargs):
+            """Time out once read timeout has elapsed"""
+            time.sleep(timeout[1])
+            raise requests.exceptions.ReadTimeout()
+
+        with mock.patch('requests.Session.post', side_effect=post) as mocked_request:
+            for _ in range(2):
+                with self.assertRaises(promailgate_client.errors.DeadlineExceededError):
+                    client.send_email('alice@example.com')
+            for _ in range(4):
+                with self.assertRaises(promailgate_client.errors.CircuitOpenError):
+                    client.send_email('alice@example.com')
+            self.assertEqual(mocked_request.call_count, 2)
+        self.assertEqual(breaker.state, promailgate_client.retry.CircuitBreaker.OPEN)
+    def test_session_pool(self):
+        """Test HTTP session is shared and configured with pool settings"""
+        client = PromailgateClient(
+            host='test.endpoint.localhost',
+            pool_connections=3,
+            pool_maxsize=25,
+            default_api_key=None)
+
+        transport = client._get_transport()
+        # Ensure same transport is returned on subsequent calls
+        self.assertIs(client._get_transport(), transport)
+        self.assertIsInstance(transport, promailgate_client.transport.RequestsTransport)
+
+        session = transport._get_session()
+
+        adapter = session.get_adapter('https://test.endpoint.localhost')
+        self.assertEqual(adapter._pool_connections, 3)
+        self.assertEqual(adapter._pool_maxsize, 25)
+        self.assertIs(session.get_adapter('http://test.endpoint.localhost'), adapter)
+
+    def test_close(self):
+        """Test close and context manager lifecycle"""
+        with PromailgateClient(host='test.endpoint.localhost') as client:
+            session = client._get_transport()._get_session()
+            with mock.patch.object(session, 'close') as mocked_close:
+                client.close()
+                mocked_close.assert_called_once_with()
+
+            # Ensure a new session is created after closing
+            self.assertIsNot(client._get_transport()._get_session(), session)
+
+        with mock.patch.object(PromailgateClient, 'close') as mocked_close:
+            with PromailgateClient(host='test.endpoint.localhost'):
+                pass
+            mocked_close.assert_called_once_with()
+
+        # Ensure closing a client that has not been used does not fail
+        PromailgateClient(host='test.endpoint.localhost').close()
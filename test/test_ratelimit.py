@@ -0,0 +1,135 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import os
+import pickle
+import tempfile
+from unittest import mock, TestCase
+
+from promailgate_client import PromailgateClient
+import promailgate_client.errors
+import promailgate_client.ratelimit
+
+
+class TestTokenBucket(TestCase):
+    """Test TokenBucket class"""
+
+    @mock.patch('promailgate_client.ratelimit.time.sleep')
+    @mock.patch('promailgate_client.ratelimit.time.monotonic', return_value=100)
+    def test_acquire(self, mocked_monotonic, mocked_sleep):
+        """Test tokens are consumed and refilled at rate"""
+        bucket = promailgate_client.ratelimit.TokenBucket(rate=10, capacity=2)
+
+        self.assertTrue(bucket.acquire())
+        self.assertTrue(bucket.acquire())
+        self.assertFalse(bucket.acquire(blocking=False))
+        self.assertFalse(bucket.acquire(timeout=0.05))
+        mocked_sleep.assert_not_called()
+
+        # Blocking acquire reserves token and waits for it
+        self.assertTrue(bucket.acquire())
+        mocked_sleep.assert_called_once_with(0.1)
+        # Next caller waits behind the reservation
+        self.assertTrue(bucket.acquire())
+        self.assertAlmostEqual(mocked_sleep.call_args[0][0], 0.2)
+
+        # Tokens are refilled over time, up to capacity
+        mocked_monotonic.return_value = 110
+        mocked_sleep.reset_mock()
+        self.assertTrue(bucket.acquire())
+        self.assertTrue(bucket.acquire())
+        mocked_sleep.assert_not_called()
+        self.assertFalse(bucket.acquire(blocking=False))
+
+    def test_file_token_bucket(self):
+        """Test that file-backed buckets share a budget"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'bucket')
+            with mock.patch('promailgate_client.ratelimit.time.time', return_value=100):
+                bucket_1 = promailgate_client.ratelimit.FileTokenBucket(path, rate=1, capacity=3)
+                bucket_2 = promailgate_client.ratelimit.FileTokenBucket(path, rate=1, capacity=3)
+
+                self.assertTrue(bucket_1.acquire(blocking=False))
+                self.assertTrue(bucket_2.acquire(blocking=False))
+                self.assertTrue(bucket_1.acquire(blocking=False))
+                self.assertFalse(bucket_2.acquire(blocking=False))
+
+            with mock.patch('promailgate_client.ratelimit.time.time', return_value=101):
+                self.assertTrue(bucket_2.acquire(blocking=False))
+                self.assertFalse(bucket_1.acquire(blocking=False))
+
+            bucket_1.close()
+            bucket_2.close()
+
+
+class TestRateLimiter(TestCase):
+    """Test RateLimiter class"""
+
+    def test_buckets_per_key(self):
+        """Test each key has a separate bucket"""
+        limiter = promailgate_client.ratelimit.RateLimiter(rate=1, capacity=1)
+        self.assertTrue(limiter.acquire('key-1', blocking=False))
+        self.assertFalse(limiter.acquire('key-1', blocking=False))
+        self.assertTrue(limiter.acquire('key-2', blocking=False))
+        self.assertIs(limiter.get_bucket('key-1'), limiter.get_bucket('key-1'))
+
+    def test_shared_rate_limiter(self):
+        """Test shared limiter does not write API key to disk"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            limiter = promailgate_client.ratelimit.SharedRateLimiter(temp_dir, rate=1, capacity=1)
+            self.assertTrue(limiter.acquire('secret-api-key', blocking=False))
+            self.assertFalse(limiter.acquire('secret-api-key', blocking=False))
+
+            other = promailgate_client.ratelimit.SharedRateLimiter(temp_dir, rate=1, capacity=1)
+            self.assertFalse(other.acquire('secret-api-key', blocking=False))
+
+            self.assertEqual(len(os.listdir(temp_dir)), 1)
+            self.assertNotIn('secret-api-key', os.listdir(temp_dir)[0])
+            limiter.close()
+            other.close()
+
+    def test_shared_rate_limiter_all_keys(self):
+        """Test shared limiter applies a single budget to all keys and can be passed to other processes"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            limiter = promailgate_client.ratelimit.SharedRateLimiter(temp_dir, rate=1, capacity=1, per_key=False)
+            self.assertTrue(limiter.acquire('key-1', blocking=False))
+            self.assertFalse(limiter.acquire('key-2', blocking=False))
+
+            copied = pickle.loads(pickle.dumps(limiter))
+            self.assertFalse(copied.acquire('key-3', blocking=False))
+            self.assertEqual(len(os.listdir(temp_dir)), 1)
+            limiter.close()
+            copied.close()
+
+    def test_client_rate_limit(self):
+        """Test send_email acquires from rate limiter using API key"""
+        limiter = mock.MagicMock()
+        client = PromailgateClient(host='test', default_api_key='default-key', rate_limiter=limiter)
+
+        response = mock.MagicMock(status_code=200)
+        with mock.patch('requests.Session.post', return_value=response):
+            client.send_email('alice@example.com', return_id=False)
+            limiter.acquire.assert_called_once_with('default-key', timeout=None)
+
+            client.send_email('alice@example.com', api_key='other-key', return_id=False)
+            limiter.acquire.assert_called_with('other-key', timeout=None)
+
+    def test_client_deadline(self):
+        """Test send_email waits for rate limit for no longer than the deadline"""
+        limiter = promailgate_client.ratelimit.RateLimiter(rate=1, capacity=1)
+        client = PromailgateClient(host='test', default_api_key='default-key', rate_limiter=limiter)
+
+        response = mock.MagicMock(status_code=200)
+        with mock.patch('requests.Session.post', return_value=response) as mocked_request:
+            client.send_email('alice@example.com', return_id=False, deadline=0.5)
+            with mock.patch('promailgate_client.ratelimit.time.sleep') as mocked_sleep:
+                with self.assertRaises(promailgate_client.errors.DeadlineExceededError):
+                    client.send_email('alice@example.com', return_id=False, deadline=0.5)
+                mocked_sleep.assert_not_called()
+            self.assertEqual(mocked_request.call_count, 1)
+
+        # Ensure no token was reserved for the send that was not attempted
+        self.assertGreater(limiter.get_bucket('default-key')._tokens, -0.5)
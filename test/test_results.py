@@ -0,0 +1,136 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import csv
+import io
+import os
+import tempfile
+from unittest import mock, TestCase
+
+from promailgate_client import PromailgateClient
+import promailgate_client.bulk
+import promailgate_client.errors
+import promailgate_client.pipeline
+import promailgate_client.results
+import promailgate_client.tracker
+
+
+def get_results(count):
+    """Return send results, with every fifth send failing"""
+    results = []
+    for index in range(count):
+        recipient = 'user%s@example.com' % index
+        if index % 5 == 4:
+            results.append(promailgate_client.bulk.SendResult(
+                index, recipient, error=promailgate_client.errors.SendError('Send error: Recipient has unsubscribed')))
+        else:
+            results.append(promailgate_client.bulk.SendResult(index, recipient, message_id='message-%s' % index))
+    return results
+
+
+class TestResultStore(TestCase):
+    """Test ResultStore class"""
+
+    def _check_store(self, store, count):
+        """Check records and joined statuses of store containing get_results(count)"""
+        self.assertEqual(len(store), count)
+        record = store[3]
+        self.assertEqual(
+            (record.index, record.recipient, record.message_id, record.error, record.state),
+            (3, 'user3@example.com', 'message-3', None, None))
+        record = store[4]
+        self.assertFalse(record.ok)
+        self.assertEqual(
+            (record.message_id, record.error, record.reason),
+            (None, 'SendError', 'Send error: Recipient has unsubscribed'))
+        self.assertEqual([record.index for record in store], list(range(count)))
+
+        statuses = [('message-%s' % index, {'MessageStatus': 'DELIVERED'}) for index in range(0, count, 2)]
+        statuses.append(promailgate_client.tracker.StatusUpdate('message-1', {'MessageStatus': 'BOUNCED'}))
+        statuses.append(('unknown', {'MessageStatus': 'DELIVERED'}))
+        # Statuses of failed sends are not matched
+        self.assertEqual(store.join_statuses(statuses), len([
+            index for index in range(0, count, 2) if index % 5 != 4]) + 1)
+        self.assertEqual(store[0].state, 'DELIVERED')
+        self.assertEqual(store[1].state, 'BOUNCED')
+        self.assertIsNone(store[3].state)
+        self.assertIsNone(store.find('message-4'))
+        self.assertEqual(store.find('message-%s' % (count - 2)), count - 2)
+
+    def test_memory(self):
+        """Test results held in memory"""
+        store = promailgate_client.results.ResultStore()
+        for result in get_results(50):
+            store.write(result)
+        self._check_store(store, 50)
+
+        summary = store.get_summary()
+        self.assertEqual((summary['sent'], summary['failed']), (40, 10))
+        self.assertEqual(summary['errors'], {'SendError': 10})
+        self.assertEqual(summary['states'], {'DELIVERED': 20, 'BOUNCED': 1, None: 29})
+
+        with self.assertRaises(IndexError):
+            store[50]
+
+    def test_persisted(self):
+        """Test results spilled to files and reopened"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = promailgate_client.results.ResultStore(temp_dir, spill_rows=7)
+            with store:
+                for result in get_results(50):
+                    store.write(result)
+                # Rows are read from both mapped files and buffers
+                self._check_store(store, 50)
+
+            store = promailgate_client.results.ResultStore(temp_dir)
+            self.assertEqual(store[1].state, 'BOUNCED')
+            store.write(promailgate_client.bulk.SendResult(50, 'late@example.com', message_id='message-50'))
+            store.update_status('message-50', {'MessageStatus': 'SENDING'})
+            store.close()
+
+            store = promailgate_client.results.ResultStore(temp_dir)
+            self.assertEqual(len(store), 51)
+            self.assertEqual((store[50].recipient, store[50].state), ('late@example.com', 'SENDING'))
+            self.assertEqual(store.get_summary()['states']['DELIVERED'], 20)
+            store.close()
+
+    def test_distinct_reasons(self):
+        """Test reasons including the recipient are not interned"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with promailgate_client.results.ResultStore(temp_dir, spill_rows=100) as store:
+                for index in range(1000):
+                    recipient = 'user%s@example.com' % index
+                    store.write(promailgate_client.bulk.SendResult(
+                        index, recipient,
+                        error=promailgate_client.errors.RecipientSuppressedError(
+                            'Recipient is suppressed: %s' % recipient)))
+            self.assertLess(os.path.getsize(os.path.join(temp_dir, promailgate_client.results.STRINGS_FILE)), 100)
+
+            store = promailgate_client.results.ResultStore(temp_dir)
+            self.assertEqual(
+                (store[999].error, store[999].reason),
+                ('RecipientSuppressedError', 'Recipient is suppressed: user999@example.com'))
+            self.assertEqual(store.get_summary()['errors'], {'RecipientSuppressedError': 1000})
+            store.close()
+
+    def test_write_csv(self):
+        """Test campaign report is written as CSV"""
+        with promailgate_client.results.ResultStore() as store:
+            client = PromailgateClient(host='test', default_api_key='1234')
+            with mock.patch.object(client, 'send_email', side_effect=lambda recipient: recipient + '-id'):
+                promailgate_client.pipeline.run_campaign(
+                    client, ['a@example.com', 'b@example.com'], store, ordered=True)
+            store.update_status('a@example.com-id', {'MessageStatus': 'DELIVERED'})
+
+            output = io.StringIO()
+            store.write_csv(output)
+        rows = list(csv.reader(io.StringIO(output.getvalue())))
+        self.assertEqual(rows, [
+            ['index', 'recipient', 'message_id', 'error', 'reason', 'state'],
+            ['0', 'a@example.com', 'a@example.com-id', '', '', 'DELIVERED'],
+            ['1', 'b@example.com', 'b@example.com-id', '', '', ''],
+        ])
+
@@ -0,0 +1,234 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+from json import dumps
+from unittest import mock, TestCase
+
+import requests.exceptions
+
+from promailgate_client import PromailgateClient
+import promailgate_client.errors
+import promailgate_client.retry
+
+
+class MockResponse:
+    def __init__(self, json_data, status_code):
+        self.json_data = json_data
+        self.status_code = status_code
+        self.content = dumps(json_data).encode('utf-8')
+
+    def json(self):
+        return self.json_data
+
+
+class TestRetryPolicy(TestCase):
+    """Test RetryPolicy and call_with_retry"""
+
+    def test_get_backoff(self):
+        """Test exponential backoff with cap and jitter"""
+        policy = promailgate_client.retry.RetryPolicy(backoff_base=0.5, backoff_max=3, jitter=False)
+        self.assertEqual([policy.get_backoff(attempt) for attempt in range(1, 6)], [0.5, 1, 2, 3, 3])
+
+        policy = promailgate_client.retry.RetryPolicy(backoff_base=0.5, backoff_max=3)
+        for attempt in range(1, 6):
+            self.assertTrue(0 <= policy.get_backoff(attempt) <= min(3, 0.5 * 2 ** (attempt - 1)))
+
+    def test_is_retryable(self):
+        """Test default retryable errors"""
+        policy = promailgate_client.retry.RetryPolicy()
+        self.assertTrue(policy.is_retryable(promailgate_client.errors.UnknownSendError()))
+        self.assertTrue(policy.is_retryable(promailgate_client.errors.UnknownServerError()))
+        self.assertTrue(policy.is_retryable(promailgate_client.errors.TransportError()))
+        self.assertFalse(policy.is_retryable(promailgate_client.errors.SendError()))
+        self.assertFalse(policy.is_retryable(promailgate_client.errors.InvalidAPIKeyError()))
+
+    @mock.patch('promailgate_client.retry.time.sleep')
+    def test_call_with_retry(self, mocked_sleep):
+        """Test retries until success or attempts are exhausted"""
+        policy = promailgate_client.retry.RetryPolicy(max_attempts=3, jitter=False)
+        on_retry = mock.MagicMock()
+
+        func = mock.MagicMock(side_effect=[promailgate_client.errors.UnknownSendError(), 'message-id'])
+        self.assertEqual(promailgate_client.retry.call_with_retry(func, policy, on_retry=on_retry), 'message-id')
+        self.assertEqual(func.call_count, 2)
+        mocked_sleep.assert_called_once_with(0.1)
+        on_retry.assert_called_once_with(1, mock.ANY)
+
+        func = mock.MagicMock(side_effect=promailgate_client.errors.UnknownSendError())
+        with self.assertRaises(promailgate_client.errors.UnknownSendError):
+            promailgate_client.retry.call_with_retry(func, policy)
+        self.assertEqual(func.call_count, 3)
+
+        # Ensure non-retryable errors are raised immediately
+        func = mock.MagicMock(side_effect=promailgate_client.errors.SendError())
+        with self.assertRaises(promailgate_client.errors.SendError):
+            promailgate_client.retry.call_with_retry(func, policy)
+        self.assertEqual(func.call_count, 1)
+
+    @mock.patch('promailgate_client.retry.time.sleep')
+    def test_retry_budget(self, mocked_sleep):
+        """Test retries stop once budget is exhausted"""
+        budget = promailgate_client.retry.RetryBudget(ratio=0.5, min_retries_per_second=0, max_balance=2)
+        policy = promailgate_client.retry.RetryPolicy(max_attempts=10, budget=budget)
+
+        func = mock.MagicMock(side_effect=promailgate_client.errors.UnknownSendError())
+        with self.assertRaises(promailgate_client.errors.UnknownSendError):
+            promailgate_client.retry.call_with_retry(func, policy)
+        # Initial balance of 2 permits 2 retries
+        self.assertEqual(func.call_count, 3)
+
+        # Requests replenish budget
+        for _ in range(2):
+            budget.record_request()
+        self.assertTrue(budget.try_withdraw())
+        self.assertFalse(budget.try_withdraw())
+
+    @mock.patch('promailgate_client.retry.time.sleep')
+    def test_deadline(self, mocked_sleep):
+        """Test retries stop once the deadline would be exceeded"""
+        policy = promailgate_client.retry.RetryPolicy(max_attempts=10, backoff_base=1, jitter=False)
+        func = mock.MagicMock(side_effect=promailgate_client.errors.UnknownSendError())
+
+        with mock.patch('promailgate_client.retry.time.monotonic', return_value=100):
+            # Backoffs of 1 and 2 seconds fit within deadline, but a further backoff of 4 seconds does not
+            with self.assertRaises(promailgate_client.errors.DeadlineExceededError) as context:
+                promailgate_client.retry.call_with_retry(func, policy, deadline=103.5)
+            self.assertIsInstance(context.exception.__cause__, promailgate_client.errors.UnknownSendError)
+        self.assertEqual(func.call_count, 3)
+
+        # Time spent in attempts also counts towards deadline
+        func.reset_mock()
+        with mock.patch('promailgate_client.retry.time.monotonic', side_effect=[100, 100, 101, 102]):
+            with self.assertRaises(promailgate_client.errors.DeadlineExceededError):
+                promailgate_client.retry.call_with_retry(func, policy, deadline=103.5)
+        self.assertEqual(func.call_count, 2)
+
+        # Ensure no attempt is made once the deadline has passed
+        func = mock.MagicMock()
+        with self.assertRaises(promailgate_client.errors.DeadlineExceededError):
+            promailgate_client.retry.call_with_retry(func, deadline=0)
+        func.assert_not_called()
+
+
+class TestCircuitBreaker(TestCase):
+    """Test CircuitBreaker class"""
+
+    def test_circuit_breaker(self):
+        """Test circuit opens after failures and recovers after reset timeout"""
+        breaker = promailgate_client.retry.CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        failing = mock.MagicMock(side_effect=promailgate_client.errors.UnknownSendError())
+
+        with mock.patch('promailgate_client.retry.time.monotonic', return_value=100):
+            for _ in range(2):
+                with self.assertRaises(promailgate_client.errors.UnknownSendError):
+                    promailgate_client.retry.call_with_retry(failing, circuit_breaker=breaker)
+            self.assertEqual(breaker.state, breaker.OPEN)
+
+            with self.assertRaises(promailgate_client.errors.CircuitOpenError):
+                promailgate_client.retry.call_with_retry(failing, circuit_breaker=breaker)
+            self.assertEqual(failing.call_count, 2)
+
+        # Failed trial request re-opens circuit
+        with mock.patch('promailgate_client.retry.time.monotonic', return_value=110):
+            self.assertEqual(breaker.state, breaker.HALF_OPEN)
+            with self.assertRaises(promailgate_client.errors.UnknownSendError):
+                promailgate_client.retry.call_with_retry(failing, circuit_breaker=breaker)
+            self.assertEqual(breaker.state, breaker.OPEN)
+
+        # Successful trial request closes circuit
+        with mock.patch('promailgate_client.retry.time.monotonic', return_value=120):
+            self.assertEqual(
+                promailgate_client.retry.call_with_retry(lambda: 'id', circuit_breaker=breaker), 'id')
+            self.assertEqual(breaker.state, breaker.CLOSED)
+
+    def test_client_errors_do_not_open_circuit(self):
+        """Test that request errors are not counted as endpoint failures"""
+        breaker = promailgate_client.retry.CircuitBreaker(failure_threshold=1)
+        func = mock.MagicMock(side_effect=promailgate_client.errors.SendError())
+        for _ in range(3):
+            with self.assertRaises(promailgate_client.errors.SendError):
+                promailgate_client.retry.call_with_retry(func, circuit_breaker=breaker)
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+    def test_deadline_errors(self):
+        """Test deadline errors are counted as failures only when caused by a failed request"""
+        breaker = promailgate_client.retry.CircuitBreaker(failure_threshold=2, reset_timeout=0)
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+
+        # Deadline passing before a request completes releases trial, leaving circuit half-open
+        func = mock.MagicMock(side_effect=promailgate_client.errors.DeadlineExceededError())
+        for _ in range(2):
+            with self.assertRaises(promailgate_client.errors.DeadlineExceededError):
+                promailgate_client.retry.call_with_retry(func, circuit_breaker=breaker)
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+
+        error = promailgate_client.errors.DeadlineExceededError()
+        error.__cause__ = promailgate_client.errors.TransportTimeoutError()
+        func.side_effect = error
+        with self.assertRaises(promailgate_client.errors.DeadlineExceededError):
+            promailgate_client.retry.call_with_retry(func, circuit_breaker=breaker)
+        self.assertEqual(breaker._state, breaker.OPEN)
+
+
+class TestClientRetry(TestCase):
+    """Test retry integration in PromailgateClient"""
+
+    @mock.patch('promailgate_client.retry.time.sleep')
+    def test_send_email_retry(self, mocked_sleep):
+        """Test send_email retries server errors"""
+        client = PromailgateClient(
+            host='test', default_api_key='1234',
+            retry_policy=promailgate_client.retry.RetryPolicy(max_attempts=3))
+
+        responses = [
+            requests.exceptions.ConnectTimeout(),
+            MockResponse({}, 500),
+            MockResponse({'status': 'OK', 'message_id': 'test-id'}, 201)
+        ]
+        with mock.patch('requests.Session.post', side_effect=responses) as mocked_request:
+            self.assertEqual(client.send_email('alice@example.com'), 'test-id')
+            self.assertEqual(mocked_request.call_count, 3)
+
+        with mock.patch('requests.Session.get', side_effect=[MockResponse({}, 500), MockResponse({}, 404)]):
+            with self.assertRaises(promailgate_client.errors.NoSuchMessageError):
+                client.get_message_status('test-id')
+
+    @mock.patch('promailgate_client.retry.time.sleep')
+    def test_send_email_not_resent(self, mocked_sleep):
+        """Test sends that may have reached the server are only retried with an idempotency key"""
+        client = PromailgateClient(
+            host='test', default_api_key='1234',
+            retry_policy=promailgate_client.retry.RetryPolicy(max_attempts=3))
+        for error in (requests.exceptions.ReadTimeout(), requests.exceptions.ConnectionError()):
+            with mock.patch('requests.Session.post', side_effect=error) as mocked_request:
+                with self.assertRaises(promailgate_client.errors.TransportError):
+                    client.send_email('alice@example.com')
+                self.assertEqual(mocked_request.call_count, 1)
+
+        responses = [requests.exceptions.ReadTimeout(), MockResponse({'status': 'OK', 'message_id': 'test-id'}, 201)]
+        with mock.patch('requests.Session.post', side_effect=responses) as mocked_request:
+            self.assertEqual(client.send_email('alice@example.com', idempotency_key='key'), 'test-id')
+            self.assertEqual(mocked_request.call_count, 2)
+
+        # Ensure status requests are retried after timeouts
+        responses = [requests.exceptions.ReadTimeout(), MockResponse({'MessageStatus': 'SENT'}, 200)]
+        with mock.patch('requests.Session.get', side_effect=responses):
+            self.assertEqual(client.get_message_status('test-id'), {'MessageStatus': 'SENT'})
+
+    def test_send_email_circuit_breaker(self):
+        """Test send_email fails fast when circuit is open"""
+        client = PromailgateClient(
+            host='test', default_api_key='1234',
+            circuit_breaker=promailgate_client.retry.CircuitBreaker(failure_threshold=1))
+
+        with mock.patch('requests.Session.post', return_value=MockResponse({}, 500)) as mocked_request:
+            with self.assertRaises(promailgate_client.errors.UnknownSendError):
+                client.send_email('alice@example.com')
+            with self.assertRaises(promailgate_client.errors.CircuitOpenError):
+                client.send_email('alice@example.com')
+            self.assertEqual(mocked_request.call_count, 1)
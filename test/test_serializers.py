@@ -0,0 +1,65 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+from json import loads
+from unittest import mock, TestCase, skipIf
+
+from promailgate_client import PromailgateClient
+import promailgate_client.errors
+import promailgate_client.serializers
+
+
+class TestSerializers(TestCase):
+    """Test serializers"""
+
+    test_payload = {'api_key': '1234', 'recipient': 'alice@example.com',
+                    'data': {'names': ['Bob', 'Café', {'inner': 123}], 1: 'one'}, 'return_id': True}
+
+    def test_json_serializer(self):
+        """Test standard library serializer"""
+        serializer = promailgate_client.serializers.JsonSerializer()
+        encoded = serializer.dumps(self.test_payload)
+        self.assertIsInstance(encoded, bytes)
+        self.assertEqual(serializer.loads(encoded)['data']['1'], 'one')
+        self.assertEqual(serializer.loads(encoded)['data']['names'][1], 'Café')
+
+    @skipIf(promailgate_client.serializers.orjson is None, 'orjson is not installed')
+    def test_orjson_serializer(self):
+        """Test orjson serializer produces same document as stdlib serializer"""
+        serializer = promailgate_client.serializers.OrjsonSerializer()
+        encoded = serializer.dumps(self.test_payload)
+        self.assertIsInstance(encoded, bytes)
+        self.assertEqual(
+            loads(encoded), loads(promailgate_client.serializers.JsonSerializer().dumps(self.test_payload)))
+        self.assertEqual(serializer.loads(b'{"a": [1, 2]}'), {'a': [1, 2]})
+        self.assertIsInstance(
+            promailgate_client.serializers.get_default_serializer(),
+            promailgate_client.serializers.OrjsonSerializer)
+
+    def test_default_serializer_fallback(self):
+        """Test stdlib serializer is used when orjson is not installed"""
+        with mock.patch('promailgate_client.serializers.orjson', None):
+            self.assertIsInstance(
+                promailgate_client.serializers.get_default_serializer(),
+                promailgate_client.serializers.JsonSerializer)
+            with self.assertRaises(RuntimeError):
+                promailgate_client.serializers.OrjsonSerializer()
+
+    def test_client_decodes_response_once(self):
+        """Test client uses serializer and decodes error response once"""
+        serializer = mock.MagicMock(wraps=promailgate_client.serializers.JsonSerializer())
+        client = PromailgateClient(host='test', default_api_key='1234', serializer=serializer)
+
+        response = mock.MagicMock(status_code=400, content=b'{"message": "Bad request"}')
+        with mock.patch('requests.Session.post', return_value=response) as mocked_request:
+            with self.assertRaises(promailgate_client.errors.SendError) as raised:
+                client.send_email('alice@example.com')
+
+        self.assertEqual(str(raised.exception), 'Send error: Bad request')
+        serializer.dumps.assert_called_once_with(
+            {'api_key': '1234', 'recipient': 'alice@example.com', 'data': {}, 'return_id': True})
+        self.assertEqual(loads(mocked_request.call_args[1]['data'])['recipient'], 'alice@example.com')
+        serializer.loads.assert_called_once_with(b'{"message": "Bad request"}')
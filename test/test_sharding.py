@@ -0,0 +1,170 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import http.server
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+import promailgate_client.cli
+import promailgate_client.errors
+import promailgate_client.sharding
+
+from test.test_transport import MockHandler
+
+
+class Server(http.server.ThreadingHTTPServer):
+    """Server accepting a burst of connections from all workers, without resetting any"""
+
+    request_queue_size = 64
+
+
+class SlowHandler(MockHandler):
+    """Handler delaying the response to slow@example.com until the server is released"""
+
+    def do_POST(self):
+        """Count request and delay slow recipient"""
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        recipient = json.loads(body.decode('utf-8'))['recipient']
+        self.server.requests += 1
+        if recipient == 'slow@example.com':
+            self.server.release.wait(10)
+        self._respond(201, {'message_id': recipient})
+
+
+class TestSharding(TestCase):
+    """Test sharded sending from worker processes"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Start local server"""
+        cls.server = Server(('127.0.0.1', 0), MockHandler)
+        cls.server.connections = 0
+        cls.url = 'http://127.0.0.1:%s' % cls.server.server_address[1]
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop local server"""
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_get_shard(self):
+        """Test recipients are assigned to a stable shard"""
+        self.assertEqual(promailgate_client.sharding.get_shard('alice@example.com', 4),
+                         promailgate_client.sharding.get_shard('alice@example.com', 4))
+        shards = set(promailgate_client.sharding.get_shard('user%s@example.com' % i, 4) for i in range(100))
+        self.assertEqual(shards, {0, 1, 2, 3})
+
+    def test_send_many(self):
+        """Test results are merged in input order"""
+        sender = promailgate_client.sharding.ShardedSender(
+            {'url': self.url, 'default_api_key': '1234', 'transport': 'http.client'},
+            processes=2, concurrency=4, batch_size=7, max_in_flight=30)
+        items = ['user%s@example.com' % i for i in range(200)] + [{'recipient': 'bob@example.com', 'data': {'a': 1}}]
+        results = list(sender.send_many(iter(items)))
+
+        self.assertEqual([result.index for result in results], list(range(201)))
+        self.assertEqual([result.message_id for result in results],
+                         ['user%s@example.com' % i for i in range(200)] + ['bob@example.com'])
+        self.assertEqual((sender.summary.sent, sender.summary.failed), (201, 0))
+        self.assertEqual(sorted(sender.shard_summaries), [0, 1])
+        self.assertEqual(sum(summary.sent for summary, _ in sender.shard_summaries.values()), 201)
+
+    def test_send_many_bounded(self):
+        """Test results buffered behind a slow send count towards max_in_flight"""
+        server = Server(('127.0.0.1', 0), SlowHandler)
+        server.connections = 0
+        server.requests = 0
+        server.release = threading.Event()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        consumed = []
+
+        def items():
+            """Yield slow recipient, followed by fast recipients, recording items consumed"""
+            for index in range(100):
+                consumed.append(index)
+                yield 'slow@example.com' if index == 0 else 'user%s@example.com' % index
+
+        try:
+            sender = promailgate_client.sharding.ShardedSender(
+                {'url': 'http://127.0.0.1:%s' % server.server_address[1], 'default_api_key': '1234',
+                 'transport': 'http.client'},
+                processes=2, concurrency=4, batch_size=3, max_in_flight=10)
+            results = []
+            thread = threading.Thread(target=lambda: results.extend(sender.send_many(items())))
+            thread.start()
+
+            # Wait for all sends allowed in flight to reach the server, then allow time for any more
+            deadline = time.monotonic() + 30
+            while server.requests < 10 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            time.sleep(0.5)
+            self.assertEqual(len(consumed), 10)
+            self.assertEqual(server.requests, 10)
+
+            server.release.set()
+            thread.join(30)
+            self.assertEqual([result.index for result in results], list(range(100)))
+        finally:
+            server.release.set()
+            server.shutdown()
+            server.server_close()
+
+    def test_errors(self):
+        """Test errors from workers are returned in results"""
+        results = list(promailgate_client.sharding.send_sharded(
+            {'url': self.url}, ['alice@example.com', 'bob@example.com'], processes=2, ordered=False))
+        self.assertEqual(sorted(result.recipient for result in results), ['alice@example.com', 'bob@example.com'])
+        for result in results:
+            self.assertIsInstance(result.error, promailgate_client.errors.NoApiKeyProvidedError)
+
+    def test_worker_failure(self):
+        """Test error is raised if a worker exits unexpectedly"""
+        sender = promailgate_client.sharding.ShardedSender({'url': self.url, 'unknown': True}, processes=1)
+        with self.assertRaises(RuntimeError):
+            list(sender.send_many(['alice@example.com']))
+
+    def test_cli(self):
+        """Test command line sender with multiple processes"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_path = os.path.join(temp_dir, 'recipients.csv')
+            with open(input_path, 'w') as handle:
+                handle.write('recipient,name\n')
+                for index in range(30):
+                    handle.write('user%s@example.com,User %s\n' % (index, index))
+
+            args = promailgate_client.cli.get_parser().parse_args([
+                input_path, '--url', self.url, '--api-key', '1234', '--processes', '2', '--quiet'])
+            summary = promailgate_client.cli.run(args, stream=io.StringIO())
+            self.assertEqual((summary.sent, summary.failed), (30, 0))
+
+            # Ensure nothing is sent when run again
+            summary = promailgate_client.cli.run(args, stream=io.StringIO())
+            self.assertEqual(summary.total, 0)
+
+    def test_cli_rate(self):
+        """Test rate limit is shared by all processes"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_path = os.path.join(temp_dir, 'recipients.csv')
+            with open(input_path, 'w') as handle:
+                handle.write('recipient\n')
+                for index in range(30):
+                    handle.write('user%s@example.com\n' % index)
+
+            args = promailgate_client.cli.get_parser().parse_args([
+                input_path, '--url', self.url, '--api-key', '1234', '--processes', '2', '--rate', '10',
+                '--quiet'])
+            start = time.monotonic()
+            summary = promailgate_client.cli.run(args, stream=io.StringIO())
+            self.assertEqual((summary.sent, summary.failed), (30, 0))
+            # A burst of 10 sends is permitted, after which the remaining 20 are sent at 10 per second.
+            # With a separate limit per process, this would take around 0.5 seconds.
+            self.assertGreaterEqual(time.monotonic() - start, 1.8)
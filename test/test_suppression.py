@@ -0,0 +1,133 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import os
+import pickle
+import tempfile
+from unittest import mock, TestCase
+
+from promailgate_client import PromailgateClient
+import promailgate_client.errors
+import promailgate_client.suppression
+
+
+class TestBloomFilter(TestCase):
+    """Test BloomFilter class"""
+
+    def test_membership(self):
+        """Test added items are found and false positive rate is close to error rate"""
+        bloom = promailgate_client.suppression.BloomFilter(2000, error_rate=0.01)
+        for index in range(2000):
+            bloom.add('user%s@example.com' % index)
+
+        self.assertEqual(len(bloom), 2000)
+        self.assertTrue(all('user%s@example.com' % index in bloom for index in range(2000)))
+        false_positives = sum('other%s@example.com' % index in bloom for index in range(10000))
+        self.assertLess(false_positives, 300)
+
+        with self.assertRaises(ValueError):
+            promailgate_client.suppression.BloomFilter(0)
+
+
+class TestSuppressionList(TestCase):
+    """Test SuppressionList class"""
+
+    def test_check(self):
+        """Test suppressed and invalid recipients are rejected"""
+        suppression = promailgate_client.suppression.SuppressionList(validate_addresses=True)
+        suppression.add(' Alice@Example.com ', 'Recipient has unsubscribed')
+        self.assertIn('alice@example.com', suppression)
+        with self.assertRaises(promailgate_client.errors.RecipientSuppressedError):
+            suppression.check('ALICE@example.com')
+
+        for recipient in ('bob', 'bob@example', 'bob@@example.com', 'bob smith@example.com'):
+            with self.assertRaises(promailgate_client.errors.InvalidRecipientError):
+                suppression.check(recipient)
+        suppression.check('bob.smith+tag@mail.example.co.uk')
+
+    def test_learn(self):
+        """Test only permanent send errors cause suppression"""
+        suppression = promailgate_client.suppression.SuppressionList()
+        suppression.learn('a@example.com', promailgate_client.errors.SendError('Send error: Recipient has unsubscribed'))
+        suppression.learn('b@example.com', promailgate_client.errors.SendError('Send error: Template not found'))
+        suppression.learn('c@example.com', promailgate_client.errors.UnknownSendError('Internal server error'))
+        self.assertEqual(len(suppression), 1)
+        self.assertIn('a@example.com', suppression)
+
+    def test_persistence(self):
+        """Test suppressions are persisted to file and reloaded"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'suppressed.tsv')
+            suppression = promailgate_client.suppression.SuppressionList(path)
+            suppression.add('alice@example.com', 'Recipient has\nunsubscribed')
+            suppression.add('alice@example.com')
+            suppression.add('bob@example.com', 'Recipient has unsubscribed', api_key='1234')
+            suppression.close()
+            with open(path) as handle:
+                self.assertEqual(handle.read(), (
+                    'alice@example.com\tRecipient has unsubscribed\n'
+                    'bob@example.com\tRecipient has unsubscribed\t%s\n'
+                    % promailgate_client.suppression.get_key_id('1234')))
+
+            suppression = promailgate_client.suppression.SuppressionList(path, bloom_capacity=1000)
+            self.assertIn('alice@example.com', suppression)
+            self.assertTrue(suppression.is_suppressed('bob@example.com', '1234'))
+            self.assertFalse(suppression.is_suppressed('bob@example.com', '5678'))
+            copied = pickle.loads(pickle.dumps(suppression))
+            self.assertIn('alice@example.com', copied)
+            suppression.close()
+            copied.close()
+
+        suppression = promailgate_client.suppression.SuppressionList()
+        suppression.add('bob@example.com')
+        self.assertIn('bob@example.com', pickle.loads(pickle.dumps(suppression)))
+
+
+class TestClientSuppression(TestCase):
+    """Test suppression in PromailgateClient"""
+
+    def test_send_email(self):
+        """Test client learns unsubscribed recipients and rejects them locally"""
+        suppression = promailgate_client.suppression.SuppressionList()
+        client = PromailgateClient(host='test', default_api_key='1234', suppression=suppression)
+        response = mock.MagicMock(status_code=400, content=b'{"Reason": "Recipient has unsubscribed"}')
+
+        with mock.patch('requests.Session.post', return_value=response) as mocked_request:
+            with self.assertRaises(promailgate_client.errors.SendError):
+                client.send_email('unsub@example.com')
+            self.assertTrue(suppression.is_suppressed('unsub@example.com', '1234'))
+
+            with self.assertRaises(promailgate_client.errors.RecipientSuppressedError):
+                client.send_email('unsub@example.com')
+            with self.assertRaises(promailgate_client.errors.RecipientSuppressedError):
+                client.prepare_send().send('unsub@example.com')
+            self.assertEqual(mocked_request.call_count, 1)
+
+    def test_api_keys(self):
+        """Test recipients unsubscribed from one API key are only suppressed for that API key"""
+        suppression = promailgate_client.suppression.SuppressionList()
+        client = PromailgateClient(host='test', default_api_key='1234', suppression=suppression)
+        unsubscribed = mock.MagicMock(status_code=400, content=b'{"Reason": "Recipient has unsubscribed"}')
+        sent = mock.MagicMock(status_code=201, content=b'{"message_id": "message-1"}')
+
+        with mock.patch('requests.Session.post', side_effect=[unsubscribed, sent, sent]) as mocked_request:
+            with self.assertRaises(promailgate_client.errors.SendError):
+                client.send_email('unsub@example.com')
+            self.assertEqual(client.send_email('unsub@example.com', api_key='5678'), 'message-1')
+            self.assertEqual(client.prepare_send(api_key='5678').send('unsub@example.com'), 'message-1')
+            with self.assertRaises(promailgate_client.errors.RecipientSuppressedError):
+                client.send_email('unsub@example.com', api_key='1234')
+            self.assertEqual(mocked_request.call_count, 3)
+
+        # Learned suppressions apply to all API keys, if per_api_key is False
+        suppression = promailgate_client.suppression.SuppressionList(per_api_key=False)
+        client = PromailgateClient(host='test', default_api_key='1234', suppression=suppression)
+        with mock.patch('requests.Session.post', return_value=unsubscribed) as mocked_request:
+            with self.assertRaises(promailgate_client.errors.SendError):
+                client.send_email('unsub@example.com')
+            with self.assertRaises(promailgate_client.errors.RecipientSuppressedError):
+                client.send_email('unsub@example.com', api_key='5678')
+            self.assertEqual(mocked_request.call_count, 1)
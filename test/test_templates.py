@@ -0,0 +1,97 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+from json import loads
+from unittest import mock, TestCase
+
+from promailgate_client import PromailgateClient
+import promailgate_client.errors
+import promailgate_client.serializers
+
+
+class TestSendTemplate(TestCase):
+    """Test SendTemplate class"""
+
+    def _get_clients(self):
+        """Return clients using each available serializer"""
+        clients = [PromailgateClient(
+            host='test', default_api_key='1234',
+            serializer=promailgate_client.serializers.JsonSerializer())]
+        if promailgate_client.serializers.orjson is not None:
+            clients.append(PromailgateClient(
+                host='test', default_api_key='1234',
+                serializer=promailgate_client.serializers.OrjsonSerializer()))
+        return clients
+
+    def test_encode(self):
+        """Test encoded body matches payload built by send_email"""
+        for client in self._get_clients():
+            template = client.prepare_send(data={'campaign': 'spring', 'names': ['a', 'b']}, return_id=False)
+            self.assertEqual(template.api_key, '1234')
+
+            self.assertEqual(loads(template.encode('alice@example.com')), {
+                'api_key': '1234', 'recipient': 'alice@example.com', 'return_id': False,
+                'data': {'campaign': 'spring', 'names': ['a', 'b']}})
+
+            self.assertEqual(loads(template.encode('bob@example.com', data={'name': 'Bob "B"'})), {
+                'api_key': '1234', 'recipient': 'bob@example.com', 'return_id': False,
+                'data': {'campaign': 'spring', 'names': ['a', 'b'], 'name': 'Bob "B"'}})
+
+            # Ensure per-recipient data overrides common data
+            self.assertEqual(loads(template.encode('bob@example.com', data={'campaign': 'autumn'}))['data'], {
+                'campaign': 'autumn', 'names': ['a', 'b']})
+
+            # Ensure empty common data
+            template = client.prepare_send(api_key='other-key')
+            self.assertEqual(loads(template.encode('bob@example.com', data={'name': 'Bob'})), {
+                'api_key': 'other-key', 'recipient': 'bob@example.com', 'return_id': True,
+                'data': {'name': 'Bob'}})
+
+            with self.assertRaises(promailgate_client.errors.NoRecipientProvidedError):
+                template.encode('')
+
+    def test_pre_encoded_data(self):
+        """Test template with pre-encoded common data"""
+        client = PromailgateClient(host='test', default_api_key='1234')
+        template = client.prepare_send(data=b' {"campaign": "spring"} ')
+        self.assertEqual(loads(template.encode('alice@example.com', data={'name': 'Alice'}))['data'], {
+            'campaign': 'spring', 'name': 'Alice'})
+
+        template = client.prepare_send(data=b'{ }')
+        self.assertEqual(loads(template.encode('alice@example.com', data={'name': 'Alice'}))['data'], {
+            'name': 'Alice'})
+
+        with self.assertRaises(ValueError):
+            client.prepare_send(data=b'[1, 2]')
+
+    def test_no_api_key(self):
+        """Test prepare_send requires an API key"""
+        client = PromailgateClient(host='test')
+        with self.assertRaises(promailgate_client.errors.NoApiKeyProvidedError):
+            client.prepare_send()
+
+    def test_send(self):
+        """Test sending using template"""
+        client = PromailgateClient(host='test', default_api_key='1234')
+        template = client.prepare_send(data={'campaign': 'spring'})
+
+        response = mock.MagicMock(status_code=201, content=b'{"status": "OK", "message_id": "test-id"}')
+        with mock.patch('requests.Session.post', return_value=response) as mocked_request:
+            self.assertEqual(template.send('alice@example.com', data={'name': 'Alice'}), 'test-id')
+            mocked_request.assert_called_once_with(
+                'https://test/api/message/send',
+                data=mock.ANY,
+                headers={'Content-type': 'application/json'}, verify=True,
+                timeout=(10.0, 30.0)
+            )
+            self.assertEqual(loads(mocked_request.call_args[1]['data'])['data'], {
+                'campaign': 'spring', 'name': 'Alice'})
+
+            results = list(client.send_many(
+                [{'recipient': 'user%s@example.com' % i, 'data': {'i': i}} for i in range(5)],
+                template=template))
+            self.assertTrue(all(result.message_id == 'test-id' for result in results))
+            self.assertEqual(mocked_request.call_count, 6)
@@ -0,0 +1,84 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import threading
+from unittest import mock, TestCase
+
+from promailgate_client import PromailgateClient
+import promailgate_client.errors
+import promailgate_client.tracker
+
+
+class TestStatusTracker(TestCase):
+    """Test StatusTracker class"""
+
+    def test_is_terminal_status(self):
+        """Test is_terminal_status"""
+        self.assertFalse(promailgate_client.tracker.is_terminal_status({'MessageStatus': 'PENDING'}))
+        self.assertTrue(promailgate_client.tracker.is_terminal_status({'MessageStatus': 'SENT'}))
+        self.assertTrue(promailgate_client.tracker.is_terminal_status({'MessageStatus': 'UNKNOWN_ERROR'}))
+
+    def test_track(self):
+        """Test that only transitions are yielded and messages are dropped once final"""
+        client = PromailgateClient(host='test')
+        polls = {}
+        lock = threading.Lock()
+
+        # Sequence of states returned for each poll of each message
+        states = {
+            'msg-1': ['PENDING', 'PENDING', 'SENDING', 'SENT'],
+            'msg-2': ['SENT'],
+            'msg-3': [promailgate_client.errors.UnknownServerError('Unknown server error'), 'PENDING', 'UNKNOWN_ERROR'],
+            'msg-4': [promailgate_client.errors.NoSuchMessageError('No such message')],
+        }
+
+        def mocked_get_message_status(message_id):
+            with lock:
+                count = polls.get(message_id, 0)
+                polls[message_id] = count + 1
+            state = states[message_id][count]
+            if isinstance(state, Exception):
+                raise state
+            return {'MessageStatus': state, 'external_id': 'ext-%s' % message_id}
+
+        tracker = promailgate_client.tracker.StatusTracker(
+            client, ['msg-1', 'msg-2', 'msg-3', 'msg-4'], concurrency=2,
+            min_interval=0.001, max_interval=0.01)
+        self.assertEqual(len(tracker), 4)
+
+        with mock.patch.object(client, 'get_message_status', side_effect=mocked_get_message_status):
+            updates = list(tracker.track())
+
+        transitions = {}
+        for update in updates:
+            transitions.setdefault(update.message_id, []).append(update.state)
+
+        self.assertEqual(transitions, {
+            'msg-1': ['PENDING', 'SENDING', 'SENT'],
+            'msg-2': ['SENT'],
+            'msg-3': ['PENDING', 'UNKNOWN_ERROR'],
+            'msg-4': [None],
+        })
+        self.assertEqual(polls, {'msg-1': 4, 'msg-2': 1, 'msg-3': 3, 'msg-4': 1})
+        self.assertEqual(len(tracker), 0)
+
+        msg_4_update = [update for update in updates if update.message_id == 'msg-4'][0]
+        self.assertTrue(msg_4_update.terminal)
+        self.assertIsInstance(msg_4_update.error, promailgate_client.errors.NoSuchMessageError)
+
+        final_update = [update for update in updates if update.message_id == 'msg-1'][-1]
+        self.assertTrue(final_update.terminal)
+        self.assertEqual(final_update.previous_status['MessageStatus'], 'SENDING')
+
+    def test_interval_backoff(self):
+        """Test that poll interval grows with time pending"""
+        tracker = promailgate_client.tracker.StatusTracker(
+            None, [], min_interval=1, max_interval=60, backoff_factor=0.5)
+        message = promailgate_client.tracker._TrackedMessage('msg-1', first_seen=100)
+
+        self.assertEqual(tracker._get_interval(message, 100), 1)
+        self.assertEqual(tracker._get_interval(message, 110), 5)
+        self.assertEqual(tracker._get_interval(message, 1000), 60)
@@ -0,0 +1,220 @@
+#  Copyright (C) Mike Norton, Matt Comben - All Rights Reserved
+#  This file is part of ProMailGate.
+#  Unauthorized copying of this file, via any medium is strictly prohibited
+#  Proprietary and confidential
+#  Written by Matt Comben <matthew@dockstudios.co.uk>, 6/2019
+
+import http.server
+import json
+import socket
+import subprocess
+import sys
+import threading
+from unittest import mock, TestCase
+
+import requests.exceptions
+
+from promailgate_client import PromailgateClient
+import promailgate_client.errors
+import promailgate_client.transport
+
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    """Handler echoing request, recording connections"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        """Record connection"""
+        super(MockHandler, self).setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        """Return 201 with message ID"""
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self._respond(201, {'message_id': json.loads(body.decode('utf-8'))['recipient']})
+
+    def do_GET(self):
+        """Return 404"""
+        self._respond(404, {'path': self.path})
+
+    def _respond(self, status, data):
+        """Send JSON response"""
+        content = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        """Disable logging"""
+        pass
+
+
+class DroppingHandler(MockHandler):
+    """Handler that closes connection without responding after reading the second request"""
+
+    def do_POST(self):
+        """Read request, then respond or close connection"""
+        self.server.requests += 1
+        if self.server.requests != 2:
+            return super(DroppingHandler, self).do_POST()
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.close_connection = True
+
+    def do_GET(self):
+        """Read request, then respond or close connection"""
+        self.server.requests += 1
+        if self.server.requests != 2:
+            return super(DroppingHandler, self).do_GET()
+        self.close_connection = True
+
+
+class TestHttpClientTransport(TestCase):
+    """Test HttpClientTransport class"""
+
+    def setUp(self):
+        """Start local server"""
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+        self.server.connections = 0
+        self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        """Stop local server"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_request(self):
+        """Test requests are performed on a persistent connection"""
+        transport = promailgate_client.transport.HttpClientTransport()
+        for index in range(3):
+            response = transport.request(
+                'POST', self.url + '/api/message/send', body=b'{"recipient": "r%s"}' % str(index).encode(),
+                headers={'Content-type': 'application/json'})
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(json.loads(response.content), {'message_id': 'r%s' % index})
+
+        response = transport.request('GET', self.url + '/api/message/status/test?a=1', timeout=(5, 5))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.content), {'path': '/api/message/status/test?a=1'})
+        self.assertEqual(self.server.connections, 1)
+        transport.close()
+
+    def test_stale_connection(self):
+        """Test request is retried on a new connection when a pooled connection was closed"""
+        transport = promailgate_client.transport.HttpClientTransport()
+        self.assertEqual(transport.request('GET', self.url + '/').status_code, 404)
+
+        # Close pooled connection from client side, as if closed by server
+        pool = transport._pools[('http', '127.0.0.1', self.server.server_address[1], True)]
+        connection = pool.queue[0]
+        connection.sock.shutdown(socket.SHUT_RDWR)
+
+        self.assertEqual(transport.request('GET', self.url + '/').status_code, 404)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_dropped_after_request(self):
+        """Test request that is not idempotent is not sent again when connection is dropped after it was read"""
+        self.server.RequestHandlerClass = DroppingHandler
+        self.server.requests = 0
+        client = PromailgateClient(url=self.url, default_api_key='1234', transport='http.client')
+        self.assertEqual(client.send_email('alice@example.com'), 'alice@example.com')
+        with self.assertRaises(promailgate_client.errors.TransportError):
+            client.send_email('bob@example.com')
+        self.assertEqual(self.server.requests, 2)
+        client.close()
+
+        # Idempotent requests are sent again on a new connection
+        self.server.requests = 0
+        transport = promailgate_client.transport.HttpClientTransport()
+        self.assertEqual(transport.request('GET', self.url + '/').status_code, 404)
+        self.assertEqual(transport.request('GET', self.url + '/').status_code, 404)
+        self.assertEqual(self.server.requests, 3)
+        transport.close()
+
+    def test_connection_error(self):
+        """Test failures to connect are raised as TransportConnectError"""
+        # Stop serving first, as the listening socket is not released whilst the server is polling it
+        self.server.shutdown()
+        self.server.server_close()
+        transport = promailgate_client.transport.HttpClientTransport()
+        with self.assertRaises(promailgate_client.errors.TransportConnectError):
+            transport.request('GET', self.url + '/', timeout=1)
+
+    def test_warmup(self):
+        """Test warmup opens pooled connections"""
+        client = PromailgateClient(
+            endpoints=[self.url], default_api_key='1234', transport='http.client', pool_maxsize=2, connect_timeout=3)
+        client.warmup(connections=3)
+        pool = client._get_transport()._pools[('http', '127.0.0.1', self.server.server_address[1], True)]
+        self.assertEqual(pool.qsize(), 2)
+        # Ensure connections are opened with the client's connect timeout
+        self.assertEqual([connection.timeout for connection in pool.queue], [3, 3])
+
+        self.assertEqual(client.send_email('alice@example.com'), 'alice@example.com')
+        self.assertEqual(self.server.connections, 2)
+        client.close()
+
+    def test_client(self):
+        """Test client using http.client transport"""
+        client = PromailgateClient(url=self.url, default_api_key='1234', transport='http.client')
+        self.assertIsInstance(client._get_transport(), promailgate_client.transport.HttpClientTransport)
+        self.assertEqual(client.send_email('alice@example.com'), 'alice@example.com')
+        with self.assertRaises(promailgate_client.errors.NoSuchMessageError):
+            client.get_message_status('test-id')
+        client.close()
+
+        with self.assertRaises(ValueError):
+            PromailgateClient(url=self.url, transport='urllib')
+
+
+class TestLazyImport(TestCase):
+    """Test transport dependencies are imported on first use"""
+
+    def test_lazy_import(self):
+        """Test importing and creating client does not import requests or http.client"""
+        code = (
+            'import sys\n'
+            'import promailgate_client\n'
+            'client = promailgate_client.PromailgateClient(host="test", default_api_key="1234")\n'
+            'print(" ".join(name for name in ("requests", "http.client", "concurrent.futures") if name in sys.modules))\n'
+            'client.warmup()\n'
+            'print("requests" in sys.modules)\n'
+        )
+        output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+        self.assertEqual(output.splitlines(), ['', 'True'])
+
+
+class TestRequestsTransport(TestCase):
+    """Test RequestsTransport class"""
+
+    def test_errors(self):
+        """Test requests exceptions are raised as TransportError"""
+        transport = promailgate_client.transport.RequestsTransport()
+        with mock.patch('requests.Session.get', side_effect=requests.exceptions.ConnectTimeout()):
+            with self.assertRaises(promailgate_client.errors.TransportTimeoutError):
+                transport.request('GET', 'http://test/')
+        with mock.patch('requests.Session.post', side_effect=requests.exceptions.ConnectionError()):
+            with self.assertRaises(promailgate_client.errors.TransportError) as context:
+                transport.request('POST', 'http://test/', body=b'{}')
+            self.assertNotIsInstance(context.exception, promailgate_client.errors.TransportConnectError)
+
+        # Ensure failures to connect are raised as TransportConnectError
+        with self.assertRaises(promailgate_client.errors.TransportConnectError):
+            transport.request('POST', 'http://127.0.0.1:1/', body=b'{}')
+        with mock.patch('requests.Session.get', side_effect=requests.exceptions.ConnectTimeout()):
+            with self.assertRaises(promailgate_client.errors.TransportConnectTimeoutError):
+                transport.request('GET', 'http://test/')
+
+    def test_custom_transport(self):
+        """Test client uses provided transport"""
+        transport = mock.MagicMock(spec=promailgate_client.transport.Transport)
+        transport.request.return_value = promailgate_client.transport.Response(200, b'')
+        client = PromailgateClient(host='test', default_api_key='1234', transport=transport)
+        self.assertTrue(client.send_email('alice@example.com', return_id=False))
+        transport.request.assert_called_once_with(
+            'POST', 'https://test/api/message/send', headers={'Content-type': 'application/json'},
+            body=mock.ANY, verify=True, timeout=(10.0, 30.0))
+        client.close()
+        transport.close.assert_called_once_with()